@@ -1,8 +1,19 @@
+import threading
+import time
+import uuid
+from unittest import mock, skipUnless
+import requests
+
 from django.test import TestCase, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from users.models import Author
 from friendship.models import Friend
-from posts.models import Post
+from posts.models import Post, Category, VisibleTo
+from comments.models import Comment
 from django.urls import reverse
+from nodes.models import Node
+from posts.federation import clear_foreign_author_posts
 
 
 class TestViews(TestCase):
@@ -36,6 +47,32 @@ class TestViews(TestCase):
         response = self.client.get(self.retrieve_author_profile_url)
         self.assertTrue(response.status_code == 404)
 
+    # test for conditional GETs of service/author/<str:author_id>/
+    def test_retrieve_author_profile_not_modified(self):
+        self.test_author.is_active = 1
+        self.test_author.save()
+        response = self.client.get(self.retrieve_author_profile_url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.retrieve_author_profile_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # Only the author is looked up, their friends are not
+        self.assertFalse([query for query in queries if 'friendship_friend' in query['sql']])
+
+        response = self.client.get(self.retrieve_author_profile_url,
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        self.test_author.bio = "changed"
+        self.test_author.save()
+        response = self.client.get(self.retrieve_author_profile_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['bio'], "changed")
+
     # test for retrieving active author service/author/<str:author_id>/
     def test_retrieve_active_author_profile(self):
 
@@ -498,4 +535,200 @@ class TestViews(TestCase):
         Author.objects.filter(username="test_retrieve_author_profile").delete()
 
 
+class TestStreamQueries(TestCase):
+    """
+    The number of SQL statements needed for a page of the stream must not grow with the number of posts, and the
+    queries behind the stream and the comments of a post must be answered from indexes rather than full table scans
+    """
+    # Session, user, count, posts, categories, visibleTo, comments and comment authors
+    STREAM_QUERIES = 8
+
+    def setUp(self):
+        self.author = Author(username="stream_reader", email="stream@test.com", password="password",
+                             first_name="stream", last_name="reader", is_active=1, host="testserver")
+        self.author.uid = "testserver/author/" + self.author.id.hex
+        self.author.save()
+        self.category = Category.objects.create(name="stream")
+        self.client = Client(HTTP_ACCEPT="application/json")
+        self.client.force_login(self.author)
+
+    def create_posts(self, number):
+        for i in range(number):
+            post = Post.objects.create(title=f"post {i}", content="content", author=self.author,
+                                       visibility="PUBLIC", size=0)
+            post.categories.add(self.category)
+            VisibleTo.objects.create(author_uid=self.author.uid, accessed_post=post)
+            for j in range(2):
+                Comment.objects.create(content=f"comment {j}", author=self.author.uid, parentPost=post)
+
+    def count_stream_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('add_or_get_post'), {'size': 50})
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_stream_query_count_is_constant(self):
+        self.create_posts(2)
+        few_posts_queries, json_response = self.count_stream_queries()
+        self.assertEqual(len(json_response['posts']), 2)
+
+        self.create_posts(8)
+        many_posts_queries, json_response = self.count_stream_queries()
+        self.assertEqual(len(json_response['posts']), 10)
+        self.assertEqual(json_response['posts'][0]['categories'], ["stream"])
+        self.assertEqual(json_response['posts'][0]['count'], 2)
+
+        self.assertEqual(few_posts_queries, many_posts_queries)
+        self.assertEqual(many_posts_queries, self.STREAM_QUERIES)
+
+    def test_stream_pages_in_database(self):
+        self.create_posts(25)
+        seen = []
+        for page in range(1, 4):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('add_or_get_post'), {'size': 10, 'page': page})
+            json_response = response.json()
+            self.assertEqual(json_response['count'], 25)
+            seen += [post['id'] for post in json_response['posts']]
+            # Only the posts on the page are loaded
+            post_queries = [q['sql'] for q in queries.captured_queries if 'FROM "posts_post"' in q['sql']
+                            and 'COUNT(*)' not in q['sql'] and 'LIMIT' in q['sql']]
+            self.assertEqual(len(post_queries), 1)
+
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+
+    @staticmethod
+    def full_scans(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [step for step in plan if step.startswith("SCAN") and "SUBQUERY" not in step.upper()
+                and "USING INDEX" not in step and "USING COVERING INDEX" not in step
+                and "USING INTEGER PRIMARY KEY" not in step]
+
+    def assert_no_full_scans(self, url, params=None):
+        queries = []
+
+        def capture(execute, sql, sql_params, many, context):
+            queries.append((sql, sql_params))
+            return execute(sql, sql_params, many, context)
+
+        with connection.execute_wrapper(capture):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        for sql, sql_params in queries:
+            if sql.startswith("SELECT"):
+                self.assertEqual(self.full_scans(sql, sql_params), [], sql)
+
+    # The plans are SQLite's, they say nothing about how Postgres uses the indexes in production
+    @skipUnless(connection.vendor == 'sqlite', "reads SQLite query plans")
+    def test_stream_uses_indexes(self):
+        self.create_posts(3)
+        self.assert_no_full_scans(reverse('add_or_get_post'), {'size': 2, 'page': 2})
+
+    @skipUnless(connection.vendor == 'sqlite', "reads SQLite query plans")
+    def test_comments_use_indexes(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        self.assert_no_full_scans(reverse('get_or_add_comment', args=[post.id]))
+
+
+class TestForeignAuthorPosts(TestCase):
+    """
+    The posts of a foreign author are fetched in large pages at the same time, and cached
+    """
+    POST_COUNT = 120
+
+    def setUp(self):
+        clear_foreign_author_posts()
+        self.node = Node.objects.create(foreign_server_hostname="posts.node", foreign_server_username="posts.node",
+                                        foreign_server_password="password", foreign_server_api_location="posts.node")
+        self.author = Author(username="foreign_posts_reader", email="reader@test.com", password="password",
+                             first_name="reader", last_name="reader", is_active=1, host="testserver")
+        self.author.uid = "testserver/author/" + self.author.id.hex
+        self.author.save()
+        self.foreign_author = "posts.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'foreign_poster').hex
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.client = Client(HTTP_ACCEPT="application/json")
+        self.client.force_login(self.author)
+
+    def fake_request(self, node, method, url, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.1)
+        with self.lock:
+            self.in_flight -= 1
+
+        page, size = kwargs['params']['page'], kwargs['params']['size']
+        posts = [{"id": str(i), "visibility": "FRIENDS" if i % 2 else "PUBLIC", "visibleTo": []}
+                 for i in range((page - 1) * size, min(page * size, self.POST_COUNT))]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"query": "posts", "count": self.POST_COUNT, "posts": posts}
+        return response
+
+    def get_posts(self, page):
+        url = reverse('retrieve_posts_of_author_id_visible_to_current_auth_user', args=[self.foreign_author])
+        return self.client.get(url, {'size': 50, 'page': page}).json()
+
+    def test_fetch_and_filter(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request) as make_request:
+            json_response = self.get_posts(1)
+            # One page to learn the count, then the two remaining pages of 50 at the same time
+            self.assertEqual(make_request.call_count, 3)
+            self.assertEqual(self.max_in_flight, 2)
+            # Only the public posts are visible to a stranger
+            self.assertEqual(json_response['count'], self.POST_COUNT // 2)
+            self.assertEqual(len(json_response['posts']), 50)
+
+            Friend.objects.create(author_id=self.author.uid, friend_id=self.foreign_author)
+            json_response = self.get_posts(3)
+            # The author's posts were cached, and a friend sees every post
+            self.assertEqual(make_request.call_count, 3)
+            self.assertEqual(json_response['count'], self.POST_COUNT)
+            self.assertEqual([post['id'] for post in json_response['posts']], [str(i) for i in range(100, 120)])
+
+    def test_served_from_database_when_node_is_down(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            self.get_posts(1)
+        clear_foreign_author_posts()
+
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=requests.ConnectionError):
+            json_response = self.get_posts(1)
+        # The posts stored the last time the node answered are served instead
+        self.assertEqual(json_response['count'], self.POST_COUNT // 2)
+
+
+class TestAuthorListCache(TestCase):
+    """
+    The list of local authors is cached until an author changes
+    """
 
+    def setUp(self):
+        self.author = Author(username="listed_author", email="listed@test.com", password="password",
+                             first_name="listed", last_name="author", display_name="Listed", is_active=1,
+                             host="testserver")
+        self.author.uid = "testserver/author/" + self.author.id.hex
+        self.author.url = self.author.uid
+        self.author.save()
+
+    def list_authors(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('retrieve_all_authors'))
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_cached_until_author_changes(self):
+        first, first_queries = self.list_authors()
+        second, second_queries = self.list_authors()
+        self.assertEqual(first, second)
+        self.assertLess(second_queries, first_queries)
+
+        self.author.display_name = "Renamed"
+        self.author.save()
+        third, third_queries = self.list_authors()
+        self.assertEqual([author['displayName'] for author in third], ["Renamed"])
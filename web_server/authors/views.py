@@ -5,7 +5,7 @@ from django.http import HttpResponse, JsonResponse
 from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import HttpResponse, JsonResponse, QueryDict, Http404
-from users.models import Author
+from users.models import Author, ForeignAuthor, ForeignAuthorSync
 from nodes.models import Node
 from friendship.models import Friend, FriendRequest
 from posts.models import Post, Category, VisibleTo
@@ -17,9 +17,14 @@ from django.template import RequestContext
 from urllib.parse import urlparse, urlunparse
 from uuid import UUID
 from social_distribution.utils.basic_auth import validate_remote_server_authentication
+from social_distribution.utils.response_cache import cached_response_data, data_validator
 from friendship.views import FOAF_verification, sanitize_author_id
+from friendship.graph import friend_graph
+from users.foreign_authors import get_foreign_author_profile_with_age, sync_foreign_authors_in_background
+from posts.audience import refresh_post_audience, viewer_audience
+from posts.federation import fetch_foreign_author_posts
+from posts.images import store_image
 
-import math
 import html
 from django.conf import settings
 
@@ -43,59 +48,33 @@ DEFAULT_PAGE_SIZE = 10
 
 def retrieve_friends_of_author(authorid):
     response_data = []
-    foreign_author_dict = {}
-    if Friend.objects.filter(author_id=authorid).exists():
-        # get friend id from Friend table
-        friends = Friend.objects.filter(author_id=authorid)
-        # compose response data
-        nodes = Node.objects.all()
-        for node in nodes:
-            url = "http://{}/author".format(
-                node.foreign_server_api_location.rstrip("/"))
-            res = requests.get(url, auth=(
-                node.username_registered_on_foreign_server, node.password_registered_on_foreign_server))
-            if res.status_code >= 200 and res.status_code < 300:
-                try:
-                    foreign_authors = res.json()
-                    for foreign_author in foreign_authors:
-                        # strip protocol and trailing slash
-                        stripped_foreign_author_id = url_regex.sub(
-                            "", foreign_author["id"].rstrip("/"))
-
-                        # remove - from UUID
-                        try:
-                            stripped_foreign_author_id_splits = stripped_foreign_author_id.rsplit(
-                                "/", 1)
-                            stripped_foreign_author_id = stripped_foreign_author_id_splits[0] + \
-                                "/" + \
-                                UUID(stripped_foreign_author_id_splits[1]).hex
-
-                        except:
-                            pass
-
-                        if stripped_foreign_author_id not in foreign_author_dict:
-                            foreign_author_dict[stripped_foreign_author_id] = foreign_author
-
-                except:
-                    continue
-
-        for friend in friends:
-            entry = {}
-            if Author.objects.filter(uid=friend.friend_id).exists():
-                friend = Author.objects.get(pk=friend.friend_id)
-                entry['id'] = friend.uid
-                entry['host'] = friend.host
-                entry['displayName'] = friend.display_name
-                entry['url'] = friend.url
-                entry['firstName'] = friend.first_name
-                entry['lastName'] = friend.last_name
-                response_data.append(entry)
-            elif friend.friend_id in foreign_author_dict:
-                entry['id'] = foreign_author_dict[friend.friend_id]['id']
-                entry['host'] = foreign_author_dict[friend.friend_id]['host']
-                entry['displayName'] = foreign_author_dict[friend.friend_id]['displayName']
-                entry['url'] = foreign_author_dict[friend.friend_id]['url']
-                response_data.append(entry)
+    # get friend id from Friend table
+    friend_ids = list(Friend.objects.filter(author_id=authorid).values_list('friend_id', flat=True))
+    if len(friend_ids) == 0:
+        return response_data
+
+    # compose response data, foreign friends come from the foreign author directory
+    sync_foreign_authors_in_background()
+    local_authors = Author.objects.in_bulk(friend_ids)
+    foreign_authors = ForeignAuthor.objects.in_bulk([sanitize_author_id(friend_id) for friend_id in friend_ids])
+    for friend_id in friend_ids:
+        entry = {}
+        if friend_id in local_authors:
+            friend = local_authors[friend_id]
+            entry['id'] = friend.uid
+            entry['host'] = friend.host
+            entry['displayName'] = friend.display_name
+            entry['url'] = friend.url
+            entry['firstName'] = friend.first_name
+            entry['lastName'] = friend.last_name
+            response_data.append(entry)
+        elif sanitize_author_id(friend_id) in foreign_authors:
+            foreign_author = foreign_authors[sanitize_author_id(friend_id)].to_api_object()
+            entry['id'] = foreign_author.get('id')
+            entry['host'] = foreign_author.get('host')
+            entry['displayName'] = foreign_author.get('displayName')
+            entry['url'] = foreign_author.get('url')
+            response_data.append(entry)
     return response_data
 
 
@@ -116,20 +95,24 @@ response:
 def return_all_authors_registered_on_local_server(request):
     if request.method != 'GET':
         return HttpResponse("Method Not Allowed", status=405)
-    authors = Author.objects.filter(is_active=1).filter(is_superuser=0)
-    data = []
-    for author in authors:
-        each = {}
-        each['id'] = "https://" + author.uid
-        each['host'] = "https://" + author.host
-        each['url'] = "https://" + author.url
-        each['displayName'] = author.display_name
-        each['firstName'] = author.first_name
-        each['lastName'] = author.last_name
-        # each['friends'] = retrieve_friends_of_author(author.uid) # uncomment if should return friend list
-        data.append(each)
-
-    return JsonResponse(data, safe=False, status=200)
+
+    def build():
+        authors = Author.objects.filter(is_active=1).filter(is_superuser=0)
+        data = []
+        for author in authors:
+            each = {}
+            each['id'] = "https://" + author.uid
+            each['host'] = "https://" + author.host
+            each['url'] = "https://" + author.url
+            each['displayName'] = author.display_name
+            each['firstName'] = author.first_name
+            each['lastName'] = author.last_name
+            # each['friends'] = retrieve_friends_of_author(author.uid) # uncomment if should return friend list
+            data.append(each)
+        return data
+
+    # Nodes poll this constantly, the authors are only listed again once one of them has changed
+    return JsonResponse(cached_response_data(request, "authors", build), safe=False, status=200)
 
 
 """
@@ -165,29 +148,20 @@ def view_list_of_available_authors_to_befriend(request, author_id):
         entry["host"] = each.host
         entry["url"] = each.url
         response_data["available_authors_to_befriend"].append(entry)
-    # query foreign users
-    nodes = Node.objects.all()
-    for node in nodes:
-        url = "http://{}/author".format(node.foreign_server_api_location)
-        res = requests.get(url, auth=(
-            node.username_registered_on_foreign_server, node.password_registered_on_foreign_server))
-        if res.status_code >= 200 and res.status_code < 300:
-            # We cannot trust that the server will return a valid json list. Sanitize
-            try:
-                res_json = res.json()
-                response_data["available_authors_to_befriend"] = response_data["available_authors_to_befriend"] + res.json()
-            except Exception as e:
-                response_data['errors'][node.get_safe_api_url(
-                )] = f"Could not parse json response, exception: {e}"
+    # foreign users come from the foreign author directory
+    sync_foreign_authors_in_background()
+    for foreign_author in ForeignAuthor.objects.all():
+        response_data["available_authors_to_befriend"].append(foreign_author.to_api_object())
+    for sync in ForeignAuthorSync.objects.exclude(error='').select_related('node'):
+        response_data['errors'][sync.node.get_safe_api_url()] = f"Could not refresh authors of node: {sync.error}"
     # if author has no friends
-    if not Friend.objects.filter(author_id=author_id).exists():
+    existing_friends_set = friend_graph.friends_of(author_id)
+    if not existing_friends_set:
         return JsonResponse(response_data, status=200)
 
-    existing_friends = Friend.objects.filter(author_id=author_id)
-    existing_friends_set = set([each.friend_id for each in existing_friends])
     available_authors_to_friend = []
     for each in response_data["available_authors_to_befriend"]:
-        if not url_regex.sub('', each['id']) in existing_friends_set:
+        if not sanitize_author_id(each['id']) in existing_friends_set:
             available_authors_to_friend.append(each)
     response_data["available_authors_to_befriend"] = available_authors_to_friend
 
@@ -342,42 +316,13 @@ def retrieve_universal_author_profile(request, author_id):
     if current_host == author_host:
         return redirect('retrieve_author_profile', author_id=splits[2])
     # it's foreign author
-    if Node.objects.filter(foreign_server_hostname=author_host).exists():
-        node = Node.objects.get(pk=author_host)
-        try:
-            author_id_splits = author_id.rsplit("/", 1)
-            author_uuid = UUID(author_id_splits[1])
-            # first try /author/authorid with UUID dash
-            url = "http://{}/{}".format(author_id_splits[0], str(author_uuid))
-            res = requests.get(url)
-            if res.status_code >= 200 and res.status_code < 300:
-                try:
-                    foreign_friend = res.json()
-                    return JsonResponse(foreign_friend, status=200)
-                except:
-                    return HttpResponse("Wrong Format Foreign Server Response", status=404)
-            else:
-                # try /author/authorid without UUID dash
-                url = "http://{}/{}".format(
-                    author_id_splits[0], author_uuid.hex)
-                res = requests.get(url)
-                if res.status_code >= 200 and res.status_code < 300:
-                    try:
-                        foreign_friend = res.json()
-                        return JsonResponse(foreign_friend, status=200)
-                    except:
-                        return HttpResponse("Wrong Format Foreign Server Response", status=404)
-        except:
-            url = "http://{}".format(author_id)
-            res = requests.get(url)
-            if res.status_code >= 200 and res.status_code < 300:
-                try:
-                    foreign_friend = res.json()
-                    return JsonResponse(foreign_friend, status=200)
-                except:
-                    return HttpResponse("Wrong Format Foreign Server Response", status=404)
-
-    return HttpResponse("Can't Retrieve Foreign Author's Information", status=404)
+    (status_code, foreign_friend), age = get_foreign_author_profile_with_age(author_id)
+    if status_code == 200:
+        # Seconds since the profile was fetched from the foreign server
+        response = JsonResponse(dict(foreign_friend, age=int(age)), status=200)
+        response['Age'] = int(age)
+        return response
+    return HttpResponse(foreign_friend, status=404)
 
 
 """
@@ -405,6 +350,8 @@ def retrieve_author_profile(request, author_id):
         # only active authors are retrivable
         author = get_object_or_404(
             Author.objects.filter(is_active=1), uid=author_id)
+
+    def get_profile(request):
         response_data = {}
         response_data['id'] = author.uid
         response_data['host'] = author.host
@@ -419,7 +366,11 @@ def retrieve_author_profile(request, author_id):
         response_data['bio'] = author.bio
         return JsonResponse(response_data)
 
-    return HttpResponse("You can only GET the URL", status=405)
+    # The profile only changes along with the author or their friends, so repeated polls can be answered with 304.
+    # Other methods are refused by the Endpoint.
+    return Endpoint(request, None, [
+        Handler('GET', 'application/json', get_profile, requires_authentication=False, validator=data_validator)
+    ]).resolve()
 
 
 @validate_remote_server_authentication()
@@ -484,8 +435,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
                 })
 
             new_post.contentType = allowed_file_type_map[file_type]
-            new_post.content = base64.b64encode(
-                request.FILES['file'].read()).decode('utf-8')
+            new_post.image_hash = store_image(request.FILES['file'].read())
         else:
             new_post.contentType = post['contentType']  # : "text/plain",
             if (post['contentType'] != "text/markdown"):
@@ -530,6 +480,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
         for uid in uids:
             visible_to = VisibleTo(author_uid=uid, accessed_post=new_post)
             visible_to.save()
+        refresh_post_audience(new_post)
 
         # Categories is commented out because it's not yet in the post data, uncomment once available
         for category in post['categories'].split('\r\n'):
@@ -561,7 +512,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
             "query": "posts",
             "count": pager.count,
             "size": size,
-            "posts": [post.to_api_object() for post in posts]
+            "posts": [post.to_api_object() for post in posts if not post.image_lost()]
         }
         (prev_uri, next_uri) = pagination_uris
         if prev_uri:
@@ -572,105 +523,26 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
 
     # Response for a local user, will get all the posts that the user can see, including friends, and foaf
     def retrieve_posts(request):
-        # own post
-        own_post = Post.objects.filter(
-            author_id=request.user.uid, unlisted=False)
-
-        # visibility =  PUBLIC
-        public_post = Post.objects.filter(visibility="PUBLIC", unlisted=False)
-
-        # visibility = FRIENDS
-        users_friends = []
-        friends = Friend.objects.filter(author_id=request.user.uid)
-        for friend in friends:
-            users_friends.append(friend.friend_id)
-        friend_post = Post.objects.filter(
-            author__in=users_friends, visibility="FRIENDS", unlisted=False)
-
-        # visibility = FOAF
-        FOAF_post = Post.objects.filter(visibility="FOAF", unlisted=False)
-        foaf_post_id = []
-        for post in FOAF_post:
-            if FOAF_verification(request, post.author.uid):
-                foaf_post_id.append(post.id)
-        foaf_post = Post.objects.filter(id__in=foaf_post_id)
-
-        # visibility = PRIVATE
-        private_post = Post.objects.filter(
-            visibleTo__author_uid__contains=request.user.uid,
-            unlisted=False)
-
-        # visibility = SERVERONLY
-        local_host = request.user.host
-        server_only_post = Post.objects.filter(
-            author__host=local_host, visibility="SERVERONLY", unlisted=False)
-
-        visible_post = public_post | foaf_post | friend_post | private_post | server_only_post | own_post
-
-        visible_post = visible_post.distinct()
-
-        array_of_posts = []
-        count = visible_post.count()
+        # Own, public, server only, friends, FOAF and private posts are all precomputed in the post audience
+        visible_post = Post.objects.filter(audience__viewer__in=viewer_audience(request.user), unlisted=False)
+
+        # Load each post's author, categories and visibleTo along with the posts rather than one post at a time
+        visible_post = visible_post.distinct().select_related(
+            'author').prefetch_related('categories', 'visibleTo')
 
         page_num = int(request.GET.get('page', "1"))
         size = min(int(request.GET.get('size', DEFAULT_PAGE_SIZE)), 50)
 
-        for post in visible_post.order_by("-published"):
-            author_id = Author.objects.get(uid=post.author_id)
-
-            author_info = {
-                "id": "http://" + str(author_id.uid),
-                "email": str(author_id.email),
-                "bio": str(author_id.bio),
-                "host": str(author_id.host),
-                "firstName": str(author_id.first_name),
-                "lastName": str(author_id.last_name),
-                "displayName": str(author_id.display_name),
-                "url": str(author_id.url),
-                "github": str(author_id.github)
-            }
-
-            categories = Category.objects.filter(post=post.id)
-            categories_list = []
-            for c in categories:
-                categories_list.append(c.name)
-
-            visible_to = post.visibleTo.all()
-            visible_to_list = []
-            for visible in visible_to:
-                visible_to_list.append(visible.author_uid)
-
-            host = request.get_host()
-            if request.is_secure():
-                host = "https://" + host
-            else:
-                host = "http://" + host
-
-            next_http = "{}/posts/{}/comments".format(host, post.id)
-            comment_size, comments = get_comments(post.id)
-            array_of_posts.append({
-                "id": str(post.id),
-                "title": str(post.title),
-                "source": str(post.source),
-                "origin": str(post.origin),
-                "description": str(post.description),
-                "contentType": str(post.contentType),
-                "content": str(post.content),
-                "author": author_info,
-                "categories": categories_list,
-                "count": int(comment_size),  # count of comment
-                "size": int(size),
-                "next": str(next_http),
-                "comments": comments,  # return ~5
-                "published": "{}+{}".format(post.published.strftime('%Y-%m-%dT%H:%M:%S'),
-                                            str(post.published).split("+")[-1]),
-                "visibility": str(post.visibility),
-                "visibleTo": visible_to_list,
-                "unlisted": post.unlisted
-            })
-
-        pager = Paginator(array_of_posts, size)
+        host = request.get_host()
+        if request.is_secure():
+            host = "https://" + host
+        else:
+            host = "http://" + host
 
+        # Page in the database and only serialize the requested page. The id breaks ties between posts published
+        # at the same moment so that pages never overlap or skip a post.
+        pager = Paginator(visible_post.order_by("-published", "-id"), size)
+        count = pager.count
         uri = request.build_absolute_uri()
 
         if page_num > pager.num_pages:
@@ -686,6 +558,8 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
 
         current_page = pager.page(page_num)
 
+        array_of_posts = visible_posts_to_api_objects(list(current_page.object_list), host, size)
+
         if current_page.has_previous() and current_page.has_next():
             response_data = {
                 "query": "posts",
@@ -693,7 +567,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
                 "size": int(size),
                 "next": str(get_page_url(uri, current_page.next_page_number())),
                 "previous": str(get_page_url(uri, current_page.previous_page_number())),
-                "posts": current_page.object_list
+                "posts": array_of_posts
             }
 
         elif not current_page.has_next() and not current_page.has_previous():
@@ -701,7 +575,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
                 "query": "posts",
                 "count": int(count),
                 "size": int(size),
-                "posts": current_page.object_list
+                "posts": array_of_posts
             }
         elif not current_page.has_next():
             response_data = {
@@ -709,7 +583,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
                 "count": int(count),
                 "size": int(size),
                 "previous": str(get_page_url(uri, current_page.previous_page_number())),
-                "posts": current_page.object_list
+                "posts": array_of_posts
             }
         elif not current_page.has_previous():
             response_data = {
@@ -717,7 +591,7 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
                 "count": int(count),
                 "size": int(size),
                 "next": str(get_page_url(uri, current_page.next_page_number())),
-                "posts": current_page.object_list
+                "posts": array_of_posts
             }
 
         return JsonResponse(response_data)
@@ -762,19 +636,97 @@ def post_creation_and_retrieval_to_curr_auth_user(request):
 
 
 def get_comments(post_id):
-    comments_list = []
-    comments = Comment.objects.filter(
-        parentPost=post_id).order_by("-published")[:5]
+    return get_comments_of_posts([post_id])[post_id]
 
 
-    for comment in comments:
-        c = comment.to_api_object()
-        if 'error' not in c['author']:
-            comments_list.append(c)
+def visible_posts_to_api_objects(posts, host, size, inline_images=True):
+    """
+    Serializes a page of posts for the stream of the authenticated user, along with their 5 newest comments.
+    The posts should have been loaded with select_related('author') and prefetch_related('categories', 'visibleTo')
+    :param host: the scheme and host of this server, used to link to each post's comments
+    :param size: the page size reported in each post
+    :param inline_images: if False, image posts link to resized variants of their image under "image" and
+                          "thumbnail" instead of carrying the original in content
+    """
+    array_of_posts = []
+    comments_of_posts = get_comments_of_posts([post.id for post in posts])
+    for post in posts:
+        if inline_images and post.image_lost():
+            # Left out rather than failing the page, linked images just 404 (see posts.views.image_response)
+            continue
+        author_id = post.author
+
+        author_info = {
+            "id": "http://" + str(author_id.uid),
+            "email": str(author_id.email),
+            "bio": str(author_id.bio),
+            "host": str(author_id.host),
+            "firstName": str(author_id.first_name),
+            "lastName": str(author_id.last_name),
+            "displayName": str(author_id.display_name),
+            "url": str(author_id.url),
+            "github": str(author_id.github)
+        }
 
-    size = len(comments_list)
+        categories_list = [c.name for c in post.categories.all()]
+
+        visible_to_list = [visible.author_uid for visible in post.visibleTo.all()]
+
+        next_http = "{}/posts/{}/comments".format(host, post.id)
+        comment_size, comments = comments_of_posts[post.id]
+        api_post = {
+            "id": str(post.id),
+            "title": str(post.title),
+            "source": str(post.source),
+            "origin": str(post.origin),
+            "description": str(post.description),
+            "contentType": str(post.contentType),
+            # Without inline images the image is only linked below
+            "content": post.api_content() if inline_images or not post.image_hash else "",
+            "author": author_info,
+            "categories": categories_list,
+            "count": int(comment_size),  # count of comment
+            "size": int(size),
+            "next": str(next_http),
+            "comments": comments,  # return ~5
+            "published": "{}+{}".format(post.published.strftime('%Y-%m-%dT%H:%M:%S'),
+                                        str(post.published).split("+")[-1]),
+            "visibility": str(post.visibility),
+            "visibleTo": visible_to_list,
+            "unlisted": post.unlisted
+        }
+        if post.image_hash and not inline_images:
+            api_post["image"] = reverse('post_image_variant', args=[post.id.hex, post.image_hash, 'feed'])
+            api_post["thumbnail"] = reverse('post_image_variant', args=[post.id.hex, post.image_hash, 'thumbnail'])
+        array_of_posts.append(api_post)
 
-    return size, comments_list
+    return array_of_posts
+
+
+def get_comments_of_posts(post_ids):
+    """
+    Batched get_comments, gets the 5 newest comments of every post at once.
+    All the comments are loaded with a single query, and their authors are resolved together.
+    Returns a dict from post id to (size, comments_list)
+    """
+    newest_comments = {post_id: [] for post_id in post_ids}
+    for comment in Comment.objects.filter(parentPost__in=post_ids).order_by("-published"):
+        if len(newest_comments[comment.parentPost_id]) < 5:
+            newest_comments[comment.parentPost_id].append(comment)
+
+    comment_authors = Comment.resolve_authors(
+        [comment for comments in newest_comments.values() for comment in comments])
+
+    output = {}
+    for post_id, comments in newest_comments.items():
+        comments_list = []
+        for comment in comments:
+            c = comment.to_api_object(comment_authors)
+            if 'error' not in c['author']:
+                comments_list.append(c)
+        output[post_id] = (len(comments_list), comments_list)
+
+    return output
 
 
 # https://stackoverflow.com/questions/5755150/altering-one-query-parameter-in-a-url-django
@@ -857,6 +809,7 @@ def post_edit_and_delete(request, post_id):
         for vt in visible_to_list:
             vt.accessed_post = post
             vt.save()
+        refresh_post_audience(post)
 
         return JsonResponse({"success": "Post updated"})
 
@@ -888,7 +841,7 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
             "query": "posts",
             "count": pager.count,
             "size": size,
-            "posts": [post.to_api_object() for post in posts]
+            "posts": [post.to_api_object() for post in posts if not post.image_lost()]
         }
         (prev_uri, next_uri) = pagination_uris
         if prev_uri:
@@ -915,26 +868,17 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
             page_num = int(request.GET.get('page', "1"))
             size = min(int(request.GET.get('size', DEFAULT_PAGE_SIZE)), 50)
 
-            request_size = 10
             diff_node = Node.objects.get(foreign_server_hostname=node)
-            username = diff_node.username_registered_on_foreign_server
-            password = diff_node.password_registered_on_foreign_server
-            api = diff_node.foreign_server_api_location
-            if diff_node.append_slash:
-                api = api + "/"
 
             # Quick fix for dsnfof node to allow viewing authors posts
             api_author_id = author_id
             if node == 'dsnfof.herokuapp.com':
                 api_author_id = api_author_id.split('/')[-1]
 
-            response = requests.get(
-                "http://{}/author/{}/posts?size={}&page={}".format(
-                    api, api_author_id, request_size, page_num),
-                auth=(username, password)
-            )
-
-            if response.status_code != 200:
+            try:
+                total_post = fetch_foreign_author_posts(diff_node, author_id, api_author_id)
+            except (requests.RequestException, ValueError) as e:
+                print(f"Could not fetch posts of '{author_id}': {e}")
                 response_data = {
                     "query": "posts",
                     "count": 0,
@@ -944,41 +888,21 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
                 }
                 return JsonResponse(response_data)
 
-            posts_list = response.json()
-
-            # grabbing all posts
-            post_total_num = posts_list["count"]
-            page = 2
-
-            if len(posts_list["posts"]) > 0:
-                total_post = [posts_list["posts"]]
-            else:
-                total_post = []
-            total_post = total_post[0]
-
-            while page <= math.ceil(post_total_num/request_size):
-                response = requests.get(
-                    "http://{}/author/{}/posts?size={}&page={}".format(
-                        api, author_id, request_size, page),
-                    auth=(username, password)
-                )
-                posts_list = response.json()
-                add_post = posts_list["posts"]
-                total_post.append(add_post[0])
-                page = page + 1
-
-            viewable_post = []
+            # Every post is by the same author, so only check the relationship once
+            user_uid = url_regex.sub("", request.user.uid).rstrip("/")
+            is_friend = friend_graph.are_friends(request.user.uid, author_id)
+            is_foaf = is_friend or (any(post.get("visibility") == "FOAF" for post in total_post) and
+                                    FOAF_verification(request, author_id))
 
             # "PUBLIC","FOAF","FRIENDS","PRIVATE"
-            for i in range(len(total_post)):
-                if total_post[i]["visibility"] == "PUBLIC":
-                    viewable_post.append(total_post[i])
-                if total_post[i]["visibility"] == "FOAF" and FOAF_verification(request, author_id):
-                    viewable_post.append(total_post[i])
-                if total_post[i]["visibility"] == "FRIENDS" and Friend.objects.filter(author_id=url_regex.sub("", request.user.uid).rstrip("/")).filter(friend_id=author_id).exists():
-                    viewable_post.append(total_post[i])
-                if total_post[i]["visibility"] == "PRIVATE" and url_regex.sub("", request.user.uid).rstrip("/") in total_post[i]["visibleTo"]:
-                    viewable_post.append(total_post[i])
+            viewable_post = []
+            for post in total_post:
+                visibility = post.get("visibility")
+                if visibility == "PUBLIC" or \
+                        (visibility == "FOAF" and is_foaf) or \
+                        (visibility == "FRIENDS" and is_friend) or \
+                        (visibility == "PRIVATE" and user_uid in post.get("visibleTo", [])):
+                    viewable_post.append(post)
 
             count = len(viewable_post)
             pager = Paginator(viewable_post, size)
@@ -1057,7 +981,7 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
                     author=author, visibility="PUBLIC", unlisted=False)
 
                 # visibility = FRIENDS
-                if Friend.objects.filter(author_id=author_uid).filter(friend_id=user_uid).exists():
+                if friend_graph.are_friends(author_uid, user_uid):
                     friend_post = Post.objects.filter(
                         author=author, visibility__in=["FRIENDS", "FOAF"], unlisted=False)
                 else:
@@ -1082,12 +1006,14 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
 
                 visible_post = public_post | foaf_post | friend_post | private_post | server_only_post
 
-            array_of_posts = []
             count = visible_post.count()
             page_num = int(request.GET.get('page', "1"))
             size = min(int(request.GET.get('size', DEFAULT_PAGE_SIZE)), 50)
 
-            for post in visible_post.order_by("-published"):
+            # Foreign servers are sent images inline as the API expects, our own pages link to resized variants
+            inline_images = request.remote_server_authenticated
+
+            def post_to_api_object(post):
                 author = Author.objects.get(uid=post.author_id)
                 author_info = {
                     "id": "http://" + str(author.uid),
@@ -1114,14 +1040,15 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
                 next_http = "http:/{}/posts/{}/comments".format(host, post.id)
 
                 comment_size, comments = get_comments(post.id)
-                array_of_posts.append({
+                api_post = {
                     "id": str(post.id),
                     "title": str(post.title),
                     "source": str(post.source),
                     "origin": str(post.origin),
                     "description": str(post.description),
                     "contentType": str(post.contentType),
-                    "content": str(post.content),
+                    # Without inline images the image is only linked below
+            "content": post.api_content() if inline_images or not post.image_hash else "",
                     "author": author_info,
                     "categories": categories_list,
                     "count": int(comment_size),  # count of comment
@@ -1132,9 +1059,15 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
                     "visibility": str(post.visibility),
                     "visibleTo": visible_to_list,
                     "unlisted": post.unlisted
-                })
-
-            pager = Paginator(array_of_posts, size)
+                }
+                if post.image_hash and not inline_images:
+                    api_post["image"] = reverse('post_image_variant', args=[post.id.hex, post.image_hash, 'feed'])
+                    api_post["thumbnail"] = reverse('post_image_variant',
+                                                    args=[post.id.hex, post.image_hash, 'thumbnail'])
+                return api_post
+
+            # Only the posts on the requested page are serialized
+            pager = Paginator(list(visible_post.order_by("-published")), size)
             uri = request.build_absolute_uri()
 
             if page_num > pager.num_pages:
@@ -1149,6 +1082,7 @@ def retrieve_posts_of_author_id_visible_to_current_auth_user(request, author_id)
                 return JsonResponse(response_data)
 
             current_page = pager.page(page_num)
+            current_page.object_list = [post_to_api_object(post) for post in current_page.object_list]
 
             if current_page.has_previous() and current_page.has_next():
                 response_data = {
@@ -1255,11 +1189,11 @@ def friend_checking_and_retrieval_of_author_id(request, author_id):
         response_data["query"] = "friends"
         response_data["author"] = author_id
         response_data["authors"] = []
-        if Friend.objects.filter(author_id=author_id).exists():
-            for potential_friend in potential_friends:
-                potential_friend = sanitize_author_id(potential_friend)
-                if Friend.objects.filter(author_id=author_id).filter(friend_id=potential_friend).exists():
-                    response_data["authors"].append(potential_friend)
+        friends = friend_graph.friends_of(author_id)
+        for potential_friend in potential_friends:
+            potential_friend = sanitize_author_id(potential_friend)
+            if potential_friend in friends:
+                response_data["authors"].append(potential_friend)
 
         return JsonResponse(response_data, status=200)
     elif request.method == 'GET':
@@ -1310,7 +1244,7 @@ def check_if_two_authors_are_friends(request, author1_id, author2_id):
         response_data["query"] = "friends"
         response_data["authors"] = [author1_id, author2_id]
         # query friend table for friendship information
-        if Friend.objects.filter(author_id=author1_id).filter(friend_id=author2_id).exists():
+        if friend_graph.are_friends(author1_id, author2_id):
             response_data["friends"] = True
             response_data["pending"] = False
         else:
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0002_auto_20200402_1934'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parentPost', '-published'], name='comment_post_published_idx'),
+        ),
+    ]
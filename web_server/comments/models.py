@@ -1,13 +1,7 @@
 from django.db import models
 from users.models import Author
+from users.foreign_authors import prefetch_foreign_author_profiles
 from posts.models import Post
-from nodes.models import Node
-import requests
-
-
-
-
-from django.conf import settings
 
 import re
 # used for stripping url protocol
@@ -44,55 +38,59 @@ class Comment(models.Model):
 
     parentPost = models.ForeignKey(Post, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # The comments of a post, newest first
+            models.Index(fields=['parentPost', '-published'], name='comment_post_published_idx'),
+        ]
+
     def __str__(self):
         # Number of characters to include as snippet before cutting off with elipsis
         snippet_length = 15
         return f'{self.author} commented "{self.content[:snippet_length]}{"..." if len(self.content) >= snippet_length else ""}"'
 
-    def to_api_object(self):
+    def to_api_object(self, authors=None):
         """
         Returns a python object that mimics the API, ready to be converted to a JSON string for delivery.
+        :param authors: the result of Comment.resolve_authors for a list of comments containing this one. When
+            serializing many comments, resolve all their authors at once and pass them in here.
         """
         author_uid = url_regex.sub("", str(self.author)).rstrip("/")
-        try:
-            author = Author.objects.get(uid=author_uid)
-            return {
-                "author": author.to_api_object(),
-                "comment": self.content,
-                "contentType": self.contentType,
-                "published": self.published,
-                "id": str(self.id.hex)
-            }
-        except Author.DoesNotExist:
-            response = requests.get(
-                "http://{}/author/profile/{}/".format(settings.HOSTNAME, author_uid)
-            )
-            # print(response.body)
-            if response.status_code == 200:
-                author_info = response.json()
-                return {
-                    "author": {
-                        "id": author_info["id"],
-                        "host": author_info["host"],
-                        "displayName": author_info["displayName"],
-                    },
-                    "comment": self.content,
-                    "contentType": self.contentType,
-                    "published": self.published,
-                    "id": str(self.id.hex)
+        if authors is None:
+            authors = Comment.resolve_authors([self])
+        return {
+            "author": authors[author_uid],
+            "comment": self.content,
+            "contentType": self.contentType,
+            "published": self.published,
+            "id": str(self.id.hex)
+        }
+
+    @staticmethod
+    def resolve_authors(comments):
+        """
+        Resolves the authors of all the given comments in one pass. Local authors are loaded with a single query,
+        and foreign authors come from the foreign author cache, with any that are not cached fetched in parallel.
+        :return: dict from each comment's author uid (without protocol) to that author's API object. If a foreign
+            author could not be retrieved, the object has an 'error' key describing why.
+        """
+        author_uids = set(url_regex.sub("", str(comment.author)).rstrip("/") for comment in comments)
+        authors = {author.uid: author.to_api_object() for author in Author.objects.filter(uid__in=author_uids)}
+
+        foreign_author_uids = [author_uid for author_uid in author_uids if author_uid not in authors]
+        for author_uid, (status_code, author_info) in prefetch_foreign_author_profiles(foreign_author_uids).items():
+            if status_code == 200:
+                authors[author_uid] = {
+                    "id": author_info.get("id", ""),
+                    "host": author_info.get("host", ""),
+                    "displayName": author_info.get("displayName", ""),
                 }
             else:
-                return {
-                    "author": {
-                        "id": "",
-                        "host": "",
-                        "displayName": "Unknown Author",
-                        "error": f"The server returned an incorrect response while attempting to get author information"
-                                 f" for {author_uid}: {response.status_code} - {response.content}"
-                    },
-                    "comment": self.content,
-                    "contentType": self.contentType,
-                    "published": self.published,
-                    "id": str(self.id.hex)
+                authors[author_uid] = {
+                    "id": "",
+                    "host": "",
+                    "displayName": "Unknown Author",
+                    "error": f"The server returned an incorrect response while attempting to get author information"
+                             f" for {author_uid}: {status_code} - {author_info}"
                 }
-
+        return authors
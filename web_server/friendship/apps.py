@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FriendshipConfig(AppConfig):
     name = 'friendship'
+
+    def ready(self):
+        # Keeps the in-process friend graph up to date
+        import friendship.signals
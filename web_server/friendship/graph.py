@@ -0,0 +1,150 @@
+"""
+In-process index of the friend graph.
+
+Checking friendships used to cost a Friend query per pair, often inside loops. Instead every process keeps the whole
+graph in memory as maps from each (sanitized) author id to the frozensets of the ids their Friend rows point at and of
+the ids whose rows point at them, so are_friends, friends_of, friended_by and friends_of_friends do not touch the
+database.
+
+Changes made by this process are applied to the index as they are saved (see friendship.signals). Every change also
+increments FriendGraphVersion, and the index compares that counter to the version it was built from at most once
+every settings.FRIEND_GRAPH_CHECK_INTERVAL seconds, rebuilding itself when another process has changed friendships.
+
+Like the Friend queries it replaces, the index is directional: are_friends(a, b) is True only if a row from a to b
+exists, whether or not the row from b to a does (only one of them is stored for foreign authors).
+"""
+import threading
+from collections import Counter
+import time
+
+from django.conf import settings
+
+from friendship.models import Friend, FriendGraphVersion, sanitize_author_id
+
+
+class FriendGraph:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # count of the (author, friend) rows, used to know when removing a row removes the friendship
+        self._rows = None
+        self._adjacency = None
+        self._reverse = None
+        self._friends_of_friends = dict()
+        self._version = None
+        self._checked_at = None
+
+    def _load(self):
+        """
+        Returns the adjacency map, rebuilding it if it has not been built yet or if another process changed friendships
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._adjacency is not None and now - self._checked_at < settings.FRIEND_GRAPH_CHECK_INTERVAL:
+                return self._adjacency
+            # Read the version first, so that a change made while loading is seen on the next check
+            version = FriendGraphVersion.current()
+            if self._adjacency is None or version != self._version:
+                self._rebuild(version)
+            self._checked_at = now
+            return self._adjacency
+
+    def _rebuild(self, version):
+        rows = Counter()
+        friends = dict()
+        friended_by = dict()
+        for author_id, friend_id in Friend.objects.values_list('author_id', 'friend_id'):
+            author_id = sanitize_author_id(author_id)
+            friend_id = sanitize_author_id(friend_id)
+            rows[(author_id, friend_id)] += 1
+            friends.setdefault(author_id, set()).add(friend_id)
+            friended_by.setdefault(friend_id, set()).add(author_id)
+
+        self._rows = rows
+        self._adjacency = {author_id: frozenset(ids) for author_id, ids in friends.items()}
+        self._reverse = {friend_id: frozenset(ids) for friend_id, ids in friended_by.items()}
+        self._friends_of_friends = dict()
+        self._version = version
+
+    def invalidate(self):
+        """
+        Drops the index, it will be rebuilt from the database the next time it is used
+        """
+        with self._lock:
+            self._adjacency = None
+            self._reverse = None
+            self._rows = None
+            self._friends_of_friends = dict()
+
+    def record_change(self, author_id, friend_id, added):
+        """
+        Records that a Friend row was saved or deleted by this process
+        :param added: True if the row was saved, False if it was deleted
+        """
+        version = FriendGraphVersion.bump()
+        author_id = sanitize_author_id(author_id)
+        friend_id = sanitize_author_id(friend_id)
+        with self._lock:
+            if self._adjacency is None:
+                return
+            if version != self._version + 1:
+                # Someone else changed friendships since the index was built, so patching it would not be enough
+                self.invalidate()
+                return
+
+            row = (author_id, friend_id)
+            if added:
+                self._rows[row] += 1
+            elif self._rows[row] > 1:
+                self._rows[row] -= 1
+            else:
+                del self._rows[row]
+            still_friends = row in self._rows
+            for index, a, b in [(self._adjacency, author_id, friend_id), (self._reverse, friend_id, author_id)]:
+                ids = index.get(a, frozenset())
+                ids = ids | {b} if still_friends else ids - {b}
+                if ids:
+                    index[a] = ids
+                else:
+                    index.pop(a, None)
+
+            self._friends_of_friends = dict()
+            self._version = version
+
+    def are_friends(self, author_id, friend_id):
+        return sanitize_author_id(friend_id) in self.friends_of(author_id)
+
+    def friends_of(self, author_id):
+        """
+        :return: frozenset of the sanitized ids of the author's friends, the authors the author's Friend rows point at
+        """
+        return self._load().get(sanitize_author_id(author_id), frozenset())
+
+    def friended_by(self, author_id):
+        """
+        :return: frozenset of the sanitized ids of the authors whose Friend rows point at the author
+        """
+        with self._lock:
+            self._load()
+            return self._reverse.get(sanitize_author_id(author_id), frozenset())
+
+    def friends_of_friends(self, author_id):
+        """
+        :return: frozenset of the sanitized ids of every author who shares a friend with the given author, that is
+                 whose Friend rows point at one of the author's friends
+        """
+        author_id = sanitize_author_id(author_id)
+        with self._lock:
+            adjacency = self._load()
+            result = self._friends_of_friends.get(author_id)
+            if result is None:
+                result = set()
+                for friend_id in adjacency.get(author_id, frozenset()):
+                    result |= self._reverse.get(friend_id, frozenset())
+                result.discard(author_id)
+                result = frozenset(result)
+                self._friends_of_friends[author_id] = result
+            return result
+
+
+friend_graph = FriendGraph()
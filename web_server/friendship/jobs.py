@@ -0,0 +1,79 @@
+"""
+Background jobs keeping local friendships and friend requests in line with what foreign servers say about them.
+
+Foreign servers do not tell us when their authors unfriend ours or accept their requests, so we ask them. Every
+foreign friend or outgoing foreign request is checked by its own job, against the foreign server's
+https://service/author/<authorid>/friends/<authorid2> endpoint.
+"""
+from jobs.queue import enqueue, register_job
+from friendship.models import Friend, FriendRequest, url_regex
+from nodes.models import Node
+
+HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+
+
+def _foreign_node(author_id, other_id):
+    """
+    :return: the Node of other_id if it is on another server we are connected to, otherwise None
+    """
+    other_host = other_id.split("/")[0]
+    if other_host == author_id.split("/")[0]:
+        return None
+    return Node.objects.filter(foreign_server_hostname=other_host).first()
+
+
+def schedule_friendship_reconciliation(author_id):
+    """
+    Schedules checking every foreign friendship and outgoing foreign friend request of a local author
+    """
+    author_id = url_regex.sub('', author_id).rstrip("/")
+    for friend_id in Friend.objects.filter(author_id=author_id).values_list('friend_id', flat=True):
+        node = _foreign_node(author_id, friend_id)
+        if node is not None:
+            enqueue("reconcile_friendship", {"author_id": author_id, "friend_id": friend_id}, node=node,
+                    dedup_key=f"reconcile_friendship:{author_id}:{friend_id}")
+    for to_id in FriendRequest.objects.filter(from_id=author_id).values_list('to_id', flat=True):
+        node = _foreign_node(author_id, to_id)
+        if node is not None:
+            enqueue("reconcile_friend_request", {"author_id": author_id, "to_id": to_id}, node=node,
+                    dedup_key=f"reconcile_friend_request:{author_id}:{to_id}")
+
+
+@register_job("reconcile_friendship")
+def reconcile_friendship(author_id, friend_id):
+    """
+    Removes the friendship if the foreign friend's server says they are no longer friends
+    """
+    node = _foreign_node(author_id, friend_id)
+    if node is None:
+        return
+    res = node.make_request('GET', "https://{}/friends/{}".format(friend_id, author_id), headers=HEADERS)
+    res.raise_for_status()
+    res = res.json()
+    pending = res.get("pending", None)
+    if not pending and not res["friends"]:
+        Friend.objects.filter(author_id=author_id).filter(friend_id=friend_id).delete()
+        Friend.objects.filter(author_id=friend_id).filter(friend_id=author_id).delete()
+
+
+@register_job("reconcile_friend_request")
+def reconcile_friend_request(author_id, to_id):
+    """
+    Turns the friend request into a friendship if the foreign server says it was accepted, or removes it if the
+    foreign server no longer has it
+    """
+    node = _foreign_node(author_id, to_id)
+    if node is None:
+        return
+    res = node.make_request('GET', "https://{}/friends/{}".format(to_id, author_id), headers=HEADERS)
+    res.raise_for_status()
+    res = res.json()
+    if res["friends"]:
+        if FriendRequest.objects.filter(from_id=author_id).filter(to_id=to_id).exists():
+            FriendRequest.objects.filter(from_id=author_id).filter(to_id=to_id).delete()
+            if not Friend.objects.filter(author_id=author_id).filter(friend_id=to_id).exists():
+                Friend(author_id=author_id, friend_id=to_id).save()
+                Friend(author_id=to_id, friend_id=author_id).save()
+    # delete if they are not friends yet
+    elif res.get("pending", None) is False:
+        FriendRequest.objects.filter(from_id=author_id).filter(to_id=to_id).delete()
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friendship', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendGraphVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
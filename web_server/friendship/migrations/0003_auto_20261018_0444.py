@@ -0,0 +1,21 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friendship', '0002_friendgraphversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friend',
+            index=models.Index(fields=['friend_id'], name='friend_friend_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['to_id'], name='friendrequest_to_id_idx'),
+        ),
+    ]
@@ -1,8 +1,21 @@
 from django.db import models
+from django.db.models import F
 from uuid import uuid4, UUID
 import re
 url_regex = re.compile(r"(http(s?))?://")
 
+
+# strip protocol, trailing slash and remove dashes uuid
+def sanitize_author_id(author_id):
+    author_id = url_regex.sub('', author_id).rstrip("/")
+    splits = author_id.rsplit("/", 1)
+    try:
+        author_id_formatted = splits[0] + "/" + UUID(splits[1]).hex
+        return author_id_formatted
+    except:
+        return author_id
+
+
 # Create your models here.
 """Friend Model: This model is used to store friendship information. There are
     in total three columns within the model
@@ -34,6 +47,10 @@ class Friend(models.Model):
 
     class Meta:
         unique_together = (("author_id", "friend_id"),)
+        indexes = [
+            # author_id lookups use the unique index, which starts with author_id
+            models.Index(fields=['friend_id'], name='friend_friend_id_idx'),
+        ]
 
 
 """FriendRequest Model: This model is used to store incoming (outgoing may as well) friend requests information. There are
@@ -57,6 +74,34 @@ class Friend(models.Model):
     """
 
 
+"""FriendGraphVersion Model: a single row counter incremented every time a friendship is created or deleted.
+    Every process keeps an in-memory copy of the friend graph (see friendship.graph) and compares this counter against
+    the version it last loaded to find out when another process has changed friendships.
+    """
+
+
+class FriendGraphVersion(models.Model):
+    version = models.BigIntegerField(default=0)
+
+    SINGLETON_ID = 1
+
+    @classmethod
+    def current(cls):
+        version = cls.objects.filter(pk=cls.SINGLETON_ID).values_list('version', flat=True).first()
+        return version or 0
+
+    @classmethod
+    def bump(cls):
+        """
+        Increments the version
+        :return: the new version
+        """
+        if not cls.objects.filter(pk=cls.SINGLETON_ID).update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=cls.SINGLETON_ID)
+            cls.objects.filter(pk=cls.SINGLETON_ID).update(version=F('version') + 1)
+        return cls.current()
+
+
 class FriendRequest(models.Model):
     from_id = models.CharField(max_length=500)
     to_id = models.CharField(max_length=500)
@@ -80,3 +125,7 @@ class FriendRequest(models.Model):
 
     class Meta:
         unique_together = (("from_id", "to_id"),)
+        indexes = [
+            # from_id lookups use the unique index, which starts with from_id
+            models.Index(fields=['to_id'], name='friendrequest_to_id_idx'),
+        ]
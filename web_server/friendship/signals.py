@@ -0,0 +1,37 @@
+import json
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver, Signal
+
+from friendship.graph import friend_graph
+from friendship.models import Friend, FriendGraphVersion, FriendRequest, sanitize_author_id
+from nodes.outbox import message_failed
+
+# Sent once the friend graph reflects a friendship being created or removed
+friendship_changed = Signal(providing_args=["author_id", "friend_id"])
+
+
+@receiver(post_save, sender=Friend)
+def friend_saved(sender, instance, created, **kwargs):
+    if created:
+        friend_graph.record_change(instance.author_id, instance.friend_id, added=True)
+    else:
+        # The row may now point at different authors, so rebuild the graph from the database everywhere
+        FriendGraphVersion.bump()
+        friend_graph.invalidate()
+    friendship_changed.send(sender=Friend, author_id=instance.author_id, friend_id=instance.friend_id)
+
+
+@receiver(post_delete, sender=Friend)
+def friend_deleted(sender, instance, **kwargs):
+    friend_graph.record_change(instance.author_id, instance.friend_id, added=False)
+    friendship_changed.send(sender=Friend, author_id=instance.author_id, friend_id=instance.friend_id)
+
+
+@receiver(message_failed)
+def friend_request_failed(sender, message, **kwargs):
+    # A friend request the foreign server never got is not pending, the author can send it again
+    if message.kind == "friend_request":
+        body = json.loads(message.body)
+        FriendRequest.objects.filter(from_id=sanitize_author_id(body["author"]["id"]),
+                                     to_id=sanitize_author_id(body["friend"]["id"])).delete()
@@ -1,6 +1,10 @@
-from django.test import TestCase, Client
-from friendship.models import Friend, Follow, FriendRequest
+from django.test import TestCase, Client, override_settings
+from friendship.models import Friend, FriendRequest, FriendGraphVersion
+from friendship.graph import friend_graph
+from friendship.views import FoafResolver
+from nodes.models import Node
 from django.urls import reverse
+from unittest import mock
 import uuid
 
 
@@ -96,7 +100,6 @@ class TestFriendshipModels(TestCase):
 
         Friend.objects.create(author_id=uid1, friend_id=uid2)
         FriendRequest.objects.create(from_id=uid1, to_id=uid2)
-        Follow.objects.create(follower_id=uid1,followee_id=uid2)
 
     def test_data(self):
         id1 = uuid.uuid5(uuid.NAMESPACE_DNS, 'test1').hex
@@ -108,11 +111,142 @@ class TestFriendshipModels(TestCase):
 
         friend_test=Friend.objects.get(author_id=uid1, friend_id=uid2)
         friend_request_test=FriendRequest.objects.get(from_id=uid1, to_id=uid2)
-        follow_test=Follow.objects.get(follower_id=uid1, followee_id=uid2)
 
         self.assertEqual(friend_test.author_id, uid1)
         self.assertEqual(friend_test.friend_id, uid2)
         self.assertEqual(friend_request_test.from_id, uid1)
         self.assertEqual(friend_request_test.to_id, uid2)
-        self.assertEqual(follow_test.follower_id, uid1)
-        self.assertEqual(follow_test.followee_id, uid2)
\ No newline at end of file
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+# This is the unittest for the FOAF resolver
+class TestFoafResolver(TestCase):
+
+    def uid(self, host, name):
+        return host + "/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, name).hex
+
+    def setUp(self):
+        friend_graph.invalidate()
+        self.viewer = self.uid("testserver", "foaf_viewer")
+        self.local_friend = self.uid("testserver", "foaf_local_friend")
+        self.local_foaf = self.uid("testserver", "foaf_local_foaf")
+        self.local_stranger = self.uid("testserver", "foaf_local_stranger")
+        self.foreign_friend = self.uid("foreign.node", "foaf_foreign_friend")
+        self.foreign_foaf = self.uid("foreign.node", "foaf_foreign_foaf")
+        self.foreign_stranger = self.uid("foreign.node", "foaf_foreign_stranger")
+
+        for author, friend in [(self.viewer, self.local_friend), (self.viewer, self.foreign_friend),
+                               (self.local_friend, self.viewer), (self.local_friend, self.local_foaf),
+                               (self.local_foaf, self.local_friend)]:
+            Friend.objects.create(author_id=author, friend_id=friend)
+        Node.objects.create(foreign_server_hostname="foreign.node", foreign_server_username="foreign.node",
+                            foreign_server_password="password", foreign_server_api_location="foreign.node")
+
+    def fake_request(self, node, method, url, **kwargs):
+        if self.foreign_foaf in url:
+            return FakeResponse(200, {"query": "friends", "authors": ["http://" + self.foreign_friend]})
+        return FakeResponse(200, {"query": "friends", "authors": []})
+
+    def test_is_foaf(self):
+        resolver = FoafResolver(self.viewer, "testserver")
+
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request) as make_request:
+            resolver.prefetch(["http://" + self.foreign_foaf, self.foreign_stranger, self.foreign_friend,
+                               self.local_stranger])
+            # Only the foreign authors that are not already known to be friends are asked for
+            self.assertEqual(make_request.call_count, 2)
+
+            with self.assertNumQueries(0):
+                self.assertTrue(resolver.is_foaf(self.viewer))
+                self.assertTrue(resolver.is_foaf(self.local_friend))
+                self.assertTrue(resolver.is_foaf(self.foreign_friend))
+                self.assertTrue(resolver.is_foaf(self.local_foaf))
+                self.assertFalse(resolver.is_foaf(self.local_stranger))
+                self.assertTrue(resolver.is_foaf(self.foreign_foaf))
+                self.assertFalse(resolver.is_foaf(self.foreign_stranger))
+                self.assertTrue(resolver.is_foaf("https://" + self.foreign_foaf + "/"))
+            self.assertEqual(make_request.call_count, 2)
+
+
+# This is the unittest for the in-process friend graph
+class TestFriendGraph(TestCase):
+
+    def setUp(self):
+        friend_graph.invalidate()
+        self.a = "testserver/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'graph_a').hex
+        self.b = "testserver/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'graph_b').hex
+        self.c = "foreign.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'graph_c').hex
+
+    def test_changes_are_applied_in_process(self):
+        d = "testserver/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'graph_d').hex
+        # Load the graph, after this it is kept up to date without reading it again
+        self.assertEqual(friend_graph.friends_of(self.a), frozenset())
+        Friend.objects.create(author_id=self.a, friend_id=self.b)
+        Friend.objects.create(author_id=self.b, friend_id=self.a)
+        # Only one side of a friendship with a foreign author is stored
+        Friend.objects.create(author_id=self.b, friend_id=self.c)
+        Friend.objects.create(author_id=d, friend_id=self.b)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(friend_graph.are_friends(self.a, self.b))
+            self.assertTrue(friend_graph.are_friends("http://" + self.b + "/", self.a))
+            self.assertTrue(friend_graph.are_friends(self.b, self.c))
+            # Like the Friend queries it replaced, only the stored direction counts
+            self.assertFalse(friend_graph.are_friends(self.c, self.b))
+            self.assertFalse(friend_graph.are_friends(self.b, d))
+            self.assertFalse(friend_graph.are_friends(self.a, self.c))
+            self.assertEqual(friend_graph.friends_of(self.b), frozenset([self.a, self.c]))
+            self.assertEqual(friend_graph.friended_by(self.b), frozenset([self.a, d]))
+            self.assertEqual(friend_graph.friends_of(self.c), frozenset())
+            self.assertEqual(friend_graph.friends_of_friends(self.a), frozenset([d]))
+            self.assertEqual(friend_graph.friends_of_friends(d), frozenset([self.a]))
+            self.assertEqual(friend_graph.friends_of_friends(self.c), frozenset())
+
+        # Removing one of the two rows only removes that direction
+        Friend.objects.filter(author_id=self.a, friend_id=self.b).delete()
+        self.assertFalse(friend_graph.are_friends(self.a, self.b))
+        self.assertTrue(friend_graph.are_friends(self.b, self.a))
+        self.assertEqual(friend_graph.friended_by(self.b), frozenset([d]))
+        self.assertEqual(friend_graph.friends_of_friends(self.a), frozenset())
+
+    def test_rows_for_the_same_friendship(self):
+        # Friendships may have been stored with or without the dashes in the uuid
+        dashed = self.b.rsplit("/", 1)[0] + "/" + str(uuid.UUID(self.b.rsplit("/", 1)[1]))
+        Friend.objects.create(author_id=self.a, friend_id=self.b)
+        Friend.objects.create(author_id=self.a, friend_id=dashed)
+        self.assertTrue(friend_graph.are_friends(self.a, self.b))
+        Friend.objects.filter(friend_id=dashed).delete()
+        self.assertTrue(friend_graph.are_friends(self.a, self.b))
+        Friend.objects.filter(friend_id=self.b).delete()
+        self.assertFalse(friend_graph.are_friends(self.a, self.b))
+
+    def test_changes_from_other_processes_are_picked_up(self):
+        self.assertFalse(friend_graph.are_friends(self.a, self.b))
+
+        # bulk_create sends no signals, like a write made by another process
+        Friend.objects.bulk_create([Friend(author_id=self.a, friend_id=self.b)])
+        FriendGraphVersion.bump()
+
+        self.assertFalse(friend_graph.are_friends(self.a, self.b))
+        with override_settings(FRIEND_GRAPH_CHECK_INTERVAL=0):
+            self.assertTrue(friend_graph.are_friends(self.a, self.b))
+
+    def test_updated_rows_rebuild_the_graph(self):
+        friend = Friend.objects.create(author_id=self.a, friend_id=self.b)
+        version = FriendGraphVersion.current()
+        self.assertTrue(friend_graph.are_friends(self.a, self.b))
+
+        # The row now points at another author, which the index can not patch in place
+        friend.friend_id = self.c
+        friend.save()
+        self.assertGreater(FriendGraphVersion.current(), version)
+        self.assertFalse(friend_graph.are_friends(self.a, self.b))
+        self.assertTrue(friend_graph.are_friends(self.a, self.c))
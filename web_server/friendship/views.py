@@ -1,8 +1,11 @@
 from django.shortcuts import render
 from django.http import HttpResponse, JsonResponse
-from friendship.models import FriendRequest, Friend
+from friendship.models import FriendRequest, Friend, sanitize_author_id
+from friendship.graph import friend_graph
 from nodes.models import Node
+from nodes import outbox
 from django.contrib.auth.decorators import login_required
+from django.urls import reverse
 import json
 import re
 from nodes.models import Node
@@ -10,21 +13,10 @@ import base64
 import requests
 from uuid import UUID
 from social_distribution.utils.basic_auth import validate_remote_server_authentication
+from social_distribution.utils.concurrency import fan_out
 from urllib.parse import quote
 url_regex = re.compile(r"(http(s?))?://")
 
-# strip protocol, trailing slash and remove dashes uuid
-
-
-def sanitize_author_id(author_id):
-    author_id = url_regex.sub('', author_id).rstrip("/")
-    splits = author_id.rsplit("/", 1)
-    try:
-        author_id_formatted = splits[0] + "/" + UUID(splits[1]).hex
-        return author_id_formatted
-    except:
-        return author_id
-
 
 """
 INTERNAL ENDPOINT
@@ -109,7 +101,10 @@ this function calls foreign_server's http://service/friendrequest endpoint
 
 
 def send_friend_request_to_foreign_friend(friend_info, author_info, foreign_server):
-
+    """
+    Records the friend request and queues it for delivery to the foreign server (see nodes.outbox)
+    :return: the OutboxMessage, or an HttpResponse if we are not connected to the foreign server
+    """
     if not Node.objects.filter(foreign_server_hostname=foreign_server).exists():
         return HttpResponse("Not Authenticated with Remote Server", status=401)
     node = Node.objects.get(foreign_server_hostname=foreign_server)
@@ -118,16 +113,16 @@ def send_friend_request_to_foreign_friend(friend_info, author_info, foreign_serv
     data["query"] = "friendrequest"
     data["author"] = author_info
     data["friend"] = friend_info
-    json_data = json.dumps(data)
-    headers = {'Content-Type': 'application/json'}
     url = "http://{}/friendrequest".format(
         node.foreign_server_api_location.rstrip("/"))
     if node.append_slash:
         url += "/"
-    response = requests.post(
-        url, headers=headers, auth=(node.username_registered_on_foreign_server, node.password_registered_on_foreign_server), data=json_data)
-
-    return HttpResponse(response.text, status=response.status_code)
+    from_id = sanitize_author_id(author_info["id"])
+    to_id = sanitize_author_id(friend_info["id"])
+    # Every request is its own message, the author may ask again once an earlier request was rejected or unfriended
+    friend_request = FriendRequest(from_id=from_id, to_id=to_id)
+    friend_request.save()
+    return outbox.send(node, "friend_request", url, data, f"friend_request:{friend_request.pk}", sender=from_id)
 
 
 """
@@ -181,18 +176,14 @@ def send_friend_request(request):
         if from_host == request.get_host():
             # friend request from local author to local author
             if to_host != request.get_host():
-                # retrieve basic auth credential from Node table
-                http_response = send_friend_request_to_foreign_friend(
+                # The request is delivered in the background, it is removed again if the foreign server refuses it
+                message = send_friend_request_to_foreign_friend(
                     body.get("friend"), body.get("author"), to_host)
-                if http_response.status_code >= 200 and http_response.status_code < 300:
-                    if not FriendRequest.objects.filter(from_id=from_id).filter(to_id=to_id).exists():
-                        new_request = FriendRequest(
-                            from_id=from_id, to_id=to_id)
-                        new_request.save()
-                        return HttpResponse("Friend Request Successfully sent", status=201)
-                    return HttpResponse("Friend Request Already Sent", status=409)
-                else:
-                    return http_response
+                if isinstance(message, HttpResponse):
+                    return message
+                response = HttpResponse("Friend Request Successfully sent", status=202)
+                response['Location'] = reverse('outbox_message', args=[message.id])
+                return response
             else:
                 new_request = FriendRequest(from_id=from_id, to_id=to_id)
                 new_request.save()
@@ -275,158 +266,107 @@ def retrieve_friend_request_of_author_id(request, author_id):
     return HttpResponse("You can only GET the URL", status=405)
 
 
-"""
-invalidate outgoing friend requests of an author by calling foreign servers'
-https://service/authorid/friend/authorid2 endpoint
-"""
-
+class FoafResolver:
+    """
+    Answers whether authors are friends of a friend (FOAF) of the viewer, for the lifetime of one request.
+
+    The viewer's friends and every author known to share a friend with them come from the in-process friend graph.
+    Foreign authors' friends can only be learned by asking their node, so each foreign author's friend list is fetched
+    at most once, and prefetch() fetches the friend lists of many authors in parallel. After that is_foaf() is a set
+    lookup.
+    """
+
+    def __init__(self, viewer, own_host):
+        """
+        :param viewer: the uid of the author viewing the posts, with or without protocol
+        :param own_host: the hostname of this server, authors on it have their friends in our database
+        """
+        self.viewer = sanitize_author_id(viewer)
+        self.own_host = own_host
+        self.friends = friend_graph.friends_of(self.viewer)
+        # Every author (local or not) our database knows shares a friend with the viewer
+        self.local_foaf = friend_graph.friends_of_friends(self.viewer)
+        # sanitized foreign author id -> set of their friends, or None if their node could not tell us
+        self.foreign_friends = dict()
+
+    @classmethod
+    def for_request(cls, request):
+        return cls(request.user.uid, request.get_host())
+
+    def is_local(self, author):
+        return author.split("/author/")[0] == self.own_host
+
+    def prefetch(self, authors):
+        """
+        Fetches the friend lists of all the given foreign authors that are not known yet, at the same time
+        :param authors: iterable of author uids, with or without protocol
+        """
+        authors = {sanitize_author_id(author) for author in authors}
+        missing = [author for author in authors if not self.is_local(author)
+                   and author not in self.foreign_friends and not self._known_foaf(author)]
+        if len(missing) == 0:
+            return
+
+        # Look up all the nodes at once so the parallel fetches do not need the database
+        nodes = Node.objects.in_bulk({author.split("/author/")[0] for author in missing})
+        calls = dict()
+        for author in missing:
+            node = nodes.get(author.split("/author/")[0])
+            if node is None:
+                print(f"Attempt to FOAF verify author '{author}' but we do not have access to their node.")
+                self.foreign_friends[author] = None
+            else:
+                calls[author] = (lambda author=author, node=node: self.fetch_foreign_friends(author, node))
+
+        results, errors = fan_out(calls)
+        for author, friends in results.items():
+            self.foreign_friends[author] = friends
+        for author, error in errors.items():
+            print(f"Attempt to FOAF verify with foreign node of '{author}' failed: {error}")
+            self.foreign_friends[author] = None
+
+    @staticmethod
+    def fetch_foreign_friends(author, node):
+        """
+        Asks the node an author belongs to for their friends
+        :return: set of sanitized friend ids, or None if the node did not answer with a friend list
+        """
+        api = "http://{}/author/{}/friends".format(node.foreign_server_api_location, author)
+        if node.append_slash:
+            api = api + "/"
+        try:
+            response = node.make_request('GET', api)
+        except requests.RequestException as e:
+            print(f"Attempt to FOAF verify with foreign node '{node.foreign_server_hostname}' failed: {e}")
+            return None
+        if response.status_code != 200:
+            return None
+        try:
+            return {sanitize_author_id(friend) for friend in response.json()["authors"]}
+        except (ValueError, KeyError, TypeError):
+            print(f"Attempt to decode FOAF verification response from '{node.foreign_server_hostname}' failed")
+            return None
+
+    def _known_foaf(self, author):
+        return author == self.viewer or author in self.friends or author in self.local_foaf
+
+    def is_foaf(self, author):
+        """
+        :param author: uid of an author, with or without protocol
+        :return: True if the author is the viewer, a friend of the viewer or a friend of one of the viewer's friends
+        """
+        author = sanitize_author_id(author)
+        if self._known_foaf(author):
+            return True
+        if self.is_local(author):
+            return False
+        if author not in self.foreign_friends:
+            self.prefetch([author])
+        friends = self.foreign_friends[author]
+        return friends is not None and not friends.isdisjoint(self.friends)
 
-def invalidate_friend_requests(author_id):
-    author_id = url_regex.sub('', author_id)
-    author_id = author_id.rstrip("/")
-    if not FriendRequest.objects.filter(from_id=author_id).exists():
-        return
-
-    friend_requests = FriendRequest.objects.filter(from_id=author_id)
-
-    hostname = author_id.split("/")[0]
-    for request in friend_requests:
-        to_host = request.to_id.split("/")[0]
-
-        # foreign requests -> call foreign server endpoint to validate
-        if hostname != to_host:
-            if Node.objects.filter(pk=to_host).exists():
-                node = Node.objects.get(foreign_server_hostname=to_host)
-                # quoted_author_id = quote(
-                #     author_id, safe='~()*!.\'')
-                headers = {"Content-Type": "application/json",
-                           "Accept": "application/json"}
-                url = "https://{}/friends/{}".format(request.to_id, author_id)
-                res = requests.get(url, headers=headers, auth=(
-                    node.username_registered_on_foreign_server, node.password_registered_on_foreign_server))
-                if res.status_code >= 200 and res.status_code < 300:
-                    res = res.json()
-                    # if they are friends
-                    if res["friends"]:
-                        if FriendRequest.objects.filter(from_id=author_id).filter(to_id=request.to_id).exists():
-                            FriendRequest.objects.filter(from_id=author_id).filter(
-                                to_id=request.to_id).delete()
-                            if not Friend.objects.filter(author_id=author_id).filter(friend_id=request.to_id).exists():
-                                new_friend = Friend(
-                                    author_id=author_id, friend_id=request.to_id)
-                                new_friend.save()
-                                new_friend = Friend(
-                                    author_id=request.to_id, friend_id=author_id)
-                                new_friend.save()
-                    # delete if they are not friends yet
-                    else:
-                        pending = res.get("pending", None)
-                        if pending is False:
-                            if FriendRequest.objects.filter(from_id=author_id).filter(to_id=request.to_id).exists():
-                                FriendRequest.objects.filter(from_id=author_id).filter(
-                                    to_id=request.to_id).delete()
-
-
-# FOAF verification involves the 3 hosts of the 3 friends A->B->C
-# assuming A B C reside on different hosts.
-# and in the same server
 
+# FOAF verification involves the 3 hosts of the 3 friends A->B->C, which may all be on different hosts.
+# Use a FoafResolver directly when checking many authors for the same request.
 def FOAF_verification(request, author):
-
-    auth_user = request.user.uid
-    auth_user = url_regex.sub("", auth_user).rstrip("/")
-    author = url_regex.sub("", author).rstrip("/")
-
-    own_node = request.get_host()
-    if auth_user == author:
-        return True
-
-    nodes = [own_node]
-    for node in Node.objects.all():
-        nodes.append(node.foreign_server_hostname)
-
-    for node in nodes:
-        # If the author is a friend of auth user return True
-        if Friend.objects.filter(author_id=auth_user).filter(friend_id=author).exists():
-            return True
-
-        # not friends so check for FOAF
-        else:
-            # if the author is on the same host as auth user
-            if node == own_node:
-                author_friends = Friend.objects.filter(author_id=author)
-                for friend in author_friends:
-                    # getting the node of the friend
-                    friend_node = friend.friend_id.split("/author/")[0]
-                    friends_uuid = friend.friend_id.split("/author/")[-1]
-                    # if friend of the author is on the same host as the auth user
-                    # A -> A -> A
-                    if friend_node == own_node:
-                        # E.g Test <-> Lara <-> Bob
-                        if Friend.objects.filter(author_id=auth_user).filter(friend_id=friend.friend_id).exists():
-                            return True
-                        else:
-                            return False
-
-                    # Since the friend is not on the same host as the auth user make a request to get friends from the other node
-                    # A -> A -> B
-                    else:
-                        try:
-                            node_object = Node.objects.get(foreign_server_hostname=friend_node)
-                        except Node.DoesNotExist as e:
-                            # If we do not know their friends node, then we must not try to connect with it,
-                            # But we can still consult other friends
-                            print(f"Attempt to FOAF verify friend node hostname '{friend_node}' but we do not have access to that node.")
-                            continue
-                        username = node_object.username_registered_on_foreign_server
-                        password = node_object.password_registered_on_foreign_server
-                        api = node_object.foreign_server_api_location
-                        api = "http://{}/author/{}/friends".format(
-                            api, "{}/author/{}".format(api, author))
-                        if node_object.append_slash:
-                            api = api + "/"
-                        response = requests.get(api,
-                                                auth=(username, password)
-                                                )
-                        if response.status_code == 200:
-                            try:
-                                friends_list = response.json()
-                            except Exception as e:
-                                print(f"Attempt to decode FOAF verification response from '{friend_node}' failed")
-                                return False
-                            for user in friends_list["authors"]:
-                                if Friend.objects.filter(author_id=auth_user).filter(friend_id=user).exists():
-                                    return True
-                                else:
-                                    return False
-
-            # author's host is different from auth user
-            else:
-                try:
-                    node_object = Node.objects.get(foreign_server_hostname=node)
-                except Node.DoesNotExist as e:
-                    print(f'attempt to FOAF verify with different foreign node {node} caused error: {e}')
-                    return False
-                username = node_object.username_registered_on_foreign_server
-                password = node_object.password_registered_on_foreign_server
-                api = node_object.foreign_server_api_location
-                if node_object.append_slash:
-                    api = api + "/"
-                response = requests.get(
-                    "http://{}/author/{}/friends".format(api, author),
-                    auth=(username, password)
-                )
-                if response.status_code == 200:
-                    try:
-                        friends_list = response.json()
-                    except Exception as e:
-                        print(f"Attempt to decode FOAF verification response from '{api}' failed")
-                        return False
-                    for user in friends_list["authors"]:
-                        # E.g Test <-> Lara <-> User
-                        if Friend.objects.filter(author_id=auth_user).filter(friend_id=user).exists():
-                            return True
-                        else:
-                            return False
-
-    return False
\ No newline at end of file
+    return FoafResolver.for_request(request).is_foaf(author)
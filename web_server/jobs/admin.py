@@ -0,0 +1,10 @@
+from django.contrib import admin
+from jobs.models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'state', 'node', 'attempts', 'run_at', 'last_error']
+    list_filter = ['state', 'name']
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.queue import claim_job, run_job, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs the background job queue, until stopped unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due, then exit")
+        parser.add_argument('--threads', type=int, default=settings.JOBS_WORKER_THREADS,
+                            help="Number of jobs run at the same time")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"Ran {run_pending_jobs()} jobs")
+            return
+
+        threads = [threading.Thread(target=self.work, daemon=True) for i in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Running jobs in {len(threads)} threads")
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+
+    @staticmethod
+    def work():
+        try:
+            while True:
+                job = claim_job()
+                if job is None:
+                    time.sleep(settings.JOBS_POLL_INTERVAL)
+                else:
+                    run_job(job)
+        finally:
+            connections.close_all()
@@ -0,0 +1,48 @@
+import json
+
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from nodes.models import Node
+
+
+class Job(models.Model):
+    """
+    A call to a registered job function, run by the run_jobs worker instead of during a request (see jobs.queue).
+    Jobs are deleted once they succeed, jobs that failed every attempt are kept for inspection.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATE_CHOICES = (
+        (PENDING, "pending"),
+        (RUNNING, "running"),
+        (FAILED, "failed"),
+    )
+
+    name = models.CharField(max_length=200)
+    # JSON object of the keyword arguments the job function is called with
+    arguments = models.TextField(default="{}")
+    # The foreign server the job talks to, at most settings.JOBS_MAX_PER_NODE jobs of a node run at once
+    node = models.ForeignKey(Node, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    # At most one pending job has the same key, scheduling it again while it is pending does nothing
+    dedup_key = models.CharField(max_length=500, null=True, blank=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['state', 'run_at'])]
+        constraints = [
+            models.UniqueConstraint(fields=['dedup_key'], condition=Q(state="pending"), name='unique_pending_job'),
+        ]
+
+    def get_arguments(self):
+        return json.loads(self.arguments)
+
+    def __str__(self):
+        return f'{self.state} job {self.name} {self.arguments}'
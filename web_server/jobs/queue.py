@@ -0,0 +1,126 @@
+"""
+A queue of jobs stored in the database, for work that talks to foreign servers but does not have to hold up the
+request that caused it.
+
+Apps define job functions in their jobs.py module, decorated with register_job (those modules are imported when the
+jobs app is ready), and schedule them with enqueue. The run_jobs management command runs them: each worker thread
+claims the job that has waited longest, calls its function with the job's arguments, and deletes the job once it
+returns. A job that raises is run again after settings.JOBS_RETRY_DELAY seconds, twice as long after every further
+failure up to settings.JOBS_MAX_RETRY_DELAY, until it has failed settings.JOBS_MAX_ATTEMPTS times.
+
+Jobs scheduled with a dedup key are only queued once while pending, so views can schedule work on every request. Jobs
+tied to a node run at most settings.JOBS_MAX_PER_NODE at a time for that node. A job still running after
+settings.JOBS_LOCK_TIMEOUT seconds is assumed to have lost its worker and is claimed again.
+"""
+from datetime import timedelta
+import json
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+_job_functions = dict()
+
+
+def register_job(name):
+    """
+    Decorator registering a function as the job scheduled by the given name. The function is called with the job's
+    arguments as keyword arguments, and the job is retried if it raises.
+    """
+    def register(function):
+        _job_functions[name] = function
+        return function
+    return register
+
+
+def enqueue(name, arguments=None, node=None, dedup_key=None, delay=0):
+    """
+    Schedules a job
+    :param name: the name its function was registered with
+    :param arguments: dict of keyword arguments to call the function with, must be JSON serializable
+    :param node: the Node the job talks to, if any
+    :param dedup_key: if a pending job has the same key, no job is added, the pending one is moved up instead if it
+                      was due later
+    :param delay: seconds to wait before running the job
+    :return: the job, or the pending job with the same dedup key
+    """
+    run_at = timezone.now() + timedelta(seconds=delay)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(name=name, arguments=json.dumps(arguments or {}), node=node,
+                                      dedup_key=dedup_key, run_at=run_at)
+    except IntegrityError:
+        # The pending job runs no later than this one would have
+        Job.objects.filter(dedup_key=dedup_key, state=Job.PENDING, run_at__gt=run_at).update(run_at=run_at)
+        return Job.objects.filter(dedup_key=dedup_key, state=Job.PENDING).first()
+
+
+def claim_job():
+    """
+    Marks the next job that is due as running
+    :return: the job, or None if no job can run right now
+    """
+    now = timezone.now()
+    lost = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    running = Job.objects.filter(state=Job.RUNNING, started_at__gte=lost, node__isnull=False)
+    busy_nodes = [node for node, count in running.values('node').annotate(count=Count('id')).values_list('node', 'count')
+                  if count >= settings.JOBS_MAX_PER_NODE]
+
+    due = Job.objects.filter(Q(state=Job.PENDING, run_at__lte=now) | Q(state=Job.RUNNING, started_at__lt=lost))
+    for job in due.exclude(node__in=busy_nodes).order_by('run_at', 'id')[:10]:
+        # Only one worker gets to move the job on from the state it was read in
+        claimed = Job.objects.filter(id=job.id, state=job.state, attempts=job.attempts).update(
+            state=Job.RUNNING, started_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _retry_or_fail(job):
+    if job.attempts >= settings.JOBS_MAX_ATTEMPTS:
+        changes = dict(state=Job.FAILED)
+    else:
+        delay = min(settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1), settings.JOBS_MAX_RETRY_DELAY)
+        changes = dict(state=Job.PENDING, run_at=timezone.now() + timedelta(seconds=delay))
+    try:
+        with transaction.atomic():
+            Job.objects.filter(id=job.id).update(last_error=traceback.format_exc(), **changes)
+    except IntegrityError:
+        # The same job was scheduled again while this one ran, that one will do the work
+        Job.objects.filter(id=job.id).delete()
+
+
+def run_job(job):
+    """
+    Runs a claimed job, then deletes it or schedules its retry
+    :return: True if the job succeeded
+    """
+    try:
+        function = _job_functions.get(job.name)
+        if function is None:
+            raise LookupError(f"No job is registered as '{job.name}'")
+        function(**job.get_arguments())
+    except Exception:
+        _retry_or_fail(job)
+        return False
+    Job.objects.filter(id=job.id).delete()
+    return True
+
+
+def run_pending_jobs():
+    """
+    Runs jobs until none is due
+    :return: the number of jobs run
+    """
+    count = 0
+    job = claim_job()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_job()
+    return count
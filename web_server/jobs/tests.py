@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import claim_job, enqueue, register_job, run_job, run_pending_jobs
+from nodes.models import Node
+
+calls = []
+
+
+@register_job("test_record")
+def record(value):
+    calls.append(value)
+
+
+@register_job("test_fail")
+def fail():
+    raise ValueError("failed on purpose")
+
+
+# This is the unit test for the background job queue
+@override_settings(JOBS_MAX_ATTEMPTS=3, JOBS_RETRY_DELAY=10, JOBS_MAX_RETRY_DELAY=15, JOBS_MAX_PER_NODE=1)
+class TestJobQueue(TestCase):
+
+    def setUp(self):
+        calls.clear()
+        self.node = Node.objects.create(foreign_server_hostname="jobs.node", foreign_server_username="jobs",
+                                        foreign_server_password="password", foreign_server_api_location="jobs.node")
+
+    def test_run(self):
+        enqueue("test_record", {"value": 1})
+        enqueue("test_record", {"value": 2}, delay=60)
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(calls, [1])
+        # Succeeded jobs are deleted, the delayed one waits
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_dedup(self):
+        first = enqueue("test_record", {"value": 1}, dedup_key="same")
+        second = enqueue("test_record", {"value": 1}, dedup_key="same")
+        self.assertEqual(first.id, second.id)
+
+        # Once it runs, the same work can be scheduled again
+        job = claim_job()
+        third = enqueue("test_record", {"value": 1}, dedup_key="same")
+        self.assertNotEqual(third.id, job.id)
+        run_job(job)
+        self.assertEqual(Job.objects.get().id, third.id)
+
+    def test_retry_with_backoff(self):
+        enqueue("test_fail")
+        delays = []
+        for attempt in range(3):
+            job = claim_job()
+            started = timezone.now()
+            self.assertFalse(run_job(job))
+            job.refresh_from_db()
+            self.assertIn("failed on purpose", job.last_error)
+            if job.state == Job.PENDING:
+                delays.append(round((job.run_at - started).total_seconds()))
+                Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        self.assertEqual(delays, [10, 15])
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertIsNone(claim_job())
+
+    def test_node_limit(self):
+        enqueue("test_record", {"value": 1}, node=self.node)
+        enqueue("test_record", {"value": 2}, node=self.node)
+        enqueue("test_record", {"value": 3})
+        first = claim_job()
+        self.assertEqual(first.node, self.node)
+        # The node already has as many jobs running as it may
+        self.assertIsNone(claim_job().node)
+        self.assertIsNone(claim_job())
+        run_job(first)
+        self.assertEqual(claim_job().get_arguments(), {"value": 2})
+
+    def test_lost_job_claimed_again(self):
+        enqueue("test_record", {"value": 1})
+        job = claim_job()
+        Job.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_job().id, job.id)
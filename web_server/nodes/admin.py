@@ -1,5 +1,5 @@
 from django.contrib import admin
-from nodes.models import Node
+from nodes.models import Node, NodeDialect, OutboxMessage
 from .forms import ForeignServerRegisterForm
 
 
@@ -30,3 +30,19 @@ class NodeAdmin(admin.ModelAdmin):
 
 # Register your models here.
 admin.site.register(Node, NodeAdmin)
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'node', 'status', 'attempts', 'response_status', 'created_at', 'last_error']
+    list_filter = ['status', 'kind', 'node']
+
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
+
+
+class NodeDialectAdmin(admin.ModelAdmin):
+    list_display = ['node', 'author_uuid_form', 'post_shape', 'updated_at']
+
+
+# Deleting a dialect makes it be learned again
+admin.site.register(NodeDialect, NodeDialectAdmin)
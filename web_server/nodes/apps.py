@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class NodesConfig(AppConfig):
     name = 'nodes'
+
+    def ready(self):
+        # Forgets verified node credentials when nodes change
+        import nodes.signals
@@ -0,0 +1,86 @@
+"""
+The dialect of each node: which of the url forms and response shapes floating around a node uses (see NodeDialect).
+
+Until a node's dialect is known every form is tried, and the one that worked is stored. From then on a single request
+is made, in the node's form, and its response is read once, in the node's shape. A learned post shape that stops
+matching is learned again.
+"""
+from uuid import UUID
+
+from nodes.models import NodeDialect
+
+
+def get_dialect(node):
+    """
+    :return: the node's NodeDialect, unsaved and empty if nothing has been learned yet
+    """
+    try:
+        return node.dialect
+    except NodeDialect.DoesNotExist:
+        return NodeDialect(node=node)
+
+
+def learn(node, **fields):
+    """
+    Stores what was learned about a node, unless it was known already
+    """
+    dialect = get_dialect(node)
+    if all(getattr(dialect, field) == value for field, value in fields.items()):
+        return
+    for field, value in fields.items():
+        setattr(dialect, field, value)
+    dialect.save()
+
+
+def author_urls(author_id, dialect):
+    """
+    :param author_id: sanitized uid of a foreign author
+    :param dialect: the NodeDialect of the author's node
+    :return: list of (uuid form, url) to try in order to get the author's profile, a single one once the node's form
+             is known. The uuid form is None when the uid does not end in a uuid.
+    """
+    prefix, _, last = author_id.rpartition("/")
+    try:
+        author_uuid = UUID(last)
+    except ValueError:
+        return [(None, "http://{}".format(author_id))]
+    urls = [(NodeDialect.DASHED, "http://{}/{}".format(prefix, str(author_uuid))),
+            (NodeDialect.HEX, "http://{}/{}".format(prefix, author_uuid.hex))]
+    learned = [url for url in urls if url[0] == dialect.author_uuid_form]
+    return learned or urls
+
+
+def _post_in_shape(body, shape):
+    if not isinstance(body, dict):
+        return None
+    if shape == NodeDialect.POSTS_LIST:
+        posts = body.get('posts')
+        post = posts[0] if isinstance(posts, list) and len(posts) > 0 else None
+    elif shape == NodeDialect.POSTS:
+        post = body.get('posts')
+    elif shape == NodeDialect.POST:
+        post = body.get('post')
+    else:
+        post = body
+    # Every post has an id, which tells posts apart from envelopes holding none
+    return post if isinstance(post, dict) and 'id' in post else None
+
+
+def read_post(node, body):
+    """
+    Finds the post in a node's response to GET /posts/<post_id>, in the shape the node is known to use, otherwise in
+    whichever shape matches, which is then learned
+    :param body: the decoded JSON response
+    :return: the post, or None if the response holds no post in any shape
+    """
+    shape = get_dialect(node).post_shape
+    if shape:
+        post = _post_in_shape(body, shape)
+        if post is not None:
+            return post
+    for shape, description in NodeDialect.POST_SHAPE_CHOICES:
+        post = _post_in_shape(body, shape)
+        if post is not None:
+            learn(node, post_shape=shape)
+            return post
+    return None
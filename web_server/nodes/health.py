@@ -0,0 +1,136 @@
+"""
+Health of the foreign servers we talk to: a circuit breaker and a bulkhead per host.
+
+Every outbound request is recorded in a sliding window of settings.FEDERATION_BREAKER_WINDOW seconds. A request fails
+if it raised or got a server error, and is slow if it took longer than settings.FEDERATION_BREAKER_SLOW_CALL seconds.
+Once the window holds at least settings.FEDERATION_BREAKER_MIN_CALLS requests and the share of failed or slow ones
+reaches settings.FEDERATION_BREAKER_FAILURE_RATE, the breaker opens: requests to the host fail right away for
+settings.FEDERATION_BREAKER_OPEN_SECONDS. After that it is half open, a single trial request is let through, and the
+breaker closes again if it succeeds or opens again if it does not. Requests that started before the breaker opened say
+nothing about the host's recovery, so how they go is ignored.
+
+Independently of the breaker, at most settings.FEDERATION_MAX_IN_FLIGHT requests to a host run at once in this
+process. Requests over the limit fail right away rather than wait, so a host that hangs can not tie up every worker.
+
+Requests that are refused raise NodeUnavailable, a requests.RequestException, so callers handle them like any other
+node that could not be reached.
+"""
+from collections import deque
+import threading
+import time
+
+from django.conf import settings
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half open"
+
+
+class NodeUnavailable(requests.RequestException):
+    """
+    Raised instead of making a request to a host that is known to be unhealthy or already has too many requests in
+    flight
+    """
+
+
+class NodeHealth:
+    """
+    The breaker and in-flight count of a single host. Thread safe.
+    """
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.state = CLOSED
+        self.opened_at = None
+        self.in_flight = 0
+        # Incremented every time the breaker opens, requests started before that are not counted
+        self.generation = 0
+        self.trial_in_flight = False
+        # (finished at, failed or slow) of the requests in the window, oldest first
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._calls and self._calls[0][0] < now - settings.FEDERATION_BREAKER_WINDOW:
+            self._calls.popleft()
+
+    def acquire(self):
+        """
+        Reserves a slot for a request, call release once it finishes
+        :return: the token to pass to release
+        :raise: NodeUnavailable if the request should not be made
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < settings.FEDERATION_BREAKER_OPEN_SECONDS:
+                    raise NodeUnavailable(f"{self.hostname} is failing, not contacting it for a while")
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and self.trial_in_flight:
+                raise NodeUnavailable(f"{self.hostname} is failing, waiting on a trial request")
+            if self.in_flight >= settings.FEDERATION_MAX_IN_FLIGHT:
+                raise NodeUnavailable(f"{self.hostname} already has {self.in_flight} requests in flight")
+            self.in_flight += 1
+            trial = self.state == HALF_OPEN
+            self.trial_in_flight |= trial
+            return self.generation, trial
+
+    def release(self, token, failed, elapsed):
+        """
+        Records how a request reserved with acquire went
+        :param token: what acquire returned for the request
+        :param failed: True if the request raised or got a server error
+        :param elapsed: seconds the request took
+        """
+        generation, trial = token
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            bad = failed or elapsed > settings.FEDERATION_BREAKER_SLOW_CALL
+            if generation != self.generation:
+                # Started before the breaker opened, the breaker already knows the host was failing
+                return
+            if self.state == HALF_OPEN:
+                if not trial:
+                    return
+                self.trial_in_flight = False
+                if bad:
+                    self._open(now)
+                else:
+                    self.state = CLOSED
+                    self._calls.clear()
+                return
+
+            self._calls.append((now, bad))
+            self._trim(now)
+            bad_calls = sum(1 for finished, call_bad in self._calls if call_bad)
+            if len(self._calls) >= settings.FEDERATION_BREAKER_MIN_CALLS and \
+                    bad_calls / len(self._calls) >= settings.FEDERATION_BREAKER_FAILURE_RATE:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.generation += 1
+        self._calls.clear()
+
+
+_health = dict()
+_health_lock = threading.Lock()
+
+
+def get_health(hostname):
+    """
+    :return: the NodeHealth of the given host, shared by every thread in the process
+    """
+    with _health_lock:
+        health = _health.get(hostname)
+        if health is None:
+            health = _health[hostname] = NodeHealth(hostname)
+        return health
+
+
+def reset_health():
+    with _health_lock:
+        _health.clear()
@@ -0,0 +1,10 @@
+from jobs.queue import register_job
+from nodes.models import Node
+from nodes.outbox import deliver_outbox
+
+
+@register_job("deliver_outbox")
+def deliver_node_outbox(hostname):
+    node = Node.objects.filter(foreign_server_hostname=hostname).first()
+    if node is not None:
+        deliver_outbox(node)
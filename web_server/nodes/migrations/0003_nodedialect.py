@@ -0,0 +1,23 @@
+# Generated by Django 2.2.10 on 2026-10-18 11:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0002_auto_20261018_0510'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeDialect',
+            fields=[
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dialect', serialize=False, to='nodes.Node')),
+                ('author_uuid_form', models.CharField(blank=True, choices=[('dashed', 'with dashes'), ('hex', 'without dashes')], max_length=10)),
+                ('post_shape', models.CharField(blank=True, choices=[('posts_list', "first of a list under 'posts'"), ('posts', "under 'posts'"), ('post', "under 'post'"), ('bare', 'the whole response')], max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,7 +1,18 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import json
 import requests
+import threading
+import time
+from uuid import uuid4
+
+from nodes.health import get_health
+from social_distribution.utils.concurrency import SingleFlight
 
 
 # Create your models here.
@@ -36,6 +47,20 @@ api_password = "some password"
 
 """
 
+# Pooled keep-alive sessions, one per host we talk to. Shared by every thread in the process so that outbound
+# requests reuse open TCP/TLS connections instead of handshaking every time.
+_sessions = dict()
+_sessions_lock = threading.Lock()
+
+# Identical GET requests made at the same time by different threads, which happens when several users open the same
+# foreign page at once, share a single request (see Node.make_host_request)
+_shared_gets = SingleFlight(settings.FEDERATION_SHARED_RESULT_CACHE_SIZE)
+
+
+def clear_shared_requests():
+    _shared_gets.clear()
+
+
 # As a server admin, I want to be able to add node to share with #44
 
 
@@ -96,15 +121,165 @@ class Node(models.Model):
 
         return api_url
 
-    def make_api_get_request(self, path=''):
+    @staticmethod
+    def get_session(hostname):
+        """
+        Returns the pooled session used for all outbound requests to the given host, creating it on first use.
+        The session keeps connections alive, bounds how many are open at once, and retries failed connections and
+        gateway errors with exponential backoff. Only idempotent methods are retried.
+        """
+        with _sessions_lock:
+            session = _sessions.get(hostname)
+            if session is None:
+                retry = Retry(total=settings.FEDERATION_RETRIES,
+                              backoff_factor=settings.FEDERATION_RETRY_BACKOFF,
+                              status_forcelist=(502, 503, 504),
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=settings.FEDERATION_POOL_CONNECTIONS,
+                                      pool_maxsize=settings.FEDERATION_POOL_MAXSIZE,
+                                      max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[hostname] = session
+            return session
+
+    @staticmethod
+    def make_host_request(hostname, method, url, **kwargs):
+        """
+        Makes a request through the pooled session of the given host, applying the default connect/read timeouts.
+        Requests to a host that keeps failing, or that already has too many requests in flight, are refused right away
+        (see nodes.health).
+        GET requests that are identical to one in flight, same url, credentials, headers and parameters, wait for it and
+        get its response instead of being made again. Unless it was a server error, the response is also reused by
+        identical requests for settings.FEDERATION_SHARED_RESULT_SECONDS after it arrived. Shared responses must not be
+        modified. Streamed requests are never shared, their body can only be read once.
+        Use this for hosts that are not registered nodes (e.g. our own server), otherwise prefer make_request.
+        Returns the requests library response, raises requests.RequestException if the host could not be reached
+        """
+        kwargs.setdefault('timeout', (settings.FEDERATION_CONNECT_TIMEOUT, settings.FEDERATION_READ_TIMEOUT))
+        if method.upper() == 'GET' and not kwargs.get('stream', False):
+            key = (hostname, url, json.dumps(kwargs, sort_keys=True, default=str))
+            return _shared_gets.do(key, lambda: Node._send_host_request(hostname, method, url, **kwargs),
+                                   ttl=settings.FEDERATION_SHARED_RESULT_SECONDS,
+                                   keep=lambda response: response.status_code < 500)
+        return Node._send_host_request(hostname, method, url, **kwargs)
+
+    @staticmethod
+    def _send_host_request(hostname, method, url, **kwargs):
+        health = get_health(hostname)
+        token = health.acquire()
+        started = time.monotonic()
+        failed = True
+        try:
+            response = Node.get_session(hostname).request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            health.release(token, failed, time.monotonic() - started)
+
+    def make_request(self, method, url, **kwargs):
+        """
+        Makes a request against any url on this Node using it's pooled session. Automatically authenticates.
+        Returns the requests library response, raises requests.RequestException if the node could not be reached
+        """
+        kwargs.setdefault('auth', (self.username_registered_on_foreign_server,
+                                   self.password_registered_on_foreign_server))
+        return Node.make_host_request(self.foreign_server_hostname, method, url, **kwargs)
+
+    def make_api_get_request(self, path='', **kwargs):
         """
         Gets the appropriate API url based on the path, and then makes a request against it.
         Automatically authenticates.
         Returns the requests library response, it is not otherwise processed
         """
-        url = self.get_safe_api_url(path)
-        req = requests.get(url,
-                           auth=(self.username_registered_on_foreign_server,
-                                 self.password_registered_on_foreign_server),
-                           headers={'Accept': 'application/json'})
-        return req
+        kwargs.setdefault('headers', {'Accept': 'application/json'})
+        return self.make_request('GET', self.get_safe_api_url(path), **kwargs)
+
+
+class OutboxMessage(models.Model):
+    """
+    A request to a foreign server that the user does not wait on, such as a friend request or a comment on a foreign
+    post. It is sent by the job queue, and retried until the foreign server takes it (see nodes.outbox).
+    """
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "pending"),
+        (DELIVERED, "delivered"),
+        (FAILED, "failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    # Sending a message with the same key again returns the existing message instead of sending it twice
+    idempotency_key = models.CharField(max_length=500, unique=True)
+    node = models.ForeignKey(Node, on_delete=models.CASCADE, related_name='outbox')
+    # What the message is, e.g. "friend_request" or "comment", so its sender can react to it failing
+    kind = models.CharField(max_length=50)
+    # The uid of the local author who sent it, the only one allowed to see its status
+    sender = models.CharField(max_length=500, blank=True)
+    method = models.CharField(max_length=10, default="POST")
+    url = models.CharField(max_length=2000)
+    # JSON body of the request
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    # Status code of the last response, if the foreign server answered
+    response_status = models.IntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['node', 'status', 'next_attempt_at'])]
+
+    def to_status_object(self):
+        return {
+            "id": str(self.id),
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "response_status": self.response_status,
+            "error": self.last_error,
+            "delivered_at": self.delivered_at,
+        }
+
+    def __str__(self):
+        return f'{self.status} {self.kind} to {self.node_id}'
+
+
+class NodeDialect(models.Model):
+    """
+    How a node's API departs from the spec, learned from its responses the first time it is asked (see nodes.dialect),
+    so later requests are made and read the right way at once.
+    Kept separate from Node because saving a Node rehashes its password.
+    """
+    # How author urls write the author's uuid
+    DASHED = "dashed"
+    HEX = "hex"
+    UUID_FORM_CHOICES = (
+        (DASHED, "with dashes"),
+        (HEX, "without dashes"),
+    )
+    # Where a single post is in the response to GET /posts/<post_id>
+    POSTS_LIST = "posts_list"
+    POSTS = "posts"
+    POST = "post"
+    BARE = "bare"
+    POST_SHAPE_CHOICES = (
+        (POSTS_LIST, "first of a list under 'posts'"),
+        (POSTS, "under 'posts'"),
+        (POST, "under 'post'"),
+        (BARE, "the whole response"),
+    )
+
+    node = models.OneToOneField(Node, primary_key=True, on_delete=models.CASCADE, related_name='dialect')
+    # Empty until learned
+    author_uuid_form = models.CharField(max_length=10, choices=UUID_FORM_CHOICES, blank=True)
+    post_shape = models.CharField(max_length=10, choices=POST_SHAPE_CHOICES, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'dialect of {self.node_id}'
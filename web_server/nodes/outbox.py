@@ -0,0 +1,120 @@
+"""
+Outbox of requests to foreign servers that users do not wait on.
+
+A view records what it wants sent as an OutboxMessage and answers right away. Delivery runs in the job queue, one job
+per node that sends the node's due messages oldest first over its pooled connection. A message is delivered once the
+node answers 2xx, or 409 meaning it already has it. It failed for good on any other 4xx, the node will not take it
+however often it is sent. Messages the node could not be reached for, or that got a server error, are tried again
+after settings.OUTBOX_RETRY_DELAY seconds, doubled after every further failure up to settings.OUTBOX_MAX_RETRY_DELAY.
+After settings.OUTBOX_MAX_ATTEMPTS they are dead lettered: marked failed and left for inspection. message_failed is
+sent whenever a message fails, so its sender can undo what it did locally.
+
+Every message has an idempotency key, sending it again while it is pending or once delivered does nothing.
+"""
+from datetime import timedelta
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Min
+from django.dispatch import Signal
+from django.utils import timezone
+import requests
+
+from jobs.queue import enqueue
+from nodes.models import OutboxMessage
+
+# Sent when a message will not be delivered
+message_failed = Signal(providing_args=["message"])
+
+
+def schedule_delivery(node, delay=0):
+    enqueue("deliver_outbox", {"hostname": node.foreign_server_hostname}, node=node,
+            dedup_key=f"deliver_outbox:{node.foreign_server_hostname}", delay=delay)
+
+
+def send(node, kind, url, body, idempotency_key, sender=""):
+    """
+    Queues a POST of a JSON body to a node
+    :param kind: what the message is, passed along to message_failed
+    :param body: the JSON serializable body
+    :param idempotency_key: identifies the message, a message that failed is sent again when its key is sent again
+    :param sender: the uid of the local author sending it
+    :return: the OutboxMessage
+    """
+    try:
+        with transaction.atomic():
+            message = OutboxMessage.objects.create(idempotency_key=idempotency_key, node=node, kind=kind,
+                                                   sender=sender, url=url, body=json.dumps(body))
+    except IntegrityError:
+        message = OutboxMessage.objects.get(idempotency_key=idempotency_key)
+        if message.status != OutboxMessage.FAILED:
+            return message
+        # Tried again by the user, starting over
+        message.status = OutboxMessage.PENDING
+        message.attempts = 0
+        message.next_attempt_at = timezone.now()
+        message.body = json.dumps(body)
+        message.save()
+    schedule_delivery(node)
+    return message
+
+
+def _fail(message, error):
+    message.status = OutboxMessage.FAILED
+    message.last_error = error
+    message.save()
+    message_failed.send(sender=OutboxMessage, message=message)
+
+
+def _deliver(message):
+    """
+    Sends a message once, recording how it went
+    :return: False if the node could not take it right now, and later messages should wait as well
+    """
+    message.attempts += 1
+    try:
+        response = message.node.make_request(message.method, message.url, data=message.body,
+                                             headers={'Content-Type': 'application/json'})
+    except requests.RequestException as e:
+        error = f"Could not connect to the foreign server: {e}"
+    else:
+        message.response_status = response.status_code
+        if 200 <= response.status_code < 300 or response.status_code == 409:
+            message.status = OutboxMessage.DELIVERED
+            message.delivered_at = timezone.now()
+            message.last_error = ""
+            message.save()
+            return True
+        if response.status_code < 500:
+            _fail(message, f"The foreign server refused it: {response.text[:500]}")
+            return True
+        error = f"The foreign server failed with {response.status_code}: {response.text[:500]}"
+
+    if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        _fail(message, error)
+    else:
+        delay = min(settings.OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1), settings.OUTBOX_MAX_RETRY_DELAY)
+        message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        message.last_error = error
+        message.save()
+    return False
+
+
+def deliver_outbox(node):
+    """
+    Sends a batch of the node's messages that are due, and schedules delivering the rest
+    """
+    pending = node.outbox.filter(status=OutboxMessage.PENDING)
+    due = pending.filter(next_attempt_at__lte=timezone.now()).order_by('created_at')[:settings.OUTBOX_BATCH_SIZE]
+    for message in due:
+        if not _deliver(message):
+            # The node is failing, the messages after this one wait for its retry
+            if message.status == OutboxMessage.PENDING:
+                schedule_delivery(node, (message.next_attempt_at - timezone.now()).total_seconds())
+                return
+            break
+
+    next_attempt_at = pending.aggregate(next_attempt_at=Min('next_attempt_at'))['next_attempt_at']
+    if next_attempt_at is not None:
+        schedule_delivery(node, max(0, (next_attempt_at - timezone.now()).total_seconds()))
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from nodes.models import Node
+from social_distribution.utils.basic_auth import forget_node_credentials
+
+
+@receiver(post_save, sender=Node)
+@receiver(post_delete, sender=Node)
+def node_changed(sender, **kwargs):
+    # The node's password or permissions may have changed
+    forget_node_credentials()
@@ -1,3 +1,409 @@
-from django.test import TestCase
+import base64
+import json
+import threading
+from unittest import mock
+import uuid
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import requests
+
+from nodes.health import NodeUnavailable, get_health, reset_health
+from friendship.models import FriendRequest
+from jobs.models import Job
+from jobs.queue import run_pending_jobs
+from nodes.dialect import read_post
+from nodes.models import Node, NodeDialect, OutboxMessage, clear_shared_requests
+from users.foreign_authors import clear_foreign_author_profiles, fetch_foreign_author_profile, \
+    prefetch_foreign_author_profiles
+from users.models import Author
+from social_distribution.utils.basic_auth import validate_remote_server_authentication
+
+
+# This is the unit test for the outbound request layer of the node model
+@override_settings(FEDERATION_CONNECT_TIMEOUT=1, FEDERATION_READ_TIMEOUT=2)
+class TestNodeRequests(TestCase):
+
+    def setUp(self):
+        clear_shared_requests()
+        self.node = Node.objects.create(foreign_server_hostname="pooled.node", foreign_server_username="pooled",
+                                        foreign_server_password="password", foreign_server_api_location="pooled.node/api",
+                                        username_registered_on_foreign_server="us",
+                                        password_registered_on_foreign_server="our password")
+
+    def test_session_is_pooled_per_host(self):
+        self.assertIs(Node.get_session("pooled.node"), Node.get_session("pooled.node"))
+        self.assertIsNot(Node.get_session("pooled.node"), Node.get_session("other.node"))
+
+    def test_make_api_get_request(self):
+        session = Node.get_session("pooled.node")
+        with mock.patch.object(session, 'request', return_value=mock.Mock(status_code=200)) as request:
+            self.node.make_api_get_request('posts')
+
+        request.assert_called_once_with('GET', 'http://pooled.node/api/posts',
+                                        auth=('us', 'our password'),
+                                        headers={'Accept': 'application/json'},
+                                        timeout=(1, 2))
+
+    def test_concurrent_identical_gets_share_a_request(self):
+        session = Node.get_session("pooled.node")
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow_request(*args, **kwargs):
+            started.set()
+            finish.wait(5)
+            return mock.Mock(status_code=200)
+
+        responses = []
+        with mock.patch.object(session, 'request', side_effect=slow_request) as request:
+            threads = [threading.Thread(target=lambda: responses.append(self.node.make_api_get_request('shared')))
+                       for i in range(3)]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            # A request with other credentials is not shared
+            other = Node(foreign_server_hostname="pooled.node", username_registered_on_foreign_server="them",
+                         password_registered_on_foreign_server="their password")
+            finish.set()
+            other.make_api_get_request('shared')
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(request.call_count, 2)
+            self.assertEqual(len(responses), 3)
+            self.assertTrue(all(response is responses[0] for response in responses))
+
+    @override_settings(FEDERATION_SHARED_RESULT_SECONDS=60)
+    def test_recent_responses_are_reused(self):
+        session = Node.get_session("pooled.node")
+        with mock.patch.object(session, 'request', return_value=mock.Mock(status_code=500)) as request:
+            self.node.make_api_get_request('recent')
+            self.node.make_api_get_request('recent')
+            # Server errors are not reused
+            self.assertEqual(request.call_count, 2)
+
+        with mock.patch.object(session, 'request', return_value=mock.Mock(status_code=200)) as request:
+            self.node.make_api_get_request('recent')
+            self.node.make_api_get_request('recent')
+            self.node.make_request('POST', self.node.get_safe_api_url('recent'))
+            self.node.make_request('POST', self.node.get_safe_api_url('recent'))
+            self.assertEqual(request.call_count, 3)
+
+
+# This is the unit test for the circuit breaker and bulkhead in front of every outbound request
+@override_settings(FEDERATION_BREAKER_MIN_CALLS=2, FEDERATION_BREAKER_FAILURE_RATE=0.5,
+                   FEDERATION_BREAKER_OPEN_SECONDS=60, FEDERATION_MAX_IN_FLIGHT=2, FEDERATION_SHARED_RESULT_SECONDS=0)
+class TestNodeHealth(TestCase):
+
+    def setUp(self):
+        reset_health()
+        clear_shared_requests()
+        self.node = Node.objects.create(foreign_server_hostname="health.node", foreign_server_username="health",
+                                        foreign_server_password="password", foreign_server_api_location="health.node")
+        self.session = Node.get_session("health.node")
+
+    def tearDown(self):
+        reset_health()
+
+    def test_breaker_opens_after_failures(self):
+        with mock.patch.object(self.session, 'request', side_effect=requests.ConnectionError) as request:
+            for attempt in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.node.make_api_get_request('posts')
+            # The node is now skipped without being contacted
+            with self.assertRaises(NodeUnavailable):
+                self.node.make_api_get_request('posts')
+            self.assertEqual(request.call_count, 2)
+
+    def test_server_errors_count_as_failures(self):
+        with mock.patch.object(self.session, 'request', return_value=mock.Mock(status_code=500)):
+            self.node.make_api_get_request('posts')
+            self.node.make_api_get_request('posts')
+            with self.assertRaises(NodeUnavailable):
+                self.node.make_api_get_request('posts')
+
+    @override_settings(FEDERATION_BREAKER_OPEN_SECONDS=0)
+    def test_half_open_trial_closes_breaker(self):
+        with mock.patch.object(self.session, 'request', side_effect=requests.ConnectionError):
+            for attempt in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.node.make_api_get_request('posts')
+        self.assertEqual(get_health("health.node").state, "open")
+
+        with mock.patch.object(self.session, 'request', return_value=mock.Mock(status_code=200)) as request:
+            self.node.make_api_get_request('posts')
+            self.node.make_api_get_request('posts')
+            self.assertEqual(request.call_count, 2)
+        self.assertEqual(get_health("health.node").state, "closed")
+
+    @override_settings(FEDERATION_BREAKER_OPEN_SECONDS=0)
+    def test_requests_from_before_opening_are_not_the_trial(self):
+        health = get_health("health.node")
+        # Started while the breaker was closed, and still running once it opens
+        earlier = health.acquire()
+        with mock.patch.object(self.session, 'request', side_effect=requests.ConnectionError):
+            for attempt in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.node.make_api_get_request('posts')
+        self.assertEqual(health.state, "open")
+
+        # The earlier request does not stop the trial from being made
+        trial = health.acquire()
+        self.assertEqual(health.state, "half open")
+        with self.assertRaises(NodeUnavailable):
+            health.acquire()
+        # Nor does it decide the trial, whichever way it went
+        health.release(earlier, False, 0)
+        self.assertEqual(health.state, "half open")
+        health.release(trial, True, 0)
+        self.assertEqual(health.state, "open")
+
+    def test_in_flight_requests_are_capped(self):
+        health = get_health("health.node")
+        token = health.acquire()
+        health.acquire()
+        with mock.patch.object(self.session, 'request') as request:
+            with self.assertRaises(NodeUnavailable):
+                self.node.make_api_get_request('posts')
+            request.assert_not_called()
+
+        health.release(token, False, 0)
+        with mock.patch.object(self.session, 'request', return_value=mock.Mock(status_code=200)):
+            self.assertEqual(self.node.make_api_get_request('posts').status_code, 200)
+
+
+@validate_remote_server_authentication()
+def protected_view(request):
+    return HttpResponse(f"{request.remote_server_authenticated_for_posts}")
+
+
+# This is the unit test for authenticating incoming requests from nodes
+class TestNodeAuthentication(TestCase):
+
+    def setUp(self):
+        self.node = Node.objects.create(foreign_server_hostname="auth.node", foreign_server_username="auth.node",
+                                        foreign_server_password="password", foreign_server_api_location="auth.node",
+                                        post_share=True)
+
+    def get(self, password):
+        credentials = base64.b64encode(f"auth.node:{password}".encode('utf-8')).decode('utf-8')
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION="Basic " + credentials)
+        request.user = mock.Mock(is_authenticated=False)
+        return protected_view(request)
+
+    def test_verified_credentials_are_cached(self):
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True,
+                               side_effect=PBKDF2PasswordHasher.encode) as encode:
+            response = self.get("password")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"True")
+            hashes = encode.call_count
+            self.assertGreater(hashes, 0)
+
+            # The same node again does not hash anything
+            self.assertEqual(self.get("password").status_code, 200)
+            self.assertEqual(encode.call_count, hashes)
+
+            # Wrong passwords are always checked and never let in
+            self.assertEqual(self.get("wrong").status_code, 401)
+            self.assertEqual(self.get("wrong").status_code, 401)
+
+            # Saving the node forgets its credentials, so changed permissions apply right away
+            self.node.foreign_server_password = "password"
+            self.node.post_share = False
+            self.node.save()
+            response = self.get("password")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"False")
+
+    def test_changes_by_other_processes_apply_at_once(self):
+        self.assertEqual(self.get("password").status_code, 200)
+
+        # Updates made elsewhere send no signal to this process
+        Node.objects.filter(pk=self.node.pk).update(post_share=False)
+        self.assertEqual(self.get("password").content, b"False")
+
+        Node.objects.filter(pk=self.node.pk).update(foreign_server_password=make_password("changed"))
+        self.assertEqual(self.get("password").status_code, 401)
+        self.assertEqual(self.get("changed").status_code, 200)
+
+        Node.objects.filter(pk=self.node.pk).delete()
+        self.assertEqual(self.get("changed").status_code, 401)
+
+
+# This is the unit test for sending friend requests and comments to foreign servers from the outbox
+@override_settings(OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_DELAY=10)
+class TestOutbox(TestCase):
+
+    def setUp(self):
+        self.node = Node.objects.create(foreign_server_hostname="outbox.node", foreign_server_username="outbox",
+                                        foreign_server_password="password", foreign_server_api_location="outbox.node")
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'outbox').hex
+        self.author = Author.objects.create(id=id, username='outbox', display_name="Outbox", password="password",
+                                            is_active=True, host="testserver", uid="testserver/author/" + id,
+                                            url="testserver/author/" + id)
+        self.foreign_id = "outbox.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'outbox_friend').hex
+        self.statuses = []
+        self.sent = []
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def fake_request(self, node, method, url, **kwargs):
+        self.sent.append((url, json.loads(kwargs['data'])))
+        status = self.statuses.pop(0)
+        if status is None:
+            raise requests.ConnectionError("refused")
+        return mock.Mock(status_code=status, text="answer")
+
+    def send_friend_request(self):
+        return self.client.post('/friendrequest', json.dumps({
+            "query": "friendrequest",
+            "author": {"id": "http://" + self.author.uid, "host": "http://testserver"},
+            "friend": {"id": "http://" + self.foreign_id, "host": "http://outbox.node"}
+        }), content_type="application/json")
+
+    def deliver(self):
+        # Retries are made due right away instead of waiting for them
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        Job.objects.update(run_at=timezone.now())
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            run_pending_jobs()
+
+    def test_friend_request_delivered_later(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            response = self.send_friend_request()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.sent, [])
+        self.assertTrue(FriendRequest.objects.filter(from_id=self.author.uid, to_id=self.foreign_id).exists())
+
+        self.statuses = [None, 503, 201]
+        self.deliver()
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+        self.deliver()
+        self.deliver()
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.DELIVERED)
+        self.assertEqual(self.sent[0][0], "http://outbox.node/friendrequest")
+        self.assertEqual(self.sent[0][1]["friend"]["id"], "http://" + self.foreign_id)
+
+        status = self.client.get(response['Location']).json()
+        self.assertEqual(status['status'], OutboxMessage.DELIVERED)
+        self.assertEqual(status['attempts'], 3)
+
+    def test_dead_lettered(self):
+        self.send_friend_request()
+        self.statuses = [503, 503, 503]
+        for i in range(3):
+            self.deliver()
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.FAILED)
+        self.assertEqual(len(self.sent), 3)
+        # The author can send the request again
+        self.assertFalse(FriendRequest.objects.exists())
+
+        self.statuses = [201]
+        self.assertEqual(self.send_friend_request().status_code, 202)
+        self.deliver()
+        self.assertEqual(OutboxMessage.objects.exclude(id=message.id).get().status, OutboxMessage.DELIVERED)
+
+    def test_friend_request_sent_again(self):
+        self.send_friend_request()
+        self.statuses = [201]
+        self.deliver()
+        # The foreign author rejected it, our author asks again
+        FriendRequest.objects.all().delete()
+        self.assertEqual(self.send_friend_request().status_code, 202)
+        self.statuses = [201]
+        self.deliver()
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.DELIVERED).count(), 2)
+
+    def test_comment_idempotent(self):
+        url = reverse('view_post_comment', args=['outbox.node/posts/' + uuid.uuid4().hex])
+        comment = {"comment": {"comment": "hello", "contentType": "text/plain", "published": "2020-04-01T10:00:00Z",
+                               "author": {"id": "http://" + self.author.uid}}}
+        responses = [self.client.post(url, json.dumps(comment), content_type="application/json") for i in range(2)]
+        self.assertEqual([response.status_code for response in responses], [202, 202])
+        self.assertEqual(responses[0].json()['outbox']['id'], responses[1].json()['outbox']['id'])
+
+        self.statuses = [400]
+        self.deliver()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0][1]['comment']['comment'], "hello")
+        # Refused comments are not retried
+        self.assertEqual(OutboxMessage.objects.get().status, OutboxMessage.FAILED)
+        self.deliver()
+        self.assertEqual(len(self.sent), 1)
+
+    def test_comment_draft_sent_once(self):
+        url = reverse('view_post_comment', args=['outbox.node/posts/' + uuid.uuid4().hex])
+        # The page stamps every submission with the time it was made, and names the draft with its key
+        for published in ("2020-04-01T10:00:00Z", "2020-04-01T10:00:01Z"):
+            comment = {"comment": {"comment": "twice", "contentType": "text/plain", "published": published,
+                                   "author": {"id": "http://" + self.author.uid}}}
+            response = self.client.post(url, json.dumps(comment), content_type="application/json",
+                                        HTTP_IDEMPOTENCY_KEY="draft-1")
+            self.assertEqual(response.status_code, 202)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+        self.statuses = [201]
+        self.deliver()
+        first_id = self.sent[0][1]['comment']['id']
+        # Another draft is another comment
+        self.client.post(url, json.dumps(comment), content_type="application/json", HTTP_IDEMPOTENCY_KEY="draft-2")
+        self.statuses = [201]
+        self.deliver()
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+        self.assertNotEqual(self.sent[1][1]['comment']['id'], first_id)
+
+
+# This is the unit test for learning how each node's API departs from the spec
+class TestNodeDialect(TestCase):
+
+    def setUp(self):
+        clear_foreign_author_profiles()
+        self.node = Node.objects.create(foreign_server_hostname="dialect.node", foreign_server_username="dialect",
+                                        foreign_server_password="password", foreign_server_api_location="dialect.node")
+        self.author_uuids = [uuid.uuid5(uuid.NAMESPACE_DNS, f'dialect{i}') for i in range(3)]
+
+    def fake_request(self, node, method, url, **kwargs):
+        # The node only knows its authors by their uuid without dashes
+        response = mock.Mock()
+        author_uuid = url.rstrip("/").split("/")[-1]
+        response.status_code = 200 if author_uuid in [author.hex for author in self.author_uuids] else 404
+        response.json.return_value = {"id": url, "displayName": "Dialect"}
+        return response
+
+    def test_author_url_form_is_learned(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request) as make_request:
+            status_code, profile = fetch_foreign_author_profile("dialect.node/author/" + self.author_uuids[0].hex)
+            self.assertEqual(status_code, 200)
+            # The form with dashes was tried first
+            self.assertEqual(make_request.call_count, 2)
+            self.assertEqual(NodeDialect.objects.get(node=self.node).author_uuid_form, NodeDialect.HEX)
+
+            profiles = prefetch_foreign_author_profiles(["http://dialect.node/author/" + str(author)
+                                                         for author in self.author_uuids[1:]])
+            self.assertTrue(all(status_code == 200 for status_code, profile in profiles.values()))
+            self.assertEqual(make_request.call_count, 4)
+
+    def test_post_shape_is_learned(self):
+        post = {"id": "post", "title": "Dialect"}
+        self.assertEqual(read_post(self.node, {"query": "post", "post": post}), post)
+        self.assertEqual(NodeDialect.objects.get(node=self.node).post_shape, NodeDialect.POST)
+        self.node.refresh_from_db()
+        self.assertEqual(read_post(self.node, {"query": "post", "post": post}), post)
+
+        # Envelopes without a post are not taken for one
+        self.assertIsNone(read_post(self.node, {"query": "posts", "posts": []}))
+        # A node changing its shape is learned again
+        self.assertEqual(read_post(self.node, {"query": "posts", "posts": [post]}), post)
+        self.assertEqual(NodeDialect.objects.get(node=self.node).post_shape, NodeDialect.POSTS_LIST)
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+urlpatterns = [
+    # Internal use only
+    path('outbox/<uuid:message_id>', views.outbox_message_status, name='outbox_message'),
+]
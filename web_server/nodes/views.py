@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 
-# Create your views here.
+from nodes.models import OutboxMessage
+
+
+@login_required
+def outbox_message_status(request, message_id):
+    """
+    For endpoint http://service/nodes/outbox/{MESSAGE_ID}
+
+    How delivering something the authenticated user sent to a foreign server is going, for pages to poll
+    """
+    message = get_object_or_404(OutboxMessage, id=message_id, sender=request.user.uid)
+    return JsonResponse(message.to_status_object())
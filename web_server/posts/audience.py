@@ -0,0 +1,91 @@
+"""
+Maintenance of the PostAudience table.
+
+A post's audience is computed from its visibility: public posts are seen by EVERYONE, server only posts by the
+authors on the post author's server, friends posts by the authors who friended the author, FOAF posts by them and by
+every author sharing a friend with the author, and private posts by the authors in visibleTo. Authors always see their
+own posts and unlisted posts have no audience. Friendships come from the in-process friend graph, in the direction
+the stream used to query them: a viewer sees the friends posts of the authors their own Friend rows point at.
+"""
+from uuid import UUID
+
+from django.db import transaction
+
+from friendship.graph import friend_graph
+from friendship.models import sanitize_author_id
+from posts.models import Post, PostAudience
+
+
+def audience_of(post):
+    """
+    :return: set of the viewers (as stored in PostAudience) that can see the post
+    """
+    if post.unlisted:
+        return set()
+
+    author_id = sanitize_author_id(post.author_id)
+    viewers = {author_id}
+    if post.visibility == Post.PUBLIC:
+        viewers.add(PostAudience.EVERYONE)
+    elif post.visibility == Post.SERVERONLY:
+        viewers.add(PostAudience.server_audience(post.author.host))
+    elif post.visibility == Post.FRIENDS:
+        viewers |= friend_graph.friended_by(author_id)
+    elif post.visibility == Post.FOAF:
+        viewers |= friend_graph.friended_by(author_id) | friend_graph.friends_of_friends(author_id)
+    elif post.visibility == Post.PRIVATE:
+        viewers |= {sanitize_author_id(visible.author_uid) for visible in post.visibleTo.all()}
+    return viewers
+
+
+def viewer_audience(author):
+    """
+    :return: list of every viewer in PostAudience the given local author is part of
+    """
+    return [sanitize_author_id(author.uid), PostAudience.EVERYONE, PostAudience.server_audience(author.host)]
+
+
+def refresh_post_audience(post):
+    """
+    Brings the audience of a single post up to date
+    """
+    viewers = audience_of(post)
+    with transaction.atomic():
+        existing = set(PostAudience.objects.filter(post=post).values_list('viewer', flat=True))
+        if existing - viewers:
+            PostAudience.objects.filter(post=post, viewer__in=existing - viewers).delete()
+        PostAudience.objects.bulk_create([PostAudience(post=post, viewer=viewer) for viewer in viewers - existing])
+
+
+def refresh_audience_of_authors(author_ids):
+    """
+    Brings the audience of the friends and FOAF posts of the given authors up to date, after their friends changed
+    :param author_ids: iterable of author uids
+    """
+    uids = set()
+    for author_id in author_ids:
+        author_id = sanitize_author_id(author_id)
+        uids.add(author_id)
+        # Authors may have been stored with the dashes in their uuid
+        splits = author_id.rsplit("/", 1)
+        try:
+            uids.add(splits[0] + "/" + str(UUID(splits[1])))
+        except (IndexError, ValueError):
+            pass
+
+    for post in Post.objects.filter(author_id__in=uids, visibility__in=[Post.FRIENDS, Post.FOAF]):
+        refresh_post_audience(post)
+
+
+def rebuild_post_audience():
+    """
+    Recomputes the audience of every post from scratch
+    :return: the number of audience rows
+    """
+    rows = []
+    for post in Post.objects.select_related('author').prefetch_related('visibleTo'):
+        rows += [PostAudience(post=post, viewer=viewer) for viewer in audience_of(post)]
+    with transaction.atomic():
+        PostAudience.objects.all().delete()
+        PostAudience.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
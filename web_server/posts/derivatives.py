@@ -0,0 +1,70 @@
+"""
+Resized variants of the images in the image store (posts.images), so pages showing many images do not embed or
+download every original.
+
+A variant is made on the first request for it, by scaling the original down to the width the variant allows
+(settings.IMAGE_VARIANT_WIDTHS) and recompressing it in the original's format. Variants are kept on disk under
+settings.IMAGE_DERIVATIVE_ROOT, named after the image hash like the store itself. Serving a variant marks it as used,
+and whenever a new variant is written the least recently used ones are removed until the variants take up no more
+than settings.IMAGE_DERIVATIVE_CACHE_BYTES.
+"""
+import os
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from posts.images import open_image
+from social_distribution.utils.disk_cache import atomic_write, evict_least_recently_used, touch
+
+ORIGINAL = "original"
+
+
+def derivative_path(image_hash, variant):
+    return os.path.join(settings.IMAGE_DERIVATIVE_ROOT, variant, image_hash[:2], image_hash)
+
+
+def _resize(image_hash, width, path):
+    """
+    Writes the original image scaled down to width to path
+    :return: False if the original could not be read as an image
+    """
+    try:
+        with open_image(image_hash) as f:
+            image = Image.open(f)
+            image_format = image.format
+            # Photos are often stored sideways with their orientation in their EXIF data, which is dropped on save
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            else:
+                image.load()
+    except (OSError, SyntaxError, ValueError):
+        return False
+
+    with atomic_write(path) as f:
+        if image_format == "JPEG":
+            image.convert("RGB").save(f, "JPEG", quality=settings.IMAGE_DERIVATIVE_JPEG_QUALITY, optimize=True)
+        else:
+            image.save(f, image_format or "PNG", optimize=True)
+    return True
+
+
+def open_image_variant(image_hash, variant):
+    """
+    Opens a variant of a stored image, making it if it was not made yet or has been evicted
+    :param variant: ORIGINAL or one of settings.IMAGE_VARIANT_WIDTHS
+    :return: the variant opened for binary reading, the original if the variant is ORIGINAL or the original can not
+             be resized
+    :raise: ValueError if the variant is unknown, FileNotFoundError if no image with the hash is stored
+    """
+    if variant == ORIGINAL:
+        return open_image(image_hash)
+    if variant not in settings.IMAGE_VARIANT_WIDTHS:
+        raise ValueError(f"Unknown image variant {variant}")
+
+    path = derivative_path(image_hash, variant)
+    if not touch(path):
+        if not _resize(image_hash, settings.IMAGE_VARIANT_WIDTHS[variant], path):
+            return open_image(image_hash)
+        evict_least_recently_used(settings.IMAGE_DERIVATIVE_ROOT, settings.IMAGE_DERIVATIVE_CACHE_BYTES, keep=path)
+    return open(path, 'rb')
@@ -0,0 +1,356 @@
+"""
+Fetching posts from foreign nodes.
+
+A foreign author's posts are only available a page at a time from their node. fetch_foreign_author_posts asks for the
+first page to learn how many there are, then requests all the other pages at the same time, and caches the complete
+list per (node, author) for settings.FOREIGN_AUTHOR_POSTS_CACHE_TTL seconds. Visibility is not applied here, the same
+list is shared by every viewer.
+
+A node's public posts are read a page at a time with fetch_public_posts_page, and each page is cached for
+settings.FOREIGN_PUBLIC_POSTS_CACHE_TTL seconds so that streams paging through the same node share the downloads.
+
+Foreign posts are also kept in the database (ForeignPost). ingest_foreign_posts, run periodically by the
+ingest_foreign_posts management command, copies the public posts of every node, upserting them by id. Once a node has
+been ingested its public posts are read from the database rather than the node, so slow or broken nodes do not slow
+down the stream. Posts fetched live, such as a foreign author's posts, are stored as well and served from the
+database when their node can not be reached. A stored post that is viewed once it is older than
+settings.FOREIGN_POST_FRESH_TTL is fetched again by the refresh_foreign_post job (see posts.jobs), the view does not
+wait for it.
+
+The comments of foreign posts are cached for settings.FOREIGN_COMMENTS_CACHE_TTL seconds, and served stale for
+settings.FOREIGN_COMMENTS_STALE_TTL more seconds while they are fetched again in the background.
+"""
+from datetime import datetime, timezone as dt_timezone
+import json
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import requests
+
+from friendship.models import sanitize_author_id
+from nodes.dialect import read_post
+from nodes.models import Node
+from posts.models import ForeignPost, ForeignPostSync
+from social_distribution.utils.cache import StaleWhileRevalidateCache, TTLCache
+from social_distribution.utils.concurrency import fan_out
+
+_author_posts = TTLCache(settings.FOREIGN_AUTHOR_POSTS_CACHE_SIZE, settings.FOREIGN_AUTHOR_POSTS_CACHE_TTL)
+_public_pages = TTLCache(settings.FOREIGN_PUBLIC_POSTS_CACHE_SIZE, settings.FOREIGN_PUBLIC_POSTS_CACHE_TTL)
+_comments = StaleWhileRevalidateCache(settings.FOREIGN_COMMENTS_CACHE_SIZE, settings.FOREIGN_COMMENTS_CACHE_TTL,
+                                      settings.FOREIGN_COMMENTS_STALE_TTL)
+
+# Posts whose publish time can not be read are shown after every other post
+UNKNOWN_PUBLISHED = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+
+def parse_published(post):
+    """
+    :return: the publish time of a post as a node listed it, as an aware datetime
+    """
+    try:
+        published = parse_datetime(str(post.get("published", "")))
+    except ValueError:
+        published = None
+    if published is None:
+        return UNKNOWN_PUBLISHED
+    if timezone.is_naive(published):
+        published = timezone.make_aware(published, dt_timezone.utc)
+    return published
+
+
+def fetch_foreign_author_posts_page(node, api_author_id, page, size):
+    """
+    :return: the JSON body of one page of an author's posts
+    :raise: requests.RequestException or ValueError if the node did not answer with a page of posts
+    """
+    response = node.make_request('GET', node.get_safe_api_url(f"author/{api_author_id}/posts"),
+                                 params={'size': size, 'page': page})
+    if response.status_code != 200:
+        raise ValueError(f"Node answered page {page} with status {response.status_code}")
+    body = response.json()
+    if not isinstance(body.get("posts"), list):
+        raise ValueError(f"Node answered page {page} without a list of posts")
+    return body
+
+
+def fetch_foreign_author_posts(node, author_id, api_author_id=None):
+    """
+    Returns every post of a foreign author, from the cache if possible
+    :param node: the Node the author belongs to
+    :param author_id: the uid of the author
+    :param api_author_id: how the author is identified in the node's API, defaults to author_id
+    :return: list of the posts as the node listed them
+    :raise: requests.RequestException or ValueError if the first page could not be fetched
+    """
+    key = (node.foreign_server_hostname, sanitize_author_id(author_id))
+    posts = _author_posts.get(key)
+    if posts is not None:
+        return posts
+
+    if api_author_id is None:
+        api_author_id = author_id
+    size = settings.FOREIGN_AUTHOR_POSTS_PAGE_SIZE
+    try:
+        first_page = fetch_foreign_author_posts_page(node, api_author_id, 1, size)
+    except (requests.RequestException, ValueError):
+        # Serve what was stored the last time the node answered
+        stored = ForeignPost.objects.filter(node=node, author_uid=sanitize_author_id(author_id)).order_by('-published')
+        if not stored.exists():
+            raise
+        return [post.to_api_object() for post in stored]
+    posts = list(first_page["posts"])
+
+    # Nodes may serve smaller pages than asked for
+    if 0 < len(posts) < size:
+        size = len(posts)
+    pages = math.ceil(int(first_page.get("count", len(posts))) / size) if len(posts) > 0 else 1
+    results, errors = fan_out({page: (lambda page=page: fetch_foreign_author_posts_page(node, api_author_id,
+                                                                                          page, size))
+                               for page in range(2, pages + 1)})
+    for page in sorted(results):
+        posts += results[page]["posts"]
+
+    store_foreign_posts(node, posts, author_id)
+    # Only complete lists are cached, so missing pages are tried again next time
+    if len(errors) == 0:
+        _author_posts.set(key, posts)
+    else:
+        print(f"Could not fetch every page of posts of '{author_id}': {errors}")
+    return posts
+
+
+def clear_foreign_author_posts():
+    _author_posts.clear()
+
+
+def fetch_public_posts_page(node, page, size):
+    """
+    Returns one page of a node's public posts, from the cache if possible. Nodes number their pages from 1.
+    :return: list of the posts as the node listed them, empty once paging past the last page
+    :raise: requests.RequestException or ValueError if the node could not deliver the page
+    """
+    key = (node.foreign_server_hostname, page, size)
+    posts = _public_pages.get(key)
+    if posts is None:
+        posts = download_public_posts_page(node, page, size)
+        _public_pages.set(key, posts)
+    return posts
+
+
+def download_public_posts_page(node, page, size):
+    """
+    Same as fetch_public_posts_page, bypassing the cache
+    """
+    api_location = node.get_safe_api_url('posts')
+    response = node.make_request('GET', api_location,
+                                 headers={
+                                     'Accept': 'application/json'
+                                 },
+                                 params={
+                                     'size': size,
+                                     'page': page
+                                 })
+    if response.status_code == 404 and page > 1:
+        # Paging past the last page, the node has exhausted it's results
+        posts = []
+    elif response.status_code != 200:
+        raise ValueError(f"Received response code {response.status_code} at api endpoint: {api_location}")
+    else:
+        try:
+            posts = response.json()['posts']
+        except Exception as e:
+            raise ValueError(f"During JSON decode got {e} for response like '{response.content[:20]}...'")
+        if not isinstance(posts, list):
+            raise ValueError(f"Node answered page {page} without a list of posts")
+    return posts
+
+
+def clear_public_posts_pages():
+    _public_pages.clear()
+
+
+def foreign_post_id(post):
+    """
+    :return: the id of a foreign post, without any url the node may have put around it
+    """
+    return str(post["id"]).rstrip("/").split("/")[-1]
+
+
+def download_foreign_post(node, post_id):
+    """
+    Downloads a single post from a node
+    :return: the post as the node sent it
+    :raise: requests.RequestException if the node could not be reached, ValueError if it did not answer with a post
+    """
+    response = node.make_api_get_request(f'posts/{post_id}')
+    if response.status_code != 200:
+        raise ValueError(f"The node answered with status {response.status_code}")
+    try:
+        post = read_post(node, response.json())
+    except ValueError:
+        post = None
+    if post is None:
+        raise ValueError(f"The response was not understandable. The response looks like: {response.content[:20]}")
+    return post
+
+
+def refresh_foreign_post(node, post_id):
+    """
+    Downloads a single post from a node and stores it
+    :return: the post as the node sent it
+    :raise: requests.RequestException or ValueError as download_foreign_post does
+    """
+    post = download_foreign_post(node, post_id)
+    store_foreign_posts(node, [post])
+    return post
+
+
+def download_foreign_comments(node, post_id):
+    """
+    Downloads the comments of a post from a node
+    :return: the comments, in the format of the view_post_comment view
+    :raise: requests.RequestException if the node could not be reached, ValueError if it did not answer with comments
+    """
+    response = node.make_api_get_request(f'posts/{post_id}/comments')
+    try:
+        body = response.json()
+        comments = [{
+            "author": comment["author"],
+            "content": comment["comment"],
+            "contentType": comment["contentType"],
+            "published": comment["published"],
+            "id": comment["id"]
+        } for comment in body["comments"]]
+        return {
+            "query": "comments",
+            "count": body["count"],
+            "size": body["size"],
+            "comments": comments
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"The node answered with status {response.status_code} and no comments: {e}")
+
+
+def fetch_foreign_comments(node, post_id):
+    """
+    Returns the comments of a foreign post, from the cache if possible
+    :return: (comments as download_foreign_comments returns them, seconds since they were downloaded)
+    :raise: requests.RequestException or ValueError if they are not cached and could not be downloaded
+    """
+    return _comments.fetch((node.foreign_server_hostname, post_id),
+                           lambda: download_foreign_comments(node, post_id))
+
+
+def clear_foreign_comments():
+    _comments.clear()
+
+
+def store_foreign_posts(node, posts, author_id=None):
+    """
+    Upserts the posts of a node by id, only writing the posts that changed. Posts without an id are skipped, posts
+    without a visibility are public.
+    :param posts: list of the posts as the node listed them
+    :param author_id: the uid of the author of every post, for posts listed under their author
+    :return: set of the ids of the stored posts
+    """
+    now = timezone.now()
+    by_id = dict()
+    for post in posts:
+        if not isinstance(post, dict) or not post.get("id"):
+            continue
+        by_id[foreign_post_id(post)] = post
+
+    existing = dict(ForeignPost.objects.filter(id__in=by_id.keys()).values_list('id', 'data'))
+    with transaction.atomic():
+        for post_id, post in by_id.items():
+            data = json.dumps(post, sort_keys=True)
+            if existing.get(post_id) == data:
+                continue
+            author = post.get("author")
+            if isinstance(author, dict):
+                author = author.get("id", "")
+            if author_id is not None:
+                author = author_id
+            ForeignPost.objects.update_or_create(id=post_id, defaults={
+                'node': node,
+                'author_uid': sanitize_author_id(str(author or "")),
+                'title': str(post.get("title", ""))[:256],
+                'contentType': str(post.get("contentType", post.get("content_type", "")))[:32],
+                'published': parse_published(post),
+                'visibility': str(post.get("visibility") or "PUBLIC")[:16],
+                'unlisted': bool(post.get("unlisted", False)),
+                'data': data,
+                'fetched_at': now
+            })
+        # Posts that did not change were still seen just now
+        ForeignPost.objects.filter(id__in=existing.keys() & by_id.keys()).update(fetched_at=now)
+    return set(by_id.keys())
+
+
+def download_node_public_posts(node):
+    """
+    Downloads a node's public posts, newest first, up to settings.FOREIGN_POST_INGEST_MAX_PAGES pages
+    :return: (posts, complete) where complete tells if the node had no posts past the ones returned
+    :raise: requests.RequestException or ValueError if the node could not deliver a page
+    """
+    size = settings.FOREIGN_PUBLIC_POSTS_PAGE_SIZE
+    posts = []
+    for page in range(1, settings.FOREIGN_POST_INGEST_MAX_PAGES + 1):
+        page_posts = download_public_posts_page(node, page, size)
+        if len(page_posts) == 0:
+            return posts, True
+        posts += page_posts
+    return posts, False
+
+
+def ingest_foreign_posts(nodes=None):
+    """
+    Copies the public posts of the given nodes into ForeignPost, asking all of them at the same time. Public posts a
+    node no longer lists are removed.
+    :param nodes: the nodes to ingest, defaults to every node
+    :return: dict from hostname to error for the nodes that could not be ingested
+    """
+    if nodes is None:
+        nodes = Node.objects.all()
+    nodes = {node.foreign_server_hostname: node for node in nodes}
+    results, errors = fan_out({hostname: (lambda node=node: download_node_public_posts(node))
+                               for hostname, node in nodes.items()})
+
+    now = timezone.now()
+    for hostname, (posts, complete) in results.items():
+        node = nodes[hostname]
+        seen = store_foreign_posts(node, posts)
+        gone = ForeignPost.objects.filter(node=node, visibility="PUBLIC", unlisted=False).exclude(id__in=seen)
+        if not complete:
+            # Only the newest posts were downloaded, older ones are not known to be gone
+            gone = gone.filter(published__gte=min((parse_published(post) for post in posts),
+                                                  default=UNKNOWN_PUBLISHED))
+        gone.delete()
+        ForeignPostSync.objects.update_or_create(node=node, defaults={
+            'attempted_at': now, 'synced_at': now, 'error': ''})
+    for hostname, error in errors.items():
+        # The posts from the last successful ingestion are kept
+        ForeignPostSync.objects.update_or_create(node=nodes[hostname], defaults={
+            'attempted_at': now, 'error': error})
+    return errors
+
+
+def ingested_public_posts():
+    """
+    :return: queryset of the stored public posts of every node that has been ingested, newest first
+    """
+    return ForeignPost.objects.filter(node__post_sync__synced_at__isnull=False, visibility="PUBLIC",
+                                      unlisted=False).order_by('-published', '-id')
+
+
+def public_posts_page(node, page, size):
+    """
+    Same as fetch_public_posts_page, but read from the database once the node has been ingested
+    """
+    if not ForeignPostSync.objects.filter(node=node, synced_at__isnull=False).exists():
+        return fetch_public_posts_page(node, page, size)
+    posts = ingested_public_posts().filter(node=node)[(page - 1) * size:page * size]
+    return [post.to_api_object() for post in posts]
@@ -0,0 +1,143 @@
+"""
+Local disk cache of the foreign images proxied for markdown posts (see posts.views.proxy_foreign_server_image).
+
+Foreign servers need our credentials to serve images, so the browser asks us and we ask them. Each image is downloaded
+once, decoded if the foreign server sends it inside a post's JSON, and kept under settings.FOREIGN_IMAGE_CACHE_ROOT
+named after the SHA-256 of its url, next to a small file holding its content type and when it was downloaded. Images
+are downloaded again once they are older than settings.FOREIGN_IMAGE_CACHE_TTL seconds, and the least recently served
+ones are removed once the cache takes up more than settings.FOREIGN_IMAGE_CACHE_BYTES.
+
+Concurrent requests for the same image in a process wait for a single download instead of each making their own.
+"""
+import base64
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from social_distribution.utils.disk_cache import atomic_write, evict_least_recently_used, touch
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ForeignImageError(Exception):
+    """
+    Raised when the foreign server answered, but not with an image
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+_downloads = dict()
+_downloads_lock = threading.Lock()
+
+
+@contextmanager
+def _single_flight(key):
+    """
+    Lets a single thread at a time in for the same key, the others wait for it to finish
+    """
+    with _downloads_lock:
+        entry = _downloads.get(key)
+        if entry is None:
+            # [lock, number of threads using the lock]
+            entry = _downloads[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _downloads_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _downloads[key]
+
+
+def _paths(url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    path = os.path.join(settings.FOREIGN_IMAGE_CACHE_ROOT, key[:2], key)
+    return path, path + ".json"
+
+
+def _open_cached(path, meta_path):
+    """
+    :return: (file, content type) of the cached image, None if it is not cached or has expired
+    """
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - meta["fetched_at"] > settings.FOREIGN_IMAGE_CACHE_TTL:
+            return None
+        image = open(path, 'rb')
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    touch(path)
+    touch(meta_path)
+    return image, meta["content_type"]
+
+
+def _download(node, url, path):
+    """
+    Downloads an image to path. The url may serve the image itself, or a post with the image base64 encoded in it.
+    :return: the content type of the image
+    :raise: requests.RequestException if the node could not be reached, ForeignImageError if it did not send an image
+    """
+    response = node.make_request('GET', url, headers={'Accept': 'application/json'}, stream=True)
+    try:
+        if response.status_code != 200:
+            raise ForeignImageError(f'The server failed to deliver a valid response. The response was '
+                                    f'{response.content[:200]}', response.status_code)
+
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.startswith('image/'):
+            with atomic_write(path) as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            return content_type
+
+        try:
+            post = response.json()['posts'][0]
+            content_type = post['contentType'].split(';')[0]
+            data = base64.b64decode(post['content'])
+        except Exception as e:
+            raise ForeignImageError(f'The foreign server responded, but the post returned was invalid: {e}', 500)
+        if not content_type.startswith('image/'):
+            raise ForeignImageError(f'The foreign post is not an image, it is {content_type}', 500)
+        with atomic_write(path) as f:
+            f.write(data)
+        return content_type
+    finally:
+        response.close()
+
+
+def open_foreign_image(node, url):
+    """
+    Opens a foreign image from the cache, downloading it first if it is not cached or has expired
+    :param node: the node serving the image
+    :param url: the image's url
+    :return: (file, content type) where file is the image opened for binary reading
+    :raise: requests.RequestException if the node could not be reached, ForeignImageError if it did not send an image
+    """
+    path, meta_path = _paths(url)
+    cached = _open_cached(path, meta_path)
+    if cached is not None:
+        return cached
+
+    with _single_flight(path):
+        # Another thread may have downloaded it while this one waited
+        cached = _open_cached(path, meta_path)
+        if cached is not None:
+            return cached
+
+        content_type = _download(node, url, path)
+        with atomic_write(meta_path) as f:
+            f.write(json.dumps({"content_type": content_type, "fetched_at": time.time()}).encode('utf-8'))
+        image = open(path, 'rb')
+        evict_least_recently_used(settings.FOREIGN_IMAGE_CACHE_ROOT, settings.FOREIGN_IMAGE_CACHE_BYTES, keep=path)
+        return image, content_type
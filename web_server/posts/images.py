@@ -0,0 +1,69 @@
+"""
+Content addressed store for the images of image posts.
+
+Images are kept as plain binary files under settings.IMAGE_STORE_ROOT, named after the SHA-256 of their bytes, so the
+same image uploaded twice is only stored once and a stored image never changes. Posts reference their image by that
+hash (Post.image_hash) so it can be streamed and resized without decoding base64 on every request.
+
+The store is on the local disk of each server, which is not shared between dynos and does not outlive a deploy, so it
+is only a cache: the image stays in Post.content and is written back to the store by restore_image when missing.
+"""
+import base64
+import binascii
+import hashlib
+import os
+
+from django.conf import settings
+
+from social_distribution.utils.disk_cache import atomic_write
+
+
+def image_path(image_hash):
+    """
+    :return: where the image with the given hash is stored, spread over subdirectories to keep directories small
+    """
+    return os.path.join(settings.IMAGE_STORE_ROOT, image_hash[:2], image_hash[2:4], image_hash)
+
+
+def store_image(data):
+    """
+    Stores an image unless the same bytes are already stored
+    :param data: the bytes of the image
+    :return: the hash to retrieve the image with
+    """
+    image_hash = hashlib.sha256(data).hexdigest()
+    path = image_path(image_hash)
+    if not os.path.exists(path):
+        with atomic_write(path) as f:
+            f.write(data)
+    return image_hash
+
+
+def restore_image(image_hash, content):
+    """
+    Writes an image back to the store from the base64 content of its post if this server does not have it yet
+    :return: True if the image is stored, False if it is missing and cannot be made from the content
+    """
+    if os.path.exists(image_path(image_hash)):
+        return True
+    try:
+        data = base64.b64decode(content, validate=True)
+    except binascii.Error:
+        return False
+    return bool(data) and store_image(data) == image_hash
+
+
+def open_image(image_hash):
+    """
+    :return: the stored image opened for binary reading
+    :raise: FileNotFoundError if no image with the hash is stored
+    """
+    return open(image_path(image_hash), 'rb')
+
+
+def image_base64(image_hash):
+    """
+    :return: the stored image encoded in base64, as the API carries images inline
+    """
+    with open_image(image_hash) as f:
+        return base64.b64encode(f.read()).decode('utf-8')
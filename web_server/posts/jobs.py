@@ -0,0 +1,21 @@
+"""
+Background jobs keeping the local copies of foreign posts up to date.
+"""
+from jobs.queue import enqueue, register_job
+from nodes.models import Node
+from posts.federation import refresh_foreign_post
+
+
+def schedule_foreign_post_refresh(node, post_id):
+    """
+    Schedules fetching a stored foreign post from its node again
+    """
+    enqueue("refresh_foreign_post", {"hostname": node.foreign_server_hostname, "post_id": post_id}, node=node,
+            dedup_key=f"refresh_foreign_post:{node.foreign_server_hostname}:{post_id}")
+
+
+@register_job("refresh_foreign_post")
+def refresh_foreign_post_job(hostname, post_id):
+    node = Node.objects.filter(foreign_server_hostname=hostname).first()
+    if node is not None:
+        refresh_foreign_post(node, post_id)
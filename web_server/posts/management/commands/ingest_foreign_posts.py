@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.federation import ingest_foreign_posts
+
+
+class Command(BaseCommand):
+    help = "Copies the public posts of every node into the database, meant to be scheduled periodically"
+
+    def handle(self, *args, **options):
+        errors = ingest_foreign_posts()
+        for hostname, error in errors.items():
+            self.stderr.write(f"Could not ingest posts of '{hostname}': {error}")
+        self.stdout.write("Foreign posts ingested")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.audience import rebuild_post_audience
+
+
+class Command(BaseCommand):
+    help = "Recomputes who can see every post, e.g. after friendships were changed outside of the application"
+
+    def handle(self, *args, **options):
+        rows = rebuild_post_audience()
+        self.stdout.write(f"Rebuilt post audience with {rows} rows")
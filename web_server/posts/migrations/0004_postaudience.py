@@ -0,0 +1,25 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_auto_20200401_1536'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostAudience',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewer', models.CharField(max_length=512)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='audience', to='posts.Post')),
+            ],
+            options={
+                'unique_together': {('viewer', 'post')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_postaudience'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='post',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['visibility', 'unlisted', '-published'], name='post_visibility_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'unlisted', '-published'], name='post_author_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visibleto',
+            index=models.Index(fields=['author_uid'], name='visibleto_author_uid_idx'),
+        ),
+    ]
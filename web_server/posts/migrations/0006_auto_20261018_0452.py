@@ -0,0 +1,47 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0001_initial'),
+        ('posts', '0005_auto_20261018_0444'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForeignPostSync',
+            fields=[
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='post_sync', serialize=False, to='nodes.Node')),
+                ('attempted_at', models.DateTimeField(null=True)),
+                ('synced_at', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ForeignPost',
+            fields=[
+                ('id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('author_uid', models.CharField(max_length=500)),
+                ('title', models.CharField(blank=True, max_length=256)),
+                ('contentType', models.CharField(blank=True, max_length=32)),
+                ('published', models.DateTimeField()),
+                ('visibility', models.CharField(max_length=16)),
+                ('unlisted', models.BooleanField(default=False)),
+                ('data', models.TextField()),
+                ('fetched_at', models.DateTimeField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='nodes.Node')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='foreignpost',
+            index=models.Index(fields=['visibility', 'unlisted', '-published'], name='foreignpost_vis_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foreignpost',
+            index=models.Index(fields=['author_uid', '-published'], name='foreignpost_author_pub_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:59
+
+import base64
+import binascii
+import hashlib
+
+from django.db import migrations, models
+
+IMAGE_TYPES = ["image/png;base64", "image/jpeg;base64"]
+
+
+def hash_images(apps, schema_editor):
+    # Only the hash is set, the content stays and images are written to the store of each server as they are served
+    Post = apps.get_model('posts', 'Post')
+    for post in Post.objects.filter(contentType__in=IMAGE_TYPES).exclude(content=""):
+        try:
+            post.image_hash = hashlib.sha256(base64.b64decode(post.content, validate=True)).hexdigest()
+        except binascii.Error:
+            continue
+        post.save(update_fields=['image_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_auto_20261018_0452'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(hash_images, migrations.RunPython.noop),
+    ]
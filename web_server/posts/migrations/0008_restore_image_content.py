@@ -0,0 +1,25 @@
+import os
+
+from django.db import migrations
+
+from posts.images import image_base64, image_path
+
+
+def restore_cleared_content(apps, schema_editor):
+    # An earlier version of 0007 moved images out of content into the image store, which is not shared between servers
+    Post = apps.get_model('posts', 'Post')
+    for post in Post.objects.exclude(image_hash="").filter(content=""):
+        if os.path.exists(image_path(post.image_hash)):
+            post.content = image_base64(post.image_hash)
+            post.save(update_fields=['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_image_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(restore_cleared_content, migrations.RunPython.noop),
+    ]
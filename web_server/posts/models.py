@@ -1,6 +1,12 @@
+import base64
+import binascii
+import json
+import os
 from uuid import uuid4
 
 from django.db import models
+from nodes.models import Node
+from posts.images import image_base64, image_path, restore_image, store_image
 from users.models import Author
 
 from django.conf import settings
@@ -43,6 +49,8 @@ class Post(models.Model):
     contentType = models.CharField(max_length=32, choices=CONTENT_TYPE_CHOICES, default=TYPE_MARKDOWN)
 
     content = models.TextField()
+    # Image posts keep their image in the image store (posts.images) instead of content, this is its SHA-256
+    image_hash = models.CharField(max_length=64, blank=True)
     # @todo Should deleting an author delete their posts? I feel like a good user experience is to say the
     # post still exists, but the user has been deleted, as per reddit
     author = models.ForeignKey(Author, on_delete=models.PROTECT)
@@ -85,8 +93,55 @@ class Post(models.Model):
     # Unlisted posts are hidden from users. By default posts should show to users.
     unlisted = models.BooleanField(default=False)
 
+    # Posts are ordered where they are listed, a default ordering would be applied to every query
     class Meta:
-        ordering = ["published"]
+        indexes = [
+            # Listings of public (and other visibility) posts, newest first
+            models.Index(fields=['visibility', 'unlisted', '-published'], name='post_visibility_published_idx'),
+            # Listings of an author's posts, newest first
+            models.Index(fields=['author', 'unlisted', '-published'], name='post_author_published_idx'),
+        ]
+
+    def is_image(self):
+        return self.contentType in (self.TYPE_PNG, self.TYPE_JPEG)
+
+    def save(self, *args, **kwargs):
+        # Images arrive base64 encoded in content, they are also put in this server's image store to be streamed from.
+        # The content is kept, as the store is not shared between servers (see posts.images)
+        if self.is_image() and self.content:
+            try:
+                self.image_hash = store_image(base64.b64decode(self.content, validate=True))
+            except binascii.Error:
+                # Not valid base64, kept as it was given
+                pass
+        elif not self.is_image():
+            self.image_hash = ""
+        super().save(*args, **kwargs)
+
+    def api_content(self):
+        """
+        Returns the content as the API carries it, with images inline in base64
+        """
+        if self.content or not self.image_hash:
+            return self.content
+        try:
+            return image_base64(self.image_hash)
+        except FileNotFoundError:
+            # The image is lost, see image_lost
+            return ""
+
+    def restore_image(self):
+        """
+        Makes sure this server's image store has the image of the post
+        :return: False if the image is lost, it is in neither the content nor the store
+        """
+        return not self.image_hash or restore_image(self.image_hash, self.content)
+
+    def image_lost(self):
+        """
+        :return: True for image posts whose image is in neither the content nor the store, listings leave them out
+        """
+        return bool(self.image_hash) and not self.content and not os.path.exists(image_path(self.image_hash))
 
     def __str__(self):
         # number of chars to show in content snippet before cutting off with elipsis
@@ -106,7 +161,9 @@ class Post(models.Model):
 
         # We only get the first 5 comments
         # Get the comments, be aware that comments might not be returned if the foreign author of the comment is unavailable
-        comments_list = [comment.to_api_object() for comment in self.comment_set.all().order_by("-published")[:5]]
+        comments = list(self.comment_set.all().order_by("-published")[:5])
+        comment_authors = self.comment_set.model.resolve_authors(comments)
+        comments_list = [comment.to_api_object(comment_authors) for comment in comments]
         filtered_comments_list = [comment for comment in comments_list if 'error' not in comment['author']]
 
 
@@ -117,7 +174,7 @@ class Post(models.Model):
             "origin": self.origin,
             "description": self.description,
             "contentType": self.contentType,
-            "content": self.content,
+            "content": self.api_content(),
             "author": self.author.to_api_object(),
             "categories": [category.name for category in self.categories.all()],
             "count": len(filtered_comments_list),
@@ -145,6 +202,84 @@ class VisibleTo(models.Model):
     # For the reverse relation ship, it is called their visibleTo
     accessed_post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='visibleTo')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['author_uid'], name='visibleto_author_uid_idx'),
+        ]
+
     def __str__(self):
         author = self.author_uid.split("/")
-        return f'{author[-1][:5]}... from {author[0]} can see post {self.accessed_post.id[:5]}...'
\ No newline at end of file
+        return f'{author[-1][:5]}... from {author[0]} can see post {self.accessed_post.id[:5]}...'
+
+class PostAudience(models.Model):
+    """
+    Who can see each listed post, precomputed so that finding the posts visible to an author is a single indexed join.
+    Maintained by posts.audience whenever a post, its visibleTo or a friendship of its author changes.
+
+    The viewer of a row is either the uid of an author who can see the post (sanitized: no protocol, no dashes in the
+    uuid), EVERYONE for public posts, or server_audience(host) for posts only visible to the authors of a server.
+    """
+    EVERYONE = "*"
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='audience')
+    viewer = models.CharField(max_length=512)
+
+    class Meta:
+        unique_together = (("viewer", "post"),)
+
+    @staticmethod
+    def server_audience(host):
+        return "server:" + host
+
+    def __str__(self):
+        return f'{self.viewer} can see post {self.post_id}'
+
+
+class ForeignPost(models.Model):
+    """
+    Local copy of the posts of foreign nodes, so that reading them does not depend on the node answering in time.
+    Public posts are ingested from every node's GET /posts by posts.federation.ingest_foreign_posts, other posts are
+    stored whenever they are fetched live.
+    """
+    # The id the node gave the post, without any url around it
+    id = models.CharField(primary_key=True, max_length=100)
+    node = models.ForeignKey(Node, on_delete=models.CASCADE, related_name='posts')
+    # Sanitized uid of the post's author: no protocol, no trailing slash, no dashes in the uuid
+    author_uid = models.CharField(max_length=500)
+    title = models.CharField(max_length=256, blank=True)
+    contentType = models.CharField(max_length=32, blank=True)
+    published = models.DateTimeField()
+    visibility = models.CharField(max_length=16)
+    unlisted = models.BooleanField(default=False)
+    # The post exactly as the node listed it, as JSON
+    data = models.TextField()
+    # Last time the post was read from the node
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Listings of public posts, newest first
+            models.Index(fields=['visibility', 'unlisted', '-published'], name='foreignpost_vis_published_idx'),
+            # Listings of an author's posts, newest first
+            models.Index(fields=['author_uid', '-published'], name='foreignpost_author_pub_idx'),
+        ]
+
+    def to_api_object(self):
+        return json.loads(self.data)
+
+    def __str__(self):
+        return f'{self.visibility} post {self.id} from {self.node_id}'
+
+
+class ForeignPostSync(models.Model):
+    """
+    When the public posts of each node were last ingested.
+    Kept separate from Node because saving a Node rehashes its password.
+    """
+    node = models.OneToOneField(Node, primary_key=True, on_delete=models.CASCADE, related_name='post_sync')
+    # Last time the node was asked for its posts, whether or not that worked
+    attempted_at = models.DateTimeField(null=True)
+    # Last time the node's posts were successfully stored
+    synced_at = models.DateTimeField(null=True)
+    # Why the last attempt failed, empty if it worked
+    error = models.TextField(blank=True)
@@ -0,0 +1,37 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from comments.models import Comment
+from friendship.graph import friend_graph
+from friendship.signals import friendship_changed
+from posts.audience import refresh_audience_of_authors, refresh_post_audience
+from posts.models import Category, Post, VisibleTo
+from social_distribution.utils.response_cache import invalidate_responses
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, **kwargs):
+    refresh_post_audience(instance)
+
+
+@receiver(friendship_changed)
+def friends_changed(sender, author_id, friend_id, **kwargs):
+    # The authors who friended the friend changed, and so did who shares a friend with the author and with everyone
+    # else who friended the friend
+    authors = {author_id, friend_id}
+    authors |= friend_graph.friended_by(friend_id)
+    refresh_audience_of_authors(authors)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=VisibleTo)
+@receiver(post_delete, sender=VisibleTo)
+@receiver(m2m_changed, sender=Post.categories.through)
+def post_content_changed(sender, **kwargs):
+    # Serialized posts include their comments, categories and visibleTo
+    invalidate_responses()
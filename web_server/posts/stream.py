@@ -0,0 +1,167 @@
+"""
+The home stream: every post the viewer can see, local and foreign, newest first.
+
+Local posts come from the post audience, the public posts of ingested nodes from ForeignPost, and the public posts
+of nodes that have not been ingested yet from the nodes themselves. Every source is already ordered newest first, so a
+page of the stream is a k-way merge (heapq.merge) of the sources on the publish time.
+
+Where each source stopped is kept as a cursor in the viewer's session: the (published, id) of the last local and
+ingested post shown, and the (page, offset) reached in the pages of each node read live. The next page of the stream
+resumes from those cursors, so each node is asked for at most the page or two the next stream page can draw from,
+however deep the viewer has scrolled. Node pages are cached by fetch_public_posts_page, so resuming part way through a
+page does not download it again.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from authors.views import visible_posts_to_api_objects
+from nodes.models import Node
+from posts.audience import viewer_audience
+from posts.federation import fetch_public_posts_page, ingested_public_posts, parse_published
+from posts.models import ForeignPost, Post
+from social_distribution.utils.concurrency import fan_out
+
+SESSION_KEY = "post_stream"
+
+
+def new_stream(size):
+    """
+    :return: the cursors of a stream that has not shown anything yet
+    """
+    return {
+        "page": 0,
+        "size": size,
+        # [published, id] of the last local post shown, None before the first one
+        "local": None,
+        "local_done": False,
+        # Same for the posts of ingested nodes
+        "ingested": None,
+        "ingested_done": False,
+        # hostname to [page, offset] of the next post to show of each node that had not been ingested when the stream
+        # started, None once the node has run out of posts. Filled in when reading the first page.
+        "nodes": None
+    }
+
+
+def _after(posts, cursor):
+    """
+    :return: the posts ordered newest first, after the [published, id] cursor
+    """
+    if cursor is not None:
+        published = parse_datetime(cursor[0])
+        posts = posts.filter(Q(published__lt=published) | Q(published=published, id__lt=cursor[1]))
+    return posts.order_by("-published", "-id")
+
+
+def _read_local(author, cursor, size):
+    """
+    :return: the next size posts visible to the author after the cursor, newest first
+    """
+    posts = Post.objects.filter(audience__viewer__in=viewer_audience(author), unlisted=False)
+    posts = posts.distinct().select_related('author').prefetch_related('categories', 'visibleTo')
+    return list(_after(posts, cursor)[:size])
+
+
+def _read_ingested(live_hostnames, cursor, size):
+    """
+    :return: the next size stored public posts of the ingested nodes after the cursor, newest first
+    """
+    return list(_after(ingested_public_posts().exclude(node__in=live_hostnames), cursor)[:size])
+
+
+def _read_node(node, cursor, size, page_size):
+    """
+    Reads at least size posts from a node starting at the cursor, fewer if the node runs out
+    :return: (entries, exhausted) where entries is a list of (post, cursor after the post), and exhausted tells if
+             the node has no posts after the entries
+    """
+    page, offset = cursor
+    entries = []
+    while len(entries) < size:
+        posts = fetch_public_posts_page(node, page, page_size)
+        if len(posts) == 0:
+            return entries, True
+        for index in range(offset, len(posts)):
+            entries.append((posts[index], [page, index + 1]))
+        page, offset = page + 1, 0
+    return entries, False
+
+
+def read_stream_page(stream, author, host):
+    """
+    Merges the next page of the stream and advances the cursors past it
+    :param stream: the cursors, as made by new_stream, updated in place
+    :param author: the local author viewing the stream
+    :param host: the scheme and host of this server
+    :return: (posts, errors, more) where errors maps the hostname of every node that could not be read to the problem,
+             and more tells if there may be posts after this page
+    """
+    size = stream["size"]
+    page_size = settings.FOREIGN_PUBLIC_POSTS_PAGE_SIZE
+    sources = []
+
+    if stream["nodes"] is None:
+        stream["nodes"] = {hostname: [1, 0] for hostname in Node.objects.filter(
+            post_sync__synced_at__isnull=True).values_list('foreign_server_hostname', flat=True)}
+
+    local_posts = []
+    if not stream["local_done"]:
+        local_posts = _read_local(author, stream["local"], size)
+        sources.append([(post.published, None, post, None) for post in local_posts])
+
+    ingested_posts = []
+    if not stream["ingested_done"]:
+        ingested_posts = _read_ingested(list(stream["nodes"].keys()), stream["ingested"], size)
+        sources.append([(post.published, post.node_id, post, None) for post in ingested_posts])
+
+    nodes = Node.objects.filter(foreign_server_hostname__in=[hostname for hostname, cursor in stream["nodes"].items()
+                                                             if cursor is not None])
+    results, errors = fan_out({
+        node.foreign_server_hostname: (lambda node=node: _read_node(
+            node, stream["nodes"][node.foreign_server_hostname], size, page_size))
+        for node in nodes})
+    for hostname, (entries, exhausted) in results.items():
+        sources.append([(parse_published(post), hostname, post, cursor) for post, cursor in entries])
+
+    merged = list(islice(heapq.merge(*sources, key=lambda entry: entry[0], reverse=True), size))
+
+    # Advance every source past what was shown, nodes that failed keep their cursor and are asked again next page
+    local_shown = [post for published, hostname, post, cursor in merged if hostname is None]
+    if local_shown:
+        stream["local"] = [local_shown[-1].published.isoformat(), str(local_shown[-1].id)]
+    if len(local_posts) < size and len(local_shown) == len(local_posts):
+        stream["local_done"] = True
+    ingested_shown = [post for published, hostname, post, cursor in merged if isinstance(post, ForeignPost)]
+    if ingested_shown:
+        stream["ingested"] = [ingested_shown[-1].published.isoformat(), ingested_shown[-1].id]
+    if len(ingested_posts) < size and len(ingested_shown) == len(ingested_posts):
+        stream["ingested_done"] = True
+    for hostname, (entries, exhausted) in results.items():
+        shown = [cursor for published, source, post, cursor in merged if source == hostname and cursor is not None]
+        if shown:
+            stream["nodes"][hostname] = shown[-1]
+        if exhausted and len(shown) == len(entries):
+            stream["nodes"][hostname] = None
+    stream["page"] += 1
+
+    local_objects = iter(visible_posts_to_api_objects(local_shown, host, size, inline_images=False))
+    posts = []
+    for published, hostname, post, cursor in merged:
+        if hostname is None:
+            posts.append(next(local_objects))
+        else:
+            if isinstance(post, ForeignPost):
+                post = post.to_api_object()
+            # Pages are shared through the cache, so the node's post is copied before being annotated
+            post = dict(post, node=hostname)
+            # Quick adaptor for groups not following the spec
+            if 'content_type' in post and 'contentType' not in post:
+                post['contentType'] = post['content_type']
+            posts.append(post)
+
+    more = not stream["local_done"] or not stream["ingested_done"] or any(stream["nodes"].values())
+    return posts, errors, more
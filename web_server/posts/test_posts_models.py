@@ -1,8 +1,16 @@
+import base64
+import os
+import shutil
+import tempfile
 import uuid
 from datetime import datetime
 from django.test import TestCase, Client, override_settings
 from users.models import Author
-from posts.models import Post
+from posts.models import Post, PostAudience, VisibleTo
+from posts.audience import refresh_post_audience, rebuild_post_audience
+from posts.images import image_path
+from friendship.models import Friend
+from friendship.graph import friend_graph
 from django.urls import reverse
 
 
@@ -76,3 +84,136 @@ class TestPostsModels(TestCase):
         self.assertEqual(returndict["size"],1)
         self.assertEqual(returndict["visibility"],"FRIENDS")
         self.assertEqual(returndict["visibleTo"][0], "http://"+Author.objects.get(id=uuid.uuid5(uuid.NAMESPACE_DNS, 'test2').hex).uid)
+
+
+# This is the unit test for the precomputed post audience
+class TestPostAudience(TestCase):
+
+    def create_author(self, name):
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, name).hex
+        return Author.objects.create(id=id, username=name, display_name=name, password="password", is_active=True,
+                                     host="testserver", uid="testserver/author/" + id,
+                                     url="http://testserver/author/" + id)
+
+    def create_post(self, author, visibility, unlisted=False):
+        return Post.objects.create(title=visibility, content="audience", author=author, visibility=visibility,
+                                   unlisted=unlisted, size=0)
+
+    def audience(self, post):
+        return set(PostAudience.objects.filter(post=post).values_list('viewer', flat=True))
+
+    def setUp(self):
+        friend_graph.invalidate()
+        self.author = self.create_author("audience_author")
+        self.friend = self.create_author("audience_friend")
+        self.foaf = self.create_author("audience_foaf")
+        self.stranger = self.create_author("audience_stranger")
+        for a, b in [(self.author, self.friend), (self.friend, self.foaf)]:
+            Friend.objects.create(author_id=a.uid, friend_id=b.uid)
+            Friend.objects.create(author_id=b.uid, friend_id=a.uid)
+
+    def test_audience_follows_visibility(self):
+        public = self.create_post(self.author, Post.PUBLIC)
+        server_only = self.create_post(self.author, Post.SERVERONLY)
+        friends = self.create_post(self.author, Post.FRIENDS)
+        foaf = self.create_post(self.author, Post.FOAF)
+        private = self.create_post(self.author, Post.PRIVATE)
+        VisibleTo.objects.create(author_uid=self.stranger.uid, accessed_post=private)
+        refresh_post_audience(private)
+        unlisted = self.create_post(self.author, Post.PUBLIC, unlisted=True)
+
+        self.assertEqual(self.audience(public), {self.author.uid, PostAudience.EVERYONE})
+        self.assertEqual(self.audience(server_only), {self.author.uid, PostAudience.server_audience("testserver")})
+        self.assertEqual(self.audience(friends), {self.author.uid, self.friend.uid})
+        self.assertEqual(self.audience(foaf), {self.author.uid, self.friend.uid, self.foaf.uid})
+        self.assertEqual(self.audience(private), {self.author.uid, self.stranger.uid})
+        self.assertEqual(self.audience(unlisted), set())
+
+        # Editing a post changes who can see it
+        private.visibility = Post.PUBLIC
+        private.save()
+        self.assertEqual(self.audience(private), {self.author.uid, PostAudience.EVERYONE})
+
+        self.assertEqual(rebuild_post_audience(), 11)
+        self.assertEqual(self.audience(foaf), {self.author.uid, self.friend.uid, self.foaf.uid})
+
+    def test_audience_follows_friendships(self):
+        friends = self.create_post(self.author, Post.FRIENDS)
+        foaf = self.create_post(self.author, Post.FOAF)
+
+        Friend.objects.create(author_id=self.foaf.uid, friend_id=self.stranger.uid)
+        Friend.objects.create(author_id=self.stranger.uid, friend_id=self.author.uid)
+        self.assertEqual(self.audience(friends), {self.author.uid, self.friend.uid, self.stranger.uid})
+        self.assertEqual(self.audience(foaf), {self.author.uid, self.friend.uid, self.foaf.uid, self.stranger.uid})
+
+        Friend.objects.filter(author_id=self.author.uid, friend_id=self.friend.uid).delete()
+        Friend.objects.filter(author_id=self.friend.uid, friend_id=self.author.uid).delete()
+        self.assertEqual(self.audience(friends), {self.author.uid, self.stranger.uid})
+        # The author has no friends left to share, only the stranger still friends the author
+        self.assertEqual(self.audience(foaf), {self.author.uid, self.stranger.uid})
+
+
+# This is the unit test for keeping the images of image posts in the image store
+class TestPostImages(TestCase):
+
+    def setUp(self):
+        store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store)
+        store_setting = override_settings(IMAGE_STORE_ROOT=store)
+        store_setting.enable()
+        self.addCleanup(store_setting.disable)
+
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'post_images').hex
+        self.author = Author.objects.create(id=id, username='post_images', display_name="PostImages",
+                                            password="password", is_active=True, host="127.0.0.1:8000",
+                                            uid="127.0.0.1:8000/author/" + id, url="http://127.0.0.1:8000/author/" + id)
+        self.image = b'\x89PNG\r\n\x1a\nnot really a png'
+        self.encoded = base64.b64encode(self.image).decode('utf-8')
+
+    def create_post(self, content, contentType=Post.TYPE_PNG):
+        return Post.objects.create(title="image", content=content, contentType=contentType, author=self.author,
+                                   visibility="PUBLIC", size=0)
+
+    def test_image_copied_to_store(self):
+        post = Post.objects.get(id=self.create_post(self.encoded).id)
+        # The content is kept, the store is not shared between servers
+        self.assertEqual(post.content, self.encoded)
+        with open(image_path(post.image_hash), 'rb') as f:
+            self.assertEqual(f.read(), self.image)
+        # The API still carries the image inline
+        self.assertEqual(post.to_api_object()['content'], self.encoded)
+
+    def test_missing_image_restored_from_content(self):
+        post = self.create_post(self.encoded)
+        os.remove(image_path(post.image_hash))
+        self.assertTrue(post.restore_image())
+        with open(image_path(post.image_hash), 'rb') as f:
+            self.assertEqual(f.read(), self.image)
+
+    def test_image_lost(self):
+        post = self.create_post(self.encoded)
+        self.assertFalse(post.image_lost())
+        os.remove(image_path(post.image_hash))
+        Post.objects.filter(id=post.id).update(content="")
+        post = Post.objects.get(id=post.id)
+        self.assertTrue(post.image_lost())
+        self.assertFalse(post.restore_image())
+        self.assertEqual(post.api_content(), "")
+
+    def test_same_image_stored_once(self):
+        first = self.create_post(self.encoded)
+        second = self.create_post(self.encoded, Post.TYPE_JPEG)
+        self.assertEqual(first.image_hash, second.image_hash)
+
+    def test_invalid_base64_kept(self):
+        post = self.create_post("not base64!")
+        self.assertEqual(post.image_hash, "")
+        self.assertEqual(post.to_api_object()['content'], "not base64!")
+
+    def test_changed_to_text(self):
+        post = self.create_post(self.encoded)
+        post.contentType = Post.TYPE_PLAIN
+        post.content = "words"
+        post.save()
+        self.assertEqual(post.image_hash, "")
+        self.assertEqual(post.api_content(), "words")
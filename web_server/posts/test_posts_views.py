@@ -0,0 +1,505 @@
+import base64
+from datetime import datetime, timedelta, timezone
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from nodes.models import Node
+from PIL import Image
+from posts.derivatives import derivative_path
+from posts.federation import clear_public_posts_pages, ingest_foreign_posts
+from posts.image_proxy import open_foreign_image
+from posts.images import image_path
+from comments.models import Comment
+from posts.models import ForeignPost, ForeignPostSync, Post
+from users.models import Author
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, content=b'', headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.content = content
+        self.headers = headers or {'Content-Type': 'application/json'}
+
+    def json(self):
+        return self.data
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+# This is the unit test for fetching public posts from every node
+@override_settings(FEDERATION_FAN_OUT_DEADLINE=1)
+class TestFetchPublicPostsFromNodes(TestCase):
+
+    def setUp(self):
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'fetch_public_posts').hex
+        self.author = Author.objects.create(id=id, username='fetch_public_posts', display_name="FetchPublicPosts",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        for hostname in ['fast.node', 'slow.node', 'broken.node']:
+            Node.objects.create(foreign_server_hostname=hostname, foreign_server_username=hostname,
+                                foreign_server_password="password", foreign_server_api_location=hostname)
+        self.client = Client()
+        self.client.force_login(self.author)
+        clear_public_posts_pages()
+
+    @staticmethod
+    def fake_request(node, method, url, **kwargs):
+        page = kwargs['params']['page']
+        if 'slow.node' in url:
+            time.sleep(3)
+            return FakeResponse(200, {'posts': [{'title': 'slow'}]})
+        if 'broken.node' in url:
+            return FakeResponse(500)
+        if page > 1:
+            return FakeResponse(200, {'posts': []})
+        return FakeResponse(200, {'posts': [{'title': f'fast {i}', 'content_type': 'text/plain'} for i in range(3)]})
+
+    def test_partial_results_and_errors(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            started = time.monotonic()
+            response = self.client.get('/posts/fetch_public_posts', {'page': 0, 'size': 10})
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        # The slow node must not hold up the answering ones past the deadline
+        self.assertLess(elapsed, 2.5)
+        self.assertEqual([post['title'] for post in json_response['posts']], ['fast 0', 'fast 1', 'fast 2'])
+        self.assertEqual(json_response['posts'][0]['contentType'], 'text/plain')
+        self.assertIn('slow.node', json_response['errors'])
+        self.assertIn('broken.node', json_response['errors'])
+        self.assertNotIn('fast.node', json_response['errors'])
+
+
+# This is the unit test for the home stream, merging local posts with every node's public posts
+@override_settings(FOREIGN_PUBLIC_POSTS_PAGE_SIZE=3)
+class TestStream(TestCase):
+    START = datetime(2020, 3, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'stream').hex
+        self.author = Author.objects.create(id=id, username='stream', display_name="Stream",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        # Local posts are published every 3 minutes, and each node's every 3 minutes in between them
+        for minute in range(0, 12, 3):
+            post = Post.objects.create(title=f'local {minute}', content="stream", author=self.author,
+                                       visibility="PUBLIC", size=0)
+            Post.objects.filter(id=post.id).update(published=self.START - timedelta(minutes=minute))
+        self.node_posts = {
+            'a.node': [{'title': f'a.node {minute}',
+                        'published': (self.START - timedelta(minutes=minute)).isoformat()}
+                       for minute in range(1, 12, 3)],
+            'b.node': [{'title': f'b.node {minute}', 'content_type': 'text/plain',
+                        'published': (self.START - timedelta(minutes=minute)).strftime('%Y-%m-%dT%H:%M:%S.000Z')}
+                       for minute in range(2, 12, 3)],
+        }
+        for hostname in self.node_posts:
+            Node.objects.create(foreign_server_hostname=hostname, foreign_server_username=hostname,
+                                foreign_server_password="password", foreign_server_api_location=hostname)
+        self.requested_pages = []
+        self.client = Client()
+        self.client.force_login(self.author)
+        clear_public_posts_pages()
+
+    def fake_request(self, node, method, url, **kwargs):
+        hostname = node.foreign_server_hostname
+        page, size = kwargs['params']['page'], kwargs['params']['size']
+        self.requested_pages.append((hostname, page))
+        posts = self.node_posts[hostname][(page - 1) * size:page * size]
+        if len(posts) == 0:
+            return FakeResponse(404)
+        return FakeResponse(200, {'posts': posts})
+
+    def get_stream(self, page):
+        response = self.client.get('/posts/stream', {'page': page, 'size': 5})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_merged_by_publish_time(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            pages = [self.get_stream(page) for page in range(3)]
+
+        titles = [post['title'] for page in pages for post in page['posts']]
+        expected = [f"{source} {minute}" for minute in range(12)
+                    for source in [['local', 'a.node', 'b.node'][minute % 3]]]
+        self.assertEqual(titles, expected)
+        self.assertEqual([len(page['posts']) for page in pages], [5, 5, 2])
+        self.assertIn('next', pages[1])
+        self.assertNotIn('next', pages[2])
+        self.assertEqual(pages[0]['posts'][2]['contentType'], 'text/plain')
+        self.assertEqual(pages[0]['posts'][1]['node'], 'a.node')
+        self.assertNotIn('node', pages[0]['posts'][0])
+
+    def test_pages_resume_from_cursors(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            for page in range(3):
+                self.get_stream(page)
+
+        # Every node page is downloaded once, deeper stream pages do not walk the nodes from their first page again
+        self.assertEqual(sorted(self.requested_pages), sorted(set(self.requested_pages)))
+        self.assertEqual(sorted(self.requested_pages),
+                         [('a.node', 1), ('a.node', 2), ('a.node', 3), ('b.node', 1), ('b.node', 2), ('b.node', 3)])
+
+    def test_out_of_order_page_starts_over(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            first = self.get_stream(1)
+            again = self.get_stream(1)
+
+        self.assertEqual([post['title'] for post in first['posts']],
+                         ['b.node 5', 'local 6', 'a.node 7', 'b.node 8', 'local 9'])
+        self.assertEqual(first['posts'], again['posts'])
+
+
+# This is the unit test for copying the public posts of every node into the database
+@override_settings(FOREIGN_PUBLIC_POSTS_PAGE_SIZE=3)
+class TestForeignPostIngestion(TestCase):
+    START = datetime(2020, 3, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'ingestion').hex
+        self.author = Author.objects.create(id=id, username='ingestion', display_name="Ingestion",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        self.node = Node.objects.create(foreign_server_hostname='a.node', foreign_server_username='a.node',
+                                        foreign_server_password="password", foreign_server_api_location='a.node')
+        self.node_posts = [{'id': f'http://a.node/posts/{minute}', 'title': f'a.node {minute}',
+                            'author': {'id': 'http://a.node/author/1'},
+                            'published': (self.START - timedelta(minutes=minute)).isoformat()}
+                           for minute in range(4)]
+        self.client = Client()
+        self.client.force_login(self.author)
+        clear_public_posts_pages()
+
+    def fake_request(self, node, method, url, **kwargs):
+        page, size = kwargs['params']['page'], kwargs['params']['size']
+        posts = self.node_posts[(page - 1) * size:page * size]
+        if len(posts) == 0:
+            return FakeResponse(404)
+        return FakeResponse(200, {'posts': posts})
+
+    @staticmethod
+    def broken_request(node, method, url, **kwargs):
+        return FakeResponse(500)
+
+    def test_upserts_and_removes(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            self.assertEqual(ingest_foreign_posts(), {})
+        self.assertEqual(set(ForeignPost.objects.values_list('id', flat=True)), {'0', '1', '2', '3'})
+        stored = ForeignPost.objects.get(id='1')
+        self.assertEqual(stored.author_uid, 'a.node/author/1')
+        self.assertEqual(stored.visibility, 'PUBLIC')
+        self.assertEqual(stored.published, self.START - timedelta(minutes=1))
+
+        self.node_posts[1]['title'] = 'edited'
+        del self.node_posts[2]
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            ingest_foreign_posts()
+        self.assertEqual(set(ForeignPost.objects.values_list('id', flat=True)), {'0', '1', '3'})
+        self.assertEqual(ForeignPost.objects.get(id='1').to_api_object()['title'], 'edited')
+
+    def test_failed_ingestion_keeps_posts(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            ingest_foreign_posts()
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.broken_request):
+            errors = ingest_foreign_posts()
+        self.assertIn('a.node', errors)
+        self.assertEqual(ForeignPost.objects.count(), 4)
+        self.assertIn('500', ForeignPostSync.objects.get(node=self.node).error)
+
+    def test_stream_reads_ingested_posts(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            ingest_foreign_posts()
+        # The node is down, but its posts are already in the database
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.broken_request) as request:
+            response = self.client.get('/posts/stream', {'page': 0, 'size': 3})
+            self.assertEqual(request.call_count, 0)
+
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual([post['title'] for post in json_response['posts']], ['a.node 0', 'a.node 1', 'a.node 2'])
+        self.assertEqual(json_response['posts'][0]['node'], 'a.node')
+        self.assertEqual(json_response['errors'], {})
+
+
+# This is the unit test for caching the public posts foreign nodes poll
+class TestPublicPostsCache(TestCase):
+
+    def setUp(self):
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'public_posts_cache').hex
+        self.author = Author.objects.create(id=id, username='public_posts_cache', display_name="PublicPostsCache",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        self.posts = [Post.objects.create(title=f'public {i}', content="cached", author=self.author,
+                                          visibility="PUBLIC", size=0) for i in range(3)]
+        self.client = Client(HTTP_ACCEPT="application/json")
+        self.client.force_login(self.author)
+
+    def get_posts(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/posts/', {'page': 1, 'size': 10})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query['sql'] for query in queries]
+
+    def test_cached_until_changed(self):
+        first, first_queries = self.get_posts()
+        second, second_queries = self.get_posts()
+        self.assertEqual(first, second)
+        # Only the session, the page count and the cache are read, no post is serialized again
+        self.assertLess(len(second_queries), len(first_queries))
+        self.assertFalse([sql for sql in second_queries if 'comments_comment' in sql])
+
+        Comment.objects.create(parentPost=self.posts[0], author=self.author.uid, content="new",
+                               contentType="text/plain")
+        third, third_queries = self.get_posts()
+        commented = [post for post in third['posts'] if post['title'] == 'public 0'][0]
+        self.assertEqual(commented['count'], 1)
+
+        self.posts[1].title = 'renamed'
+        self.posts[1].save()
+        self.assertIn('renamed', [post['title'] for post in self.get_posts()[0]['posts']])
+
+    def test_conditional_get(self):
+        response = self.client.get('/posts/', {'page': 1, 'size': 10})
+        etag = response['ETag']
+        response = self.client.get('/posts/', {'page': 1, 'size': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Every page has its own validator
+        response = self.client.get('/posts/', {'page': 1, 'size': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        comments_url = f'/posts/{self.posts[0].id}/comments/'
+        etag = self.client.get(comments_url)['ETag']
+        self.assertEqual(self.client.get(comments_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(parentPost=self.posts[0], author=self.author.uid, content="new",
+                               contentType="text/plain")
+        self.assertEqual(self.client.get(comments_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_conditional_get_from_node(self):
+        Node.objects.create(foreign_server_hostname="polling.node", foreign_server_username="polling.node",
+                            foreign_server_password="password", foreign_server_api_location="polling.node",
+                            post_share=True)
+        credentials = base64.b64encode(b"polling.node:password").decode('utf-8')
+        node = Client(HTTP_ACCEPT="application/json", HTTP_AUTHORIZATION="Basic " + credentials)
+
+        for client in (node, Client(HTTP_ACCEPT="application/json")):
+            response = client.get('/posts/', {'page': 1, 'size': 10})
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            response = client.get('/posts/', {'page': 1, 'size': 10}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        comments_url = f'/posts/{self.posts[0].id}/comments/'
+        response = node.get(comments_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(node.get(comments_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+# This is the unit test for serving the images of image posts
+class TestPostImage(TestCase):
+
+    def setUp(self):
+        store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store)
+        store_setting = override_settings(IMAGE_STORE_ROOT=store)
+        store_setting.enable()
+        self.addCleanup(store_setting.disable)
+
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'post_image').hex
+        self.author = Author.objects.create(id=id, username='post_image', display_name="PostImage",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        self.image = b'\xff\xd8\xffnot really a jpeg'
+        self.post = Post.objects.create(title="image", content=base64.b64encode(self.image).decode('utf-8'),
+                                        contentType=Post.TYPE_JPEG, author=self.author, visibility="PUBLIC", size=0)
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def test_image_served_from_store(self):
+        url = reverse('post_image', args=[self.post.id.hex, self.post.image_hash])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.image)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        # A url naming another image of the post is not found
+        response = self.client.get(reverse('post_image', args=[self.post.id.hex, '0' * 64]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_post_url_serves_image(self):
+        response = self.client.get(f'/posts/{self.post.id.hex}/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.image)
+        self.assertEqual(response['ETag'], f'"{self.post.image_hash}"')
+
+    def test_image_written_back_to_store(self):
+        # Another server, or this one after a deploy, does not have the image in its store yet
+        os.remove(image_path(self.post.image_hash))
+        response = self.client.get(reverse('post_image', args=[self.post.id.hex, self.post.image_hash]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.image)
+
+    def test_lost_image(self):
+        os.remove(image_path(self.post.image_hash))
+        Post.objects.filter(id=self.post.id).update(content="")
+        response = self.client.get(reverse('post_image', args=[self.post.id.hex, self.post.image_hash]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/posts/{self.post.id.hex}/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 404)
+        # Listings leave the post out rather than failing
+        response = self.client.get('/posts/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['posts'], [])
+
+    def test_api_carries_base64(self):
+        response = self.client.get(f'/posts/{self.post.id.hex}/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['posts'][0]['content'], base64.b64encode(self.image).decode('utf-8'))
+
+
+# This is the unit test for the resized variants of post images
+class TestImageDerivatives(TestCase):
+
+    def setUp(self):
+        for setting in ('IMAGE_STORE_ROOT', 'IMAGE_DERIVATIVE_ROOT'):
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            store_setting = override_settings(**{setting: directory})
+            store_setting.enable()
+            self.addCleanup(store_setting.disable)
+
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'image_derivatives').hex
+        self.author = Author.objects.create(id=id, username='image_derivatives', display_name="ImageDerivatives",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        self.posts = [self.create_post((1000 + i, 500)) for i in range(3)]
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def create_post(self, size):
+        image = io.BytesIO()
+        Image.new("RGB", size, (200, 30, 30)).save(image, "JPEG")
+        return Post.objects.create(title="photo", content=base64.b64encode(image.getvalue()).decode('utf-8'),
+                                   contentType=Post.TYPE_JPEG, author=self.author, visibility="PUBLIC", size=0)
+
+    def get_variant(self, post, variant):
+        response = self.client.get(reverse('post_image_variant', args=[post.id.hex, post.image_hash, variant]))
+        self.assertEqual(response.status_code, 200)
+        return Image.open(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_variants(self):
+        self.assertEqual(self.get_variant(self.posts[0], 'thumbnail').size, (160, 80))
+        self.assertEqual(self.get_variant(self.posts[0], 'feed').size, (640, 320))
+        self.assertEqual(self.get_variant(self.posts[0], 'original').size, (1000, 500))
+        self.assertTrue(os.path.exists(derivative_path(self.posts[0].image_hash, 'thumbnail')))
+        response = self.client.get(reverse('post_image_variant', args=[self.posts[0].id.hex,
+                                                                        self.posts[0].image_hash, 'huge']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_least_recently_used_evicted(self):
+        self.get_variant(self.posts[0], 'thumbnail')
+        first = derivative_path(self.posts[0].image_hash, 'thumbnail')
+        # Older than anything written after it, but used again below
+        os.utime(first, (0, 0))
+        self.get_variant(self.posts[1], 'thumbnail')
+        second = derivative_path(self.posts[1].image_hash, 'thumbnail')
+        os.utime(second, (1, 1))
+        self.get_variant(self.posts[0], 'thumbnail')
+
+        # Room for two thumbnails
+        with self.settings(IMAGE_DERIVATIVE_CACHE_BYTES=2 * max(os.path.getsize(first), os.path.getsize(second))):
+            self.get_variant(self.posts[2], 'thumbnail')
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertTrue(os.path.exists(derivative_path(self.posts[2].image_hash, 'thumbnail')))
+
+    def test_stream_links_variants(self):
+        response = self.client.get('/posts/stream', {'page': 0, 'size': 10})
+        posts = response.json()['posts']
+        self.assertEqual(posts[0]['content'], "")
+        self.assertEqual(posts[0]['thumbnail'], reverse('post_image_variant', args=[
+            self.posts[2].id.hex, self.posts[2].image_hash, 'thumbnail']))
+
+
+# This is the unit test for proxying the images of foreign servers
+class TestForeignImageProxy(TestCase):
+
+    def setUp(self):
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+        cache_setting = override_settings(FOREIGN_IMAGE_CACHE_ROOT=cache)
+        cache_setting.enable()
+        self.addCleanup(cache_setting.disable)
+
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'foreign_image_proxy').hex
+        self.author = Author.objects.create(id=id, username='foreign_image_proxy', display_name="ForeignImageProxy",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        self.node = Node.objects.create(foreign_server_hostname='images.node', foreign_server_username='images.node',
+                                        foreign_server_password="password", foreign_server_api_location='images.node')
+        self.image = b'\x89PNG\r\n\x1a\nforeign'
+        self.requests = 0
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def fake_request(self, node, method, url, **kwargs):
+        self.requests += 1
+        # Long enough for concurrent requests to pile up behind the first one
+        time.sleep(0.2)
+        if url.endswith('/raw'):
+            return FakeResponse(200, content=self.image, headers={'Content-Type': 'image/png'})
+        return FakeResponse(200, {'posts': [{'contentType': 'image/png;base64',
+                                             'content': base64.b64encode(self.image).decode('utf-8')}]})
+
+    def get_image(self, path):
+        response = self.client.get('/posts/proxy_image/images.node/' + path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        return b''.join(response.streaming_content)
+
+    def test_cached(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            self.assertEqual(self.get_image('posts/1'), self.image)
+            self.assertEqual(self.get_image('posts/1'), self.image)
+            self.assertEqual(self.requests, 1)
+            self.assertEqual(self.get_image('posts/1/raw'), self.image)
+            self.assertEqual(self.requests, 2)
+
+            with self.settings(FOREIGN_IMAGE_CACHE_TTL=-1):
+                self.get_image('posts/1')
+            self.assertEqual(self.requests, 3)
+
+    def test_concurrent_requests_coalesced(self):
+        results = []
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            def fetch():
+                image, content_type = open_foreign_image(self.node, 'http://images.node/posts/2')
+                with image:
+                    results.append(image.read())
+            threads = [threading.Thread(target=fetch) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results, [self.image] * 4)
+        self.assertEqual(self.requests, 1)
+
+    def test_unknown_node(self):
+        response = self.client.get('/posts/proxy_image/elsewhere.com/image.png')
+        self.assertEqual(response.status_code, 404)
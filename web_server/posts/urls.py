@@ -4,9 +4,12 @@ urlpatterns = [
     # API
     path('', views.retrieve_all_public_posts_on_local_server, name='post_index'),
     path('<str:post_id>/', views.retrieve_single_post_with_id, name='post'),
+    path('<str:post_id>/image/<str:image_hash>', views.retrieve_post_image, name='post_image'),
+    path('<str:post_id>/image/<str:image_hash>/<str:variant>', views.retrieve_post_image, name='post_image_variant'),
     path('<str:post_id>/comments/',  views.comments_retrieval_and_creation_to_post_id, name="get_or_add_comment"),
 
     #Internal use only
+    path("stream", views.retrieve_stream, name='stream'),
     path("fetch_public_posts", views.fetch_public_posts_from_nodes),
     path("proxy_image/<path:image_url>", views.proxy_foreign_server_image, name='proxy_image')
 
@@ -1,6 +1,6 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse
 from django.contrib.staticfiles import finders
 from django.conf import settings
 
@@ -10,6 +10,12 @@ from users.models import Author
 from nodes.models import Node
 from friendship.models import Friend
 from friendship.views import FOAF_verification
+from friendship.graph import friend_graph
+from posts.audience import refresh_post_audience
+from posts.federation import public_posts_page
+from posts.image_proxy import ForeignImageError, open_foreign_image
+from posts.derivatives import ORIGINAL, open_image_variant
+from posts.stream import SESSION_KEY as STREAM_SESSION_KEY, new_stream, read_stream_page
 import json
 
 
@@ -21,13 +27,19 @@ import json
 
 from social_distribution.utils.endpoint_utils import Endpoint, PagingHandler, Handler
 from social_distribution.utils.basic_auth import validate_remote_server_authentication
+from social_distribution.utils.concurrency import fan_out
+from social_distribution.utils.response_cache import cached_response_data, data_validator
 
 import requests
 import base64
 import re
+import time
 # used for stripping url protocol
 url_regex = re.compile(r"(http(s?))?://")
 
+# The largest page size nodes are expected to honour, this matches the maximum our own Endpoint allows
+MAX_NODE_PAGE_SIZE = 50
+
 
 # No Authentication Required
 def retrieve_all_public_posts_on_local_server(request):
@@ -39,12 +51,13 @@ def retrieve_all_public_posts_on_local_server(request):
     :returns: application/json | text/html
     """
     def json_handler(request, posts, pager, pagination_uris):
-        output = {
+        # Nodes poll this constantly, the posts are only serialized again once something they show has changed
+        output = cached_response_data(request, "posts", lambda: {
             "query": "posts",
             "count": pager.count,
             "size": len(posts),
-            "posts": [post.to_api_object() for post in posts]
-        }
+            "posts": [post.to_api_object() for post in posts if not post.image_lost()]
+        }, page=posts.number, size=pager.per_page)
         (prev_uri, next_uri) = pagination_uris
         if prev_uri:
             output['prev'] = prev_uri
@@ -54,7 +67,7 @@ def retrieve_all_public_posts_on_local_server(request):
         return JsonResponse(output)
 
     return Endpoint(request, Post.objects.filter(visibility="PUBLIC").order_by('-published'), [
-        PagingHandler("GET", "application/json", json_handler)
+        PagingHandler("GET", "application/json", json_handler, validator=data_validator)
     ]).resolve()
 
 def check_get_perm(request, api_object_post):
@@ -128,7 +141,8 @@ def retrieve_single_post_with_id(request, post_id):
     :returns: application/json | text/html | image/jpg | image/png
     """
     def get_json(request, posts, pager, pagination_uris):
-        post_list = [post.to_api_object() for post in posts if check_get_perm(request, post.to_api_object())]
+        post_list = [post.to_api_object() for post in posts
+                     if not post.image_lost() and check_get_perm(request, post.to_api_object())]
         output = {
             "query": "post",
             "count": len(post_list),
@@ -140,13 +154,16 @@ def retrieve_single_post_with_id(request, post_id):
     def get_html_or_image(request, posts, pager, pagination_uris):
         post = Post.objects.get(id=post_id)
         if post.contentType == post.TYPE_PNG or post.contentType == post.TYPE_JPEG:
-            if not check_get_perm(request, post.to_api_object()):
+            if not check_get_perm(request, image_permission_object(post)):
                 # The user does not have permission to access this post, they must be served the 401 image
                 with open(finders.find('401-image.png'), 'rb') as f:
                     return HttpResponse(f.read(), content_type='image/png', status=401)
-            # Note, this REQUIRES that the content be in base64 format.
-            response = HttpResponse(base64.b64decode(post.content), status=200)
-            response['Content-Type'] = post.contentType
+            response = image_response(post)
+            if response.status_code == 404:
+                return response
+            # The post could be changed to another image, so this url is revalidated against the image's hash
+            response['ETag'] = f'"{post.image_hash}"'
+            response['Cache-Control'] = 'private, no-cache'
             return response
 
         if not check_get_perm(request, post.to_api_object()):
@@ -189,6 +206,9 @@ def retrieve_single_post_with_id(request, post_id):
             if key == 'id':
                 # We ignore a passed in id, since the id was already specified in the url
                 continue
+            elif key == 'image_hash':
+                # Only set by the post itself, images are passed base64 encoded in content
+                continue
             elif key == 'visibleTo':
                 #  visibleTo is a Many to One relationship, we need to create the objects that will be bound to the post
                 visible_to_list = [
@@ -247,6 +267,7 @@ def retrieve_single_post_with_id(request, post_id):
             for vt in visible_to_list:
                 vt.accessed_post = post
                 vt.save()
+            refresh_post_audience(post)
 
         return JsonResponse({"success": "Post updated"})
 
@@ -272,8 +293,9 @@ def comments_retrieval_and_creation_to_post_id(request, post_id):
             }, status=404)
 
         comments_list = []
+        comment_authors = Comment.resolve_authors(comments)
         for comment in comments:
-            c = comment.to_api_object()
+            c = comment.to_api_object(comment_authors)
             if 'error' in c['author']:
                 # The comment could not be retrieved, we might have temporarily lost connection
                 continue
@@ -363,14 +385,16 @@ def comments_retrieval_and_creation_to_post_id(request, post_id):
         except Node.DoesNotExist as e:
             print(f"Attempt to FOAF verify friend node hostname '{auth_user_node}' but we do not have access to that node.")
             return False
-        username = node_object.username_registered_on_foreign_server
-        password = node_object.password_registered_on_foreign_server
         api = node_object.foreign_server_api_location
         api = "http://{}/author/{}/friends".format(
             api, "{}/author/{}".format(api, author))
         if node_object.append_slash:
             api = api + "/"
-        response = requests.get(api,auth=(username, password))
+        try:
+            response = node_object.make_request('GET', api)
+        except requests.RequestException as e:
+            print(f"Attempt to FOAF verify with node '{auth_user_node}' failed: {e}")
+            return False
         if response.status_code == 200:
             try:
                 friends_list = response.json()
@@ -504,7 +528,7 @@ def comments_retrieval_and_creation_to_post_id(request, post_id):
                 if user_id == url_regex.sub("", user).rstrip("/"):
                     return True
         elif visibility == Post.FRIENDS:
-            if Friend.objects.filter(author_id=author_id).filter(friend_id=user_id).exists():
+            if friend_graph.are_friends(author_id, user_id):
                 return True
         else:
             return False
@@ -554,11 +578,12 @@ def comments_retrieval_and_creation_to_post_id(request, post_id):
 
     def api_response(request, comments, pager, pagination_uris):
         size = min(int(request.GET.get('size', 10)), 50)
+        comment_authors = Comment.resolve_authors(comments)
         output = {
             "query": "comments",
             "count": pager.count,
             "size": size,
-            "comments": [comment.to_api_object() for comment in comments]
+            "comments": [comment.to_api_object(comment_authors) for comment in comments]
         }
 
         (prev_uri, next_uri) = pagination_uris
@@ -571,7 +596,7 @@ def comments_retrieval_and_creation_to_post_id(request, post_id):
     if request.user.is_authenticated:
         return Endpoint(request, Comment.objects.filter(parentPost=post_id).order_by("-published"),
                         [Handler("POST", "application/json", post_handler),
-                         PagingHandler("GET", "application/json", get_handler)]
+                         PagingHandler("GET", "application/json", get_handler, validator=data_validator)]
                         ).resolve()
     else:
         auth = request.META['HTTP_AUTHORIZATION'].split()
@@ -602,10 +627,55 @@ def comments_retrieval_and_creation_to_post_id(request, post_id):
 
         return Endpoint(request, Comment.objects.filter(parentPost=post_id).order_by("-published"),
                         [Handler("POST", "application/json", foreign_post_handler, False),
-                         PagingHandler("GET", "application/json", api_response)]
+                         PagingHandler("GET", "application/json", api_response, validator=data_validator)]
                         ).resolve()
 
 
+@login_required  # Local server usage only
+def retrieve_stream(request):
+    """
+    For endpoint http://service/posts/stream
+    The home stream of the authenticated user, every post visible to them on this server merged with the public posts
+    of every node, newest first.
+    Page 0 starts the stream over, and each following page continues from where the previous one stopped, so pages
+    should be requested in order. Nodes that could not be reached are reported in errors and asked again next page.
+    Methods: GET
+    :param request: may specify page and size
+    :returns: application/json
+    """
+    output = {
+        'query': "stream",
+        'page': 0,
+        'size': 10,
+        'posts': [],
+        'errors': dict()
+    }
+
+    try:
+        output['page'] = int(request.GET.get('page', '0'))
+        output['size'] = min(int(request.GET.get('size', '10')), MAX_NODE_PAGE_SIZE)
+        if output['page'] < 0 or output['size'] < 1:
+            raise ValueError("page and size must be positive")
+    except Exception as e:
+        output['errors'] = str(e)
+        # Bad request with invalid parameters
+        return JsonResponse(output, status=400)
+
+    host = ("https://" if request.is_secure() else "http://") + request.get_host()
+    stream = request.session.get(STREAM_SESSION_KEY)
+    if output['page'] == 0 or stream is None or stream['page'] != output['page'] or stream['size'] != output['size']:
+        # Out of order, or the session lost its cursors, skip over the pages before the requested one
+        stream = new_stream(output['size'])
+        while stream['page'] < output['page']:
+            read_stream_page(stream, request.user, host)
+
+    output['posts'], output['errors'], more = read_stream_page(stream, request.user, host)
+    request.session[STREAM_SESSION_KEY] = stream
+    if more:
+        output['next'] = f"{request.path}?page={output['page'] + 1}&size={output['size']}"
+    return JsonResponse(output)
+
+
 @login_required  # Local server usage only
 def fetch_public_posts_from_nodes(request):
     """
@@ -636,47 +706,20 @@ def fetch_public_posts_from_nodes(request):
 
     # Then we need to track the pages of each Node, pull their results and merge them together
     class NodePager:
-        def __init__(self, api_location, username, password, page, size):
-            self.api_location = api_location
-            self.username = username
-            self.password = password
+        def __init__(self, node, page, size):
+            self.node = node
             self.page = page
             self.size = size
             self.results = None
 
         def fetch_page(self):
             """
-            Gets the current page of public posts from the node. Returns empty list if no results or error.
+            Gets the current page of public posts from the node. Returns empty list if there are no more results,
+            raises an exception describing the problem if the node could not deliver the page.
             Caches the results so it will only fetch the page if the page has not already been fetched
             """
-            if self.results is not None:
-                return self.results
-
-            try:
-                req_params = {
-                    'size' : self.size
-                }
-                if self.page > 0:
-                    req_params['page'] = self.page
-
-                response = requests.get(self.api_location,
-                                        auth=(self.username, self.password),
-                                        headers={
-                                            'Accept': 'application/json'
-                                        },
-                                        params=req_params)
-            except Exception as e:
-                print(f"Error connecting to node '{self.api_location}': {e}")
-                return []
-            if response.status_code != 200:
-                print(f"Response was {response.status_code} when fetching public posts from {self.api_location}")
-                self.results = []
-            else:
-                try:
-                    res_json = response.json()
-                    self.results = res_json['posts']
-                except:
-                    self.results = []
+            if self.results is None:
+                self.results = public_posts_page(self.node, self.page, self.size)
             return self.results
 
         def next_page(self):
@@ -688,29 +731,44 @@ def fetch_public_posts_from_nodes(request):
         Manages a collection of node pagers, returning pages of their combined results
         """
 
-        def __init__(self, size):
+        def __init__(self, size, node_page_size, deadline):
             self.size = size
+            self.deadline = deadline
+            self.errors = dict()
             self.node_pagers = dict()
             for node in Node.objects.all():
                 # Create a pager so we can handle paging through all the results
-                self.node_pagers[node.foreign_server_hostname] = NodePager(node.get_safe_api_url('posts'),
-                                                                           node.username_registered_on_foreign_server,
-                                                                           node.password_registered_on_foreign_server,
-                                                                           0,  # Always start on the first page, we have no other way to ensure all results are seen
-                                                                           size)
+                self.node_pagers[node.foreign_server_hostname] = NodePager(node,
+                                                                           1,  # Always start on the first page, we have no other way to ensure all results are seen
+                                                                           node_page_size)
 
         def get_page(self, page):
             """
-            Gets the specified page by individually and sequentially querying each node and combining results until the
-            desired page is reached. Thus getting deep pages should be avoided if possible.
+            Gets the specified page by querying every node at the same time and combining results until the
+            desired page is reached. Nodes that error or do not answer before the deadline are dropped from the
+            results and reported in self.errors
             """
-            current_page = 0
+            started = time.monotonic()
             current_results_queue = []
             while len(self.node_pagers) > 0 and len(current_results_queue) < ((page+1) * self.size):
+                remaining = self.deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    # Out of time, serve what the nodes have delivered so far
+                    break
+
+                results, errors = fan_out({node: pager.fetch_page for node, pager in self.node_pagers.items()},
+                                          deadline=remaining)
+
                 # make an array from the keys so that we can delete keys during the loop
                 for node in [*self.node_pagers.keys()]:
+                    if node in errors:
+                        # A node that failed once is not asked again, it would only slow down the remaining rounds
+                        self.errors[node] = errors[node]
+                        del self.node_pagers[node]
+                        continue
+
                     pager = self.node_pagers[node]
-                    pager_page = pager.fetch_page()
+                    pager_page = results[node]
                     if len(pager_page) == 0:
                         # This node has exhausted it's pages
                         del self.node_pagers[node]
@@ -719,8 +777,12 @@ def fetch_public_posts_from_nodes(request):
 
             return current_results_queue[page*self.size:(page+1)*self.size]
 
-    manager = NodeCollectionPager(10)
+    # Ask each node for as much as the requested page needs in one go, so deep pages need fewer rounds
+    manager = NodeCollectionPager(output['size'],
+                                  min((output['page'] + 1) * output['size'], MAX_NODE_PAGE_SIZE),
+                                  settings.FEDERATION_FAN_OUT_DEADLINE)
     output['posts'] = manager.get_page(output['page'])
+    output['errors'] = manager.errors
 
     # Quick adaptor for groups not following the spec
     for post in output['posts']:
@@ -762,46 +824,83 @@ def fetch_public_posts_from_nodes(request):
     return JsonResponse(output, status=200)
 
 
+def image_permission_object(post):
+    """
+    :return: what check_get_perm needs of an image post, without reading and encoding the image like to_api_object
+    """
+    return {
+        "contentType": post.contentType,
+        "author": post.author.to_api_object(),
+        "visibility": post.visibility,
+        "visibleTo": ["http://" + visible.author_uid for visible in post.visibleTo.all()],
+    }
+
+
+def image_response(post, variant=ORIGINAL):
+    """
+    :return: a response streaming the image of an image post, or a variant of it, from the image store, or a 404 if
+             the image is lost
+    """
+    if post.image_hash:
+        if not post.restore_image():
+            return HttpResponse("The image of this post is missing", status=404)
+        try:
+            response = FileResponse(open_image_variant(post.image_hash, variant))
+        except FileNotFoundError:
+            return HttpResponse("The image of this post is missing", status=404)
+    else:
+        # Posts whose content was not valid base64 when saved are served as they are
+        response = HttpResponse(post.content)
+    response['Content-Type'] = post.contentType.split(';')[0]
+    return response
+
+
+@validate_remote_server_authentication()
+def retrieve_post_image(request, post_id, image_hash, variant=ORIGINAL):
+    """
+    For endpoint http://service/posts/{POST_ID}/image/{IMAGE_HASH}/{VARIANT}
+
+    Serves the image of an image post, resized to the variant if one is given (see settings.IMAGE_VARIANT_WIDTHS). The
+    url names the image by its hash, so what it serves never changes and can be cached for good.
+    """
+    if variant != ORIGINAL and variant not in settings.IMAGE_VARIANT_WIDTHS:
+        return HttpResponse(f"Unknown image variant '{variant}'", status=404)
+    post = get_object_or_404(Post, id=post_id, image_hash=image_hash)
+    if not check_get_perm(request, image_permission_object(post)):
+        return HttpResponse("You do not have permission to see this post", status=401)
+    response = image_response(post, variant)
+    if response.status_code == 404:
+        return response
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
 @login_required
 def proxy_foreign_server_image(request, image_url):
     """
     For markdown posts that contain images in them, we need to proxy the request through our server.
     This is because foreign servers require authorization. Requires an image url, which should NOT include the protocol
+    The image is streamed back as is, and cached on disk (see posts.image_proxy).
 
     If the url passed is not for a specific node we have connections for, it will be returned with the https protocol
     appended so that other img urls are not affected and resolve as normal.
     """
     image_url_parts = image_url.split('/')
-    credentials = None
     try:
         node = Node.objects.get(foreign_server_hostname=image_url_parts[0])
-        credentials = (node.username_registered_on_foreign_server,
-                       node.password_registered_on_foreign_server)
     except Node.DoesNotExist as e:
         # This url is not for a node that we have credentials for, we have to return some sort of message that
         # Will inform the front end to NOT replace the url. This is done just by stating an error status.
         return HttpResponse("We do not have a connection to this node", status=404)
 
-    request_args = {
-        'headers': {
-            'Accept': 'application/json'
-        }
-    }
-    if credentials is not None:
-        request_args['auth'] = credentials
-    # Make a request to the url, and pass in the credentials if they exist
-    response = requests.get('http://' + image_url, **request_args)
-    if response.status_code != 200:
-        # Return the original server response as an HTTP response
-        return HttpResponse(f'The server failed to deliver a valid response. The response was {response.content}', status=response.status_code)
-
+    # Served from the local cache, or downloaded with the node's credentials
     try:
-        # Decode the json response to get the post
-        post = response.json()['posts'][0]
-    except Exception as e:
-        return HttpResponse(f'The foreign server responded, but the post returned was invalid: {e}', status=500)
-
-    # Otherwise read the image data and return the image
-    uri = ("data:" + post['contentType'] + ", " + post['content'])
-
-    return HttpResponse(uri, content_type=response.headers['Content-Type'])
+        image, content_type = open_foreign_image(node, 'http://' + image_url)
+    except requests.RequestException as e:
+        return HttpResponse(f'The foreign server could not be reached: {e}', status=502)
+    except ForeignImageError as e:
+        return HttpResponse(str(e), status=e.status)
+
+    response = FileResponse(image, content_type=content_type)
+    response['Cache-Control'] = f'private, max-age={settings.FOREIGN_IMAGE_CACHE_TTL}'
+    return response
@@ -1,4 +1,6 @@
 python manage.py migrate
+python manage.py createcachetable
+python manage.py rebuild_post_audience
 # OBTAINED FROM STACKOVERFLOW
 # Original Question Author: planetp (https://stackoverflow.com/users/275088/planetp)
 # Answer Author: Eugene Yarmash (https://stackoverflow.com/users/244297/eugene-yarmash)
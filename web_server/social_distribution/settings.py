@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     'crispy_forms',
     'markdownx',
     'nodes.apps.NodesConfig',
+    'jobs.apps.JobsConfig',
 ]
 
 MIDDLEWARE = [
@@ -145,5 +146,117 @@ LOGIN_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
 AUTH_USER_MODEL = 'users.Author'  # new
 
+# Images of image posts, stored by their SHA-256 (see posts.images). This server's copy, the images stay in Post.content
+# and are written here again when missing, so it does not need to be shared between dynos or outlive a deploy.
+IMAGE_STORE_ROOT = os.path.join(BASE_DIR, 'image_store')
+# Resized copies of those images (see posts.derivatives), the least recently used are removed once they take up more
+# than IMAGE_DERIVATIVE_CACHE_BYTES. Can be thrown away at any time, they are made again when next asked for.
+IMAGE_DERIVATIVE_ROOT = os.path.join(BASE_DIR, 'image_derivatives')
+IMAGE_DERIVATIVE_CACHE_BYTES = 256 * 1024 * 1024
+# Variant name to the largest width of that variant, in pixels
+IMAGE_VARIANT_WIDTHS = {
+    'thumbnail': 160,
+    'feed': 640,
+}
+IMAGE_DERIVATIVE_JPEG_QUALITY = 80
+# Foreign images proxied for markdown posts (see posts.image_proxy), downloaded again once older than the TTL
+FOREIGN_IMAGE_CACHE_ROOT = os.path.join(BASE_DIR, 'foreign_image_cache')
+FOREIGN_IMAGE_CACHE_TTL = 60 * 60
+FOREIGN_IMAGE_CACHE_BYTES = 128 * 1024 * 1024
+
+# Shared by every process, so that invalidating an entry in one process invalidates it for all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'response_cache',
+    }
+}
+# Seconds the data of a public endpoint is cached for, it is also invalidated as soon as what it shows changes
+RESPONSE_CACHE_TTL = 300
+
+# Federation
+# Seconds a request that fans out to every node will wait before giving up on the nodes that have not answered
+FEDERATION_FAN_OUT_DEADLINE = 8
+# Maximum number of nodes contacted at the same time by a single fan out
+FEDERATION_FAN_OUT_WORKERS = 8
+# Seconds to wait when connecting to, and then reading from, a foreign server
+FEDERATION_CONNECT_TIMEOUT = 3.05
+FEDERATION_READ_TIMEOUT = 10
+# Failed connections and gateway errors are retried, waiting backoff * (2 ^ retry) seconds in between
+FEDERATION_RETRIES = 2
+FEDERATION_RETRY_BACKOFF = 0.3
+# Size of the keep-alive connection pools kept for every foreign server
+FEDERATION_POOL_CONNECTIONS = 4
+FEDERATION_POOL_MAXSIZE = 10
+# Requests to a foreign server are refused for FEDERATION_BREAKER_OPEN_SECONDS once at least MIN_CALLS requests were
+# made in the last WINDOW seconds and FAILURE_RATE of them failed or took longer than SLOW_CALL seconds
+FEDERATION_BREAKER_WINDOW = 60
+FEDERATION_BREAKER_MIN_CALLS = 5
+FEDERATION_BREAKER_FAILURE_RATE = 0.5
+FEDERATION_BREAKER_SLOW_CALL = 5
+FEDERATION_BREAKER_OPEN_SECONDS = 30
+# Maximum number of requests to a single foreign server in flight at once, further requests are refused right away
+FEDERATION_MAX_IN_FLIGHT = 6
+# Identical GET requests to a foreign server made at once in this process share a single request, and its response is
+# reused for this many seconds afterwards. At most CACHE_SIZE responses are kept.
+FEDERATION_SHARED_RESULT_SECONDS = 1
+FEDERATION_SHARED_RESULT_CACHE_SIZE = 500
+# Foreign author profiles are cached for this many seconds, or less if the author was not found. After that a profile
+# is still served for FOREIGN_AUTHOR_STALE_TTL seconds while it is fetched again in the background.
+FOREIGN_AUTHOR_CACHE_TTL = 300
+FOREIGN_AUTHOR_STALE_TTL = 60 * 60
+FOREIGN_AUTHOR_NOT_FOUND_TTL = 60
+FOREIGN_AUTHOR_CACHE_SIZE = 1000
+# Seconds a node's verified credentials are trusted without checking its password again
+NODE_CREDENTIAL_CACHE_TTL = 60
+NODE_CREDENTIAL_CACHE_SIZE = 100
+# Seconds before each node's list of authors is downloaded again. When a view finds it older than that it is
+# refreshed in a background thread, unless disabled here (e.g. when the sync_foreign_authors command is scheduled)
+FOREIGN_AUTHOR_DIRECTORY_MAX_AGE = 600
+FOREIGN_AUTHOR_BACKGROUND_SYNC = True
+# A foreign author's posts are fetched in pages of this size, all at once, then cached for this many seconds
+FOREIGN_AUTHOR_POSTS_PAGE_SIZE = 50
+FOREIGN_AUTHOR_POSTS_CACHE_TTL = 60
+FOREIGN_AUTHOR_POSTS_CACHE_SIZE = 100
+# The home stream reads each node's public posts in pages of this size, and caches every page for this many seconds
+FOREIGN_PUBLIC_POSTS_PAGE_SIZE = 50
+FOREIGN_PUBLIC_POSTS_CACHE_TTL = 60
+FOREIGN_PUBLIC_POSTS_CACHE_SIZE = 200
+# The ingest_foreign_posts command copies at most this many pages of each node's public posts into the database
+FOREIGN_POST_INGEST_MAX_PAGES = 10
+# A stored foreign post older than FOREIGN_POST_FRESH_TTL seconds is fetched again by a job when it is viewed. Until
+# it is older than FOREIGN_POST_STALE_TTL it is shown without waiting on the node, after that the node is asked first.
+FOREIGN_POST_FRESH_TTL = 5 * 60
+FOREIGN_POST_STALE_TTL = 24 * 60 * 60
+# The comments of a foreign post are cached for FOREIGN_COMMENTS_CACHE_TTL seconds, then served for
+# FOREIGN_COMMENTS_STALE_TTL more seconds while they are fetched again in the background
+FOREIGN_COMMENTS_CACHE_TTL = 30
+FOREIGN_COMMENTS_STALE_TTL = 10 * 60
+FOREIGN_COMMENTS_CACHE_SIZE = 200
+
+# Background jobs (see jobs.queue)
+# A failed job is retried after JOBS_RETRY_DELAY seconds, doubled after every further failure up to JOBS_MAX_RETRY_DELAY
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 30
+JOBS_MAX_RETRY_DELAY = 60 * 60
+# Maximum number of jobs talking to the same node that run at once
+JOBS_MAX_PER_NODE = 2
+# Seconds a job may run before it is assumed its worker died, and it is run again
+JOBS_LOCK_TIMEOUT = 10 * 60
+# Threads of each run_jobs worker, and seconds they wait before looking for jobs again when none are due
+JOBS_WORKER_THREADS = 4
+JOBS_POLL_INTERVAL = 5
+# Friend requests and comments to foreign servers are sent from an outbox (see nodes.outbox), at most OUTBOX_BATCH_SIZE
+# messages per node per job. A message that could not be delivered is retried after OUTBOX_RETRY_DELAY seconds,
+# doubled after every further failure up to OUTBOX_MAX_RETRY_DELAY, and given up on after OUTBOX_MAX_ATTEMPTS.
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 30
+OUTBOX_MAX_RETRY_DELAY = 60 * 60
+
+# Friends
+# Seconds between checks for friendships changed by other processes, until then the in-process friend graph is trusted
+FRIEND_GRAPH_CHECK_INTERVAL = 1
+
 # Configure for deployment to heroku, handles issues with static assets
 django_heroku.settings(locals())
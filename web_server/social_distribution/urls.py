@@ -28,6 +28,7 @@ urlpatterns = [
     path('posts/', include('posts.urls')),
     path('', include('friendship.urls')),
     path('user/', include('users.urls')),
+    path('nodes/', include('nodes.urls')),
     path('github/', views.github, name='github'),
 
 
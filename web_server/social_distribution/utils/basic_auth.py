@@ -7,10 +7,39 @@
 
 
 import base64
+import hashlib
+import hmac
+from django.conf import settings
 from django.http import HttpResponse
 from django.contrib.auth import authenticate, login
 from nodes.models import Node
 from django.contrib.auth.hashers import check_password
+from social_distribution.utils.cache import TTLCache
+
+#############################################################################
+
+# Node credentials that were recently verified.
+# Checking a password means hashing it, which is slow on purpose, so nodes that keep sending the same credentials are
+# only checked once per TTL. Entries are keyed by an HMAC of the credentials so passwords are never kept in memory.
+# The HMAC also covers the password hash stored for the node, and the node's permissions are read from its row on
+# every request, so a node whose password was changed or that was deleted or restricted by any process is not let in
+# from the cache. Cleared in the process that saves or deletes a Node as well, see nodes.signals
+_verified_node_credentials = TTLCache(settings.NODE_CREDENTIAL_CACHE_SIZE, settings.NODE_CREDENTIAL_CACHE_TTL)
+
+
+def _credentials_digest(username, password, password_hash):
+    return hmac.new(settings.SECRET_KEY.encode('utf-8'), f"{username}:{password}:{password_hash}".encode('utf-8'),
+                    hashlib.sha256).hexdigest()
+
+
+def forget_node_credentials():
+    _verified_node_credentials.clear()
+
+
+def _authenticate_remote_server(request, image_share, post_share):
+    request.remote_server_authenticated = True
+    request.remote_server_authenticated_for_images = image_share
+    request.remote_server_authenticated_for_posts = post_share
 
 #############################################################################
 
@@ -43,6 +72,14 @@ def handle_incoming_request_or_request(view, request, test_func, realm="", *args
                 uname, passwd = base64.b64decode(
                     auth[1]).decode('utf-8').rsplit(':', 1)
 
+                # Nodes that recently authenticated with these credentials do not need to be checked again
+                entry = Node.objects.filter(foreign_server_username=uname).first()
+                if entry is not None:
+                    digest = _credentials_digest(uname, passwd, entry.foreign_server_password)
+                    if _verified_node_credentials.get(digest) is not None:
+                        _authenticate_remote_server(request, entry.image_share, entry.post_share)
+                        return view(request, *args, **kwargs)
+
                 # This code would allow credentials of local authors to remotely authorize,
                 # This use case is not supported for now
 
@@ -56,13 +93,11 @@ def handle_incoming_request_or_request(view, request, test_func, realm="", *args
                             return view(request, *args, **kwargs)
 
                 # Check if the credentials are valid for the host requesting them
-                if Node.objects.all().filter(foreign_server_username=uname).exists():
-                    entry = Node.objects.all().get(foreign_server_username=uname)
+                if entry is not None:
 
                     if check_password(passwd, entry.foreign_server_password):
-                        request.remote_server_authenticated = True
-                        request.remote_server_authenticated_for_images = entry.image_share
-                        request.remote_server_authenticated_for_posts = entry.post_share
+                        _verified_node_credentials.set(digest, True)
+                        _authenticate_remote_server(request, entry.image_share, entry.post_share)
                         return view(request, *args, **kwargs)
                     else:
                         deny_response += " The provided password for your server authentication was invalid"
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+import threading
+import time
+
+from django.db import connections
+
+
+class TTLCache:
+    """
+    A thread safe, size bounded, in-process cache.
+    Entries expire once their time to live has passed, and when the cache is full the least recently used entry
+    is evicted to make room for the new one.
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        :param max_size: the maximum number of entries held at once
+        :param ttl: the default number of seconds an entry lives for, may be overridden per entry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for key, or default if there is no entry or the entry has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores value for key, evicting the least recently used entry if the cache is full
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class StaleWhileRevalidateCache:
+    """
+    A thread safe, size bounded, in-process cache of things fetched from elsewhere that are better served late than
+    not at all.
+    Entries are fresh for their time to live. After that they are stale for a while longer: they are still served
+    right away, and a background thread fetches them again. Only one refresh of an entry runs at a time, and if it
+    fails the stale entry is kept until it expires. When the cache is full the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size, ttl, stale_ttl):
+        """
+        :param max_size: the maximum number of entries held at once
+        :param ttl: the default number of seconds an entry is fresh for, may be overridden per entry
+        :param stale_ttl: the default number of seconds an entry is still served after it stopped being fresh
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = TTLCache(max_size, ttl + stale_ttl)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def set(self, key, value, ttl=None, stale_ttl=None):
+        """
+        Stores a value fetched just now
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if stale_ttl is None:
+            stale_ttl = self.stale_ttl
+        now = time.monotonic()
+        self._entries.set(key, (now, now + ttl, value), ttl=ttl + stale_ttl)
+
+    def get(self, key, fetch=None, remember=None):
+        """
+        Returns the value stored for key, starting a background refresh if it is stale
+        :param fetch: zero argument callable fetching the value again, nothing is refreshed if not given
+        :param remember: callable (key, value) storing what fetch returned, defaults to set. It may decide not to
+                         store some values, such as failures.
+        :return: (value, age) where age is the number of seconds since the value was fetched, or None if there is no
+                 entry or it has expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        fetched_at, fresh_until, value = entry
+        now = time.monotonic()
+        if now >= fresh_until and fetch is not None:
+            self._refresh_in_background(key, fetch, remember)
+        return value, now - fetched_at
+
+    def fetch(self, key, fetch, remember=None):
+        """
+        Returns the value stored for key as get does, or fetches and stores it if there is none
+        :return: (value, age)
+        """
+        found = self.get(key, fetch, remember)
+        if found is not None:
+            return found
+        value = fetch()
+        (remember or self.set)(key, value)
+        return value, 0
+
+    def _refresh_in_background(self, key, fetch, remember):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                (remember or self.set)(key, fetch())
+            except Exception as e:
+                print(f"Could not refresh the cached '{key}': {e}")
+            finally:
+                # Worker threads get their own database connections, which Django will not clean up for us
+                connections.close_all()
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def delete(self, key):
+        self._entries.delete(key)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+from social_distribution.utils.cache import TTLCache
+
+_MISSING = object()
+
+
+def fan_out(calls, deadline=None, max_workers=None):
+    """
+    Runs a set of independent calls concurrently and collects whatever finished before the deadline.
+
+    This is meant for talking to many foreign nodes at once, where the total time should be bounded by the slowest
+    node that answers in time rather than by the sum of every node's latency. Calls that raise or do not finish
+    before the deadline are reported as errors instead of failing the whole batch, so callers always get partial
+    results.
+
+    :param calls: dict mapping a key (e.g. a node hostname) to a zero argument callable
+    :param deadline: seconds to wait for all calls to finish, defaults to settings.FEDERATION_FAN_OUT_DEADLINE
+    :param max_workers: maximum number of calls in flight at once, defaults to settings.FEDERATION_FAN_OUT_WORKERS
+    :return: (results, errors) two dicts keyed the same way as calls. A key is in exactly one of them.
+    """
+    results = dict()
+    errors = dict()
+    if len(calls) == 0:
+        return results, errors
+
+    if deadline is None:
+        deadline = settings.FEDERATION_FAN_OUT_DEADLINE
+    if max_workers is None:
+        max_workers = settings.FEDERATION_FAN_OUT_WORKERS
+
+    def run(call):
+        try:
+            return call()
+        finally:
+            # Worker threads get their own database connections, which Django will not clean up for us
+            connections.close_all()
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(calls)))
+    try:
+        futures = {executor.submit(run, call): key for key, call in calls.items()}
+        done, not_done = wait(futures, timeout=deadline)
+
+        for future in done:
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = f"{type(e).__name__}: {e}"
+
+        for future in not_done:
+            # Stragglers are abandoned, they will finish in the background but nobody is waiting on them
+            future.cancel()
+            errors[futures[future]] = "Did not respond before the deadline"
+    finally:
+        # Do not block on abandoned calls
+        executor.shutdown(wait=False)
+
+    return results, errors
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single call.
+
+    The first thread to ask for a key makes the call, threads asking for the same key while it runs wait for it and
+    get the same result, or the same exception. A result can also be kept for a few seconds afterwards, so calls made
+    just after it finished reuse it instead of starting again. Exceptions are never kept. Thread safe.
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size: the maximum number of results kept once their call has finished
+        """
+        self._results = TTLCache(max_size, 0)
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, function, ttl=0, keep=None):
+        """
+        Returns the result of function, calling it unless a call for the same key is in flight or recently finished
+        :param key: hashable identifying what function computes
+        :param function: zero argument callable
+        :param ttl: seconds the result is reused for after the call finished, 0 to only share it with waiting threads
+        :param keep: predicate on the result deciding if it may be reused after the call finished, defaults to always
+        """
+        with self._lock:
+            result = self._results.get(key, _MISSING)
+            if result is not _MISSING:
+                return result
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and ttl > 0 and (keep is None or keep(call.result)):
+                    self._results.set(key, call.result, ttl)
+            call.done.set()
+        return call.result
+
+    def clear(self):
+        """
+        Forgets the results kept, calls in flight are still shared
+        """
+        self._results.clear()
@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+import os
+import tempfile
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Opens a file for binary writing that only appears at path once it has been written completely, so readers never
+    see a partially written file. Nothing is written to path if the block raises.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def touch(path):
+    """
+    Marks a cached file as used just now
+    :return: False if the file does not exist
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def evict_least_recently_used(root, max_bytes, keep=None):
+    """
+    Removes the files under root that were least recently used (modified or touched) until the files take up no more
+    than max_bytes
+    :param keep: path of a file that is never removed, such as the one just written
+    """
+    files = []
+    for directory, directories, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for used_at, size, path in files)
+    for used_at, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
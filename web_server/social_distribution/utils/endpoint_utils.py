@@ -1,5 +1,8 @@
+from hashlib import md5
 from django.core.paginator import Paginator
-from django.http import HttpResponse, JsonResponse, QueryDict
+from django.http import HttpResponse, JsonResponse, QueryDict, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from urllib.parse import urlparse, urlunparse
 
 class Endpoint:
@@ -12,6 +15,10 @@ class Endpoint:
     Error 405 - there is no handler that accepts the method verb requested (e.g. GET or POST)
     Error 406 - there is no handler that produces the requested content (e.g. Accepts: text/html)
     Error 500 - An exception occurred when running the handler
+
+    Handlers that declare a validator support conditional GETs: responses carry an ETag and Last-Modified, and requests
+    whose If-None-Match or If-Modified-Since still match are answered with 304 Not Modified without running the
+    handler.
     """
 
     def __init__(self, request, query, handlers, default_page_size=10, max_page_size=50):
@@ -54,8 +61,8 @@ class Endpoint:
         # Find out which response content types we can support on this method
         supported_content_types = [handler.produces for handler in method_handlers]
 
-        # Find out which content type should be served to the user agent
-        accepted_content_types = self.request.headers['Accept'].split(',')
+        # Find out which content type should be served to the user agent, user agents that do not say accept anything
+        accepted_content_types = self.request.headers.get('Accept', '*/*').split(',')
         accepted_type = None
         for content_type in accepted_content_types:
             # Find and serve the first acceptable type to the user
@@ -86,6 +93,15 @@ class Endpoint:
         # Filter method handlers based on the chosen content type, and choose the first one
         handler = [handler for handler in method_handlers if handler.produces == accepted_type][0]
 
+        # Answer conditional requests from the validators alone when nothing changed since the user agent last asked
+        validators = self._get_validators(handler, accepted_type)
+        if validators is not None:
+            not_modified = get_conditional_response(self.request, etag=validators[0], last_modified=validators[1])
+            if not_modified is not None:
+                if not_modified.status_code == 304:
+                    self._set_validators(not_modified, validators)
+                return not_modified
+
         # Attempt to fulfill the request using the handler, provide information the Handler needs
         try:
             response = None
@@ -98,13 +114,39 @@ class Endpoint:
                 raise TypeError("Handler must be class or subclass of Handler class")
 
             # Validate Response
-            if issubclass(type(response), HttpResponse):
+            if isinstance(response, (HttpResponse, StreamingHttpResponse)):
+                if validators is not None and response.status_code == 200:
+                    self._set_validators(response, validators)
                 return response
             else:
                 raise TypeError("Response handler unable to produce HttpResponse like object")
         except Exception as e:
             return HttpResponse(f"The server failed to handle your request. Cause Hint: {e}", status=500)
 
+    def _get_validators(self, handler, content_type):
+        """
+        Returns the (etag, last_modified) of the response the handler would produce, last_modified being a timestamp.
+        Returns None if the handler has no validator, or the request can not be answered with 304 Not Modified.
+        """
+        if handler.validator is None or self.request.method not in ("GET", "HEAD") or \
+                not handler.is_allowed(self.request):
+            return None
+
+        version, last_modified = handler.validator(self.request)
+        # The same data looks different on every page, in every content type, and to every requester
+        user = self.request.user.pk if self.request.user.is_authenticated else None
+        node = (getattr(self.request, 'remote_server_authenticated_for_images', None),
+                getattr(self.request, 'remote_server_authenticated_for_posts', None))
+        tag = f"{version}|{self.request.path}|{sorted(self.request.GET.lists())}|{content_type}|{user}|{node}"
+        return quote_etag(md5(tag.encode('utf-8')).hexdigest()), int(last_modified.timestamp())
+
+    @staticmethod
+    def _set_validators(response, validators):
+        response['ETag'] = validators[0]
+        response['Last-Modified'] = http_date(validators[1])
+        # User agents may keep the response, but must check it is still valid before using it again
+        patch_cache_control(response, no_cache=True)
+
     def _get_pagination_uris(self):
         """
         Returns a tuple containing absolute uris to the next and previous page of results.
@@ -147,7 +189,7 @@ class Handler:
     """
     Handles a request
     """
-    def __init__(self, method, produces, handling_func, requires_authentication=True):
+    def __init__(self, method, produces, handling_func, requires_authentication=True, validator=None):
         """
         Create the handler
         :param method: Which http verb this handler deals with (e.g. "GET" or "POST")
@@ -157,11 +199,24 @@ class Handler:
                 request: the original http request
             Should return:
                 A valid HttpResponse object consistent with it's produces string
+        :param validator: optional function telling cheaply if the response changed, enables conditional GETs.
+            Should take the following arguments:
+                request: the original http request
+            Should return:
+                (version, last_modified) where version is a string that changes whenever the response would, and
+                last_modified is an aware datetime of when it last changed
         """
         self.method = method
         self.produces = produces
         self.handler = handling_func
         self.requires_authentication = requires_authentication
+        self.validator = validator
+
+    def is_allowed(self, request):
+        """
+        Tells if handle would run the handling function for the request, rather than refuse it
+        """
+        return not self.requires_authentication or request.user.is_authenticated
 
     def handle(self, request):
         """
@@ -169,7 +224,7 @@ class Handler:
         :param request:
         :return:
         """
-        if self.requires_authentication and not request.user.is_authenticated:
+        if not self.is_allowed(request):
             return JsonResponse({
                 "success": False,
                 "message": "You must be logged in to access this Endpoint"
@@ -187,7 +242,12 @@ class PagingHandler(Handler):
         pager: A Paginator that has been loaded with the query to get information about pagination
         pagination_uris: A tuple of absolute_uris of form (previous_page, next_page).
             If there is no previous or next page the uri should be None
+
+    The handler function checks who may see the results itself, requires_authentication is not enforced.
     """
+    def is_allowed(self, request):
+        return True
+
     def handle(self, request, results, pager, pagination_uris):
         """
         Handles the request using it's handler, gets the query results and pager information as well.
@@ -0,0 +1,73 @@
+"""
+Cache of the data behind the public endpoints foreign nodes poll, such as every public post or every author.
+
+Entries live in Django's cache, shared by every process, keyed by (endpoint, page, size, permission class of the
+requester) along with a version. Any change to the models the endpoints serialize bumps the version (see the signals
+of the posts and users apps), which invalidates every entry at once without having to know their keys.
+
+The same version, along with when it last changed, serves as the validator of conditional GETs (see data_validator).
+"""
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+_VERSION_KEY = "response_cache:version"
+
+
+def _new_version():
+    # A fresh random version can never collide with one that was used before and evicted
+    return uuid4().hex, datetime.now(timezone.utc)
+
+
+def data_version():
+    """
+    :return: (version, changed_at) where version changes, and changed_at is set to the current time, whenever data
+             shown by the cached endpoints changes
+    """
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        cache.add(_VERSION_KEY, _new_version(), None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def data_validator(request):
+    """
+    Validator for Endpoint handlers whose response only changes when the data tracked here does
+    """
+    return data_version()
+
+
+def invalidate_responses():
+    """
+    Forgets every cached response
+    """
+    cache.set(_VERSION_KEY, _new_version(), None)
+
+
+def permission_class(request):
+    """
+    :return: a name for what the requester is allowed to see, requesters with the same name are served the same data
+    """
+    if getattr(request, 'remote_server_authenticated', False):
+        return "node:images={}:posts={}".format(getattr(request, 'remote_server_authenticated_for_images', False),
+                                                getattr(request, 'remote_server_authenticated_for_posts', False))
+    return "user" if request.user.is_authenticated else "anonymous"
+
+
+def cached_response_data(request, endpoint, build, page=None, size=None):
+    """
+    Returns the data of a response from the cache, building and caching it on a miss
+    :param endpoint: name of the endpoint
+    :param build: zero argument callable building the data, which must be picklable
+    :param page: the page requested, if the endpoint is paged
+    :param size: the size of the pages, if the endpoint is paged
+    """
+    key = f"response_cache:{data_version()[0]}:{endpoint}:{page}:{size}:{permission_class(request)}"
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.RESPONSE_CACHE_TTL)
+    return data
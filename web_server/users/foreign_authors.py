@@ -0,0 +1,239 @@
+"""
+Foreign authors: a cache of their profiles, and a directory of every author on every node.
+
+Comments and friend lists reference foreign authors only by their uid, so showing them requires asking the
+author's node for their profile. Profiles are cached here, keyed by the sanitized uid (no protocol, no trailing
+slash, no dashes in the uuid), so that the same author is only fetched once per TTL no matter how many comments
+they have made. Once a profile is older than settings.FOREIGN_AUTHOR_CACHE_TTL it is still served for
+settings.FOREIGN_AUTHOR_STALE_TTL seconds while it is fetched again in the background, so a node that is down or slow
+does not hold up pages showing its authors. Authors the node says do not exist (404) are cached as well, for a shorter
+time and never served stale, so that missing authors do not cost a round trip every time they are shown. Other
+failures are not cached.
+
+The directory (ForeignAuthor) holds every author each node lists at GET /author, so that friend lists and the list of
+authors to befriend do not download every node's authors on every request. Each node's directory is refreshed once it
+is older than settings.FOREIGN_AUTHOR_DIRECTORY_MAX_AGE, by the sync_foreign_authors management command or in the
+background when a view reads the directory.
+"""
+from datetime import timedelta
+import json
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+import requests
+
+from friendship.views import sanitize_author_id
+from nodes.dialect import author_urls, get_dialect, learn
+from nodes.models import Node
+from users.models import ForeignAuthor, ForeignAuthorSync
+from social_distribution.utils.cache import StaleWhileRevalidateCache
+from social_distribution.utils.concurrency import fan_out
+
+_profiles = StaleWhileRevalidateCache(settings.FOREIGN_AUTHOR_CACHE_SIZE, settings.FOREIGN_AUTHOR_CACHE_TTL,
+                                      settings.FOREIGN_AUTHOR_STALE_TTL)
+
+
+def _fetch_profile(author_id, node):
+    """
+    :return: ((status_code, body) as described in fetch_foreign_author_profile, the uuid form of the url that worked
+             or None)
+    """
+    status_code = 404
+    for uuid_form, url in author_urls(author_id, get_dialect(node)):
+        try:
+            res = node.make_request('GET', url)
+        except requests.RequestException as e:
+            return (502, f"Could not connect to foreign server: {e}"), None
+        if res.status_code >= 200 and res.status_code < 300:
+            try:
+                return (200, res.json()), uuid_form
+            except ValueError:
+                return (404, "Wrong Format Foreign Server Response"), None
+        status_code = res.status_code
+
+    return (status_code, "Can't Retrieve Foreign Author's Information"), None
+
+
+def fetch_foreign_author_profile(author_id, node=None):
+    """
+    Fetches the profile of a foreign author from the node they belong to, bypassing the cache. Nodes differ on whether
+    author urls write the uuid with dashes, both are tried until the node's dialect is known.
+    :param author_id: the uid of the author, with or without protocol
+    :param node: the Node the author belongs to, looked up from the author id if not given
+    :return: (status_code, body) where body is the profile on a 200, otherwise a message describing the problem
+    """
+    author_id = sanitize_author_id(author_id)
+    if node is None:
+        node = Node.objects.select_related('dialect').filter(foreign_server_hostname=author_id.split("/")[0]).first()
+    if node is None:
+        return 404, "Can't Retrieve Foreign Author's Information"
+
+    result, uuid_form = _fetch_profile(author_id, node)
+    if uuid_form is not None:
+        learn(node, author_uuid_form=uuid_form)
+    return result
+
+
+def _remember(author_id, result):
+    status_code, body = result
+    if status_code == 200:
+        _profiles.set(author_id, result)
+    elif status_code == 404:
+        _profiles.set(author_id, result, ttl=settings.FOREIGN_AUTHOR_NOT_FOUND_TTL, stale_ttl=0)
+
+
+def get_foreign_author_profile_with_age(author_id):
+    """
+    Returns the profile of a foreign author, from the cache if possible
+    :return: ((status_code, body) as described in fetch_foreign_author_profile, seconds since it was fetched)
+    """
+    author_id = sanitize_author_id(author_id)
+    return _profiles.fetch(author_id, lambda: fetch_foreign_author_profile(author_id), _remember)
+
+
+def get_foreign_author_profile(author_id):
+    """
+    Returns the profile of a foreign author, from the cache if possible
+    :return: (status_code, body) as described in fetch_foreign_author_profile
+    """
+    return get_foreign_author_profile_with_age(author_id)[0]
+
+
+def prefetch_foreign_author_profiles(author_ids):
+    """
+    Resolves many foreign authors in one pass. Cached profiles are used as is (stale ones are refreshed in the
+    background), and every author that is not cached is fetched from their node at the same time.
+    :param author_ids: iterable of author uids, with or without protocol
+    :return: dict from each of the given author ids to (status_code, body) as described in fetch_foreign_author_profile
+    """
+    sanitized = {author_id: sanitize_author_id(author_id) for author_id in author_ids}
+    found = dict()
+    missing = []
+    for author_id in set(sanitized.values()):
+        cached = _profiles.get(author_id, lambda author_id=author_id: fetch_foreign_author_profile(author_id),
+                               _remember)
+        if cached is None:
+            missing.append(author_id)
+        else:
+            found[author_id] = cached[0]
+
+    # Look up all the nodes at once so the parallel fetches do not need the database
+    nodes = Node.objects.select_related('dialect').in_bulk({author_id.split("/")[0] for author_id in missing})
+    calls = dict()
+    for author_id in missing:
+        node = nodes.get(author_id.split("/")[0])
+        if node is None:
+            found[author_id] = (404, "Can't Retrieve Foreign Author's Information")
+            _remember(author_id, found[author_id])
+        else:
+            calls[author_id] = (lambda author_id=author_id, node=node: _fetch_profile(author_id, node))
+
+    results, errors = fan_out(calls)
+    for author_id, (result, uuid_form) in results.items():
+        if uuid_form is not None:
+            learn(nodes[author_id.split("/")[0]], author_uuid_form=uuid_form)
+        _remember(author_id, result)
+        found[author_id] = result
+    for author_id, error in errors.items():
+        found[author_id] = (502, error)
+
+    return {author_id: found[sanitized[author_id]] for author_id in sanitized}
+
+
+def clear_foreign_author_profiles():
+    _profiles.clear()
+
+
+def fetch_node_authors(node):
+    """
+    Downloads the list of every author on a node
+    :return: dict from sanitized author uid to the author exactly as the node listed them
+    :raise: requests.RequestException or ValueError if the node did not answer with a list of authors
+    """
+    res = node.make_request('GET', "http://{}/author".format(node.foreign_server_api_location.rstrip("/")))
+    if res.status_code < 200 or res.status_code >= 300:
+        raise ValueError(f"Node answered with status {res.status_code}")
+    authors = dict()
+    for foreign_author in res.json():
+        if not isinstance(foreign_author, dict) or "id" not in foreign_author:
+            raise ValueError("Node listed an author without an id")
+        authors[sanitize_author_id(foreign_author["id"])] = foreign_author
+    return authors
+
+
+def store_node_authors(node, authors):
+    """
+    Brings the directory of a node in line with the authors it listed, only writing the authors that changed
+    :param authors: dict as returned by fetch_node_authors
+    """
+    existing = dict(ForeignAuthor.objects.filter(node=node).values_list('uid', 'profile'))
+    with transaction.atomic():
+        gone = existing.keys() - authors.keys()
+        if gone:
+            ForeignAuthor.objects.filter(node=node, uid__in=gone).delete()
+        for uid, foreign_author in authors.items():
+            profile = json.dumps(foreign_author, sort_keys=True)
+            if existing.get(uid) != profile:
+                ForeignAuthor.objects.update_or_create(uid=uid, defaults={'node': node, 'profile': profile})
+
+
+def stale_nodes():
+    """
+    :return: list of the nodes whose directory has not been refreshed (successfully or not) recently
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.FOREIGN_AUTHOR_DIRECTORY_MAX_AGE)
+    return list(Node.objects.filter(Q(author_sync__isnull=True) | Q(author_sync__attempted_at__isnull=True) |
+                                    Q(author_sync__attempted_at__lt=cutoff)))
+
+
+def sync_foreign_authors(nodes=None):
+    """
+    Refreshes the directory of the given nodes, asking all of them at the same time
+    :param nodes: the nodes to refresh, defaults to the stale ones
+    :return: dict from hostname to error for the nodes that could not be refreshed
+    """
+    if nodes is None:
+        nodes = stale_nodes()
+    nodes = {node.foreign_server_hostname: node for node in nodes}
+    results, errors = fan_out({hostname: (lambda node=node: fetch_node_authors(node))
+                               for hostname, node in nodes.items()})
+
+    now = timezone.now()
+    for hostname, authors in results.items():
+        store_node_authors(nodes[hostname], authors)
+        ForeignAuthorSync.objects.update_or_create(node=nodes[hostname], defaults={
+            'attempted_at': now, 'synced_at': now, 'error': ''})
+    for hostname, error in errors.items():
+        # The authors from the last successful refresh are kept
+        ForeignAuthorSync.objects.update_or_create(node=nodes[hostname], defaults={
+            'attempted_at': now, 'error': error})
+    return errors
+
+
+_background_sync_lock = threading.Lock()
+
+
+def sync_foreign_authors_in_background():
+    """
+    Starts refreshing the stale nodes in a background thread, unless none are stale or a refresh is already running.
+    Does not wait for it, callers keep using the directory as it is.
+    """
+    if not settings.FOREIGN_AUTHOR_BACKGROUND_SYNC:
+        return
+    nodes = stale_nodes()
+    if len(nodes) == 0 or not _background_sync_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            sync_foreign_authors(nodes)
+        except Exception as e:
+            print(f"Could not refresh the foreign author directory: {e}")
+        finally:
+            connections.close_all()
+            _background_sync_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
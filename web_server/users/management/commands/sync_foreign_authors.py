@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from nodes.models import Node
+from users.foreign_authors import sync_foreign_authors
+
+
+class Command(BaseCommand):
+    help = "Refreshes the directory of foreign authors from every node whose directory is stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Refresh every node, even the ones that are not stale")
+
+    def handle(self, *args, **options):
+        nodes = list(Node.objects.all()) if options['all'] else None
+        errors = sync_foreign_authors(nodes)
+        for hostname, error in errors.items():
+            self.stderr.write(f"Could not refresh authors of '{hostname}': {error}")
+        self.stdout.write("Foreign author directory refreshed")
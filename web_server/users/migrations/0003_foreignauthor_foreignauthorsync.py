@@ -0,0 +1,32 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0001_initial'),
+        ('users', '0002_auto_20200322_1721'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForeignAuthorSync',
+            fields=[
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='author_sync', serialize=False, to='nodes.Node')),
+                ('attempted_at', models.DateTimeField(null=True)),
+                ('synced_at', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ForeignAuthor',
+            fields=[
+                ('uid', models.CharField(max_length=500, primary_key=True, serialize=False)),
+                ('profile', models.TextField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='authors', to='nodes.Node')),
+            ],
+        ),
+    ]
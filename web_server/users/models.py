@@ -2,6 +2,8 @@ from django.db import models
 from django.conf import settings
 from uuid import uuid4
 from django.contrib.auth.models import AbstractUser
+from nodes.models import Node
+import json
 # Create your models here.
 
 """Author Model: This model is used to store all Author related information. This model is an extension of 
@@ -84,3 +86,33 @@ class Author(AbstractUser):
         Given a uid (uri pointing to author), returns the uuid that is unique to the user
         """
         return uid.split('/')[-1]
+
+
+class ForeignAuthor(models.Model):
+    """
+    Directory of the authors of every node, as listed by their GET /author endpoint.
+    Kept up to date by users.foreign_authors.sync_foreign_authors so that views never have to download every node's
+    author list themselves.
+    """
+    # Sanitized uid of the author: no protocol, no trailing slash, no dashes in the uuid
+    uid = models.CharField(primary_key=True, max_length=500)
+    node = models.ForeignKey(Node, on_delete=models.CASCADE, related_name='authors')
+    # The author exactly as the node listed them, as JSON
+    profile = models.TextField()
+
+    def to_api_object(self):
+        return json.loads(self.profile)
+
+
+class ForeignAuthorSync(models.Model):
+    """
+    When the author directory of each node was last refreshed.
+    Kept separate from Node because saving a Node rehashes its password.
+    """
+    node = models.OneToOneField(Node, primary_key=True, on_delete=models.CASCADE, related_name='author_sync')
+    # Last time the node was asked for its authors, whether or not that worked
+    attempted_at = models.DateTimeField(null=True)
+    # Last time the node's authors were successfully stored
+    synced_at = models.DateTimeField(null=True)
+    # Why the last attempt failed, empty if it worked
+    error = models.TextField(blank=True)
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from friendship.signals import friendship_changed
+from social_distribution.utils.response_cache import invalidate_responses
+from users.models import Author
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def author_changed(sender, **kwargs):
+    # Authors are listed on their own and inside every post and comment
+    invalidate_responses()
+
+
+@receiver(friendship_changed)
+def friends_changed(sender, **kwargs):
+    # Author profiles list their friends, and who can see a post depends on them
+    invalidate_responses()
@@ -1,8 +1,21 @@
+import json
+import threading
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from unittest import mock
 
 from django.test import TestCase, Client, override_settings
-from users.models import Author
+from django.utils import timezone
+from users.models import Author, ForeignAuthor, ForeignAuthorSync
+from users.foreign_authors import get_foreign_author_profile, prefetch_foreign_author_profiles, \
+    clear_foreign_author_profiles, stale_nodes, sync_foreign_authors
+from friendship.models import Friend, FriendRequest
+from jobs.models import Job
+from jobs.queue import run_pending_jobs
+from nodes.models import Node
+from posts.models import ForeignPost
+from social_distribution.utils.cache import StaleWhileRevalidateCache, TTLCache
 from django.urls import reverse
 from dateutil import tz
 
@@ -128,3 +141,245 @@ class TestAuthorModels(TestCase):
         self.assertEqual(return_dict['url'], test_dic['url'])
         self.assertEqual(return_dict['github'], test_dic['github'])
 
+
+
+#This is the unit test for the foreign author profile cache
+class TestForeignAuthorCache(TestCase):
+
+    def setUp(self):
+        clear_foreign_author_profiles()
+        self.node = Node.objects.create(foreign_server_hostname="foreign.node", foreign_server_username="foreign",
+                                        foreign_server_password="password", foreign_server_api_location="foreign.node")
+        self.found_uid = "foreign.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'found').hex
+        self.missing_uid = "foreign.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'missing').hex
+
+    def fake_request(self, node, method, url, **kwargs):
+        response = mock.Mock()
+        if uuid.uuid5(uuid.NAMESPACE_DNS, 'found').hex in url.replace("-", ""):
+            response.status_code = 200
+            response.json.return_value = {"id": "http://" + self.found_uid, "host": "http://foreign.node",
+                                          "displayName": "Found"}
+        else:
+            response.status_code = 404
+        return response
+
+    def test_prefetch_caches_found_and_missing_authors(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request) as make_request:
+            profiles = prefetch_foreign_author_profiles(["http://" + self.found_uid, self.missing_uid])
+            self.assertEqual(profiles["http://" + self.found_uid][0], 200)
+            self.assertEqual(profiles["http://" + self.found_uid][1]["displayName"], "Found")
+            self.assertEqual(profiles[self.missing_uid][0], 404)
+            requests_made = make_request.call_count
+
+            # Both the profile and the 404 are served from the cache afterwards
+            self.assertEqual(get_foreign_author_profile(self.found_uid)[0], 200)
+            self.assertEqual(get_foreign_author_profile(self.missing_uid)[0], 404)
+            self.assertEqual(make_request.call_count, requests_made)
+
+    def test_cache_expiry_and_eviction(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        # b was the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("d", 4, ttl=0)
+        self.assertIsNone(cache.get("d"))
+
+
+#This is the unit test for the foreign author directory
+@override_settings(FOREIGN_AUTHOR_BACKGROUND_SYNC=False)
+class TestForeignAuthorDirectory(TestCase):
+
+    def setUp(self):
+        self.node = Node.objects.create(foreign_server_hostname="directory.node", foreign_server_username="directory",
+                                        foreign_server_password="password", foreign_server_api_location="directory.node")
+        self.broken_node = Node.objects.create(foreign_server_hostname="broken.node", foreign_server_username="broken",
+                                               foreign_server_password="password",
+                                               foreign_server_api_location="broken.node")
+        self.uuids = [uuid.uuid5(uuid.NAMESPACE_DNS, f'directory{i}') for i in range(3)]
+        self.listed = [self.listing(i, f"Author {i}") for i in range(2)]
+
+    def listing(self, i, name):
+        return {"id": "https://directory.node/author/" + str(self.uuids[i]), "host": "https://directory.node",
+                "url": "https://directory.node/author/" + str(self.uuids[i]), "displayName": name}
+
+    def fake_request(self, node, method, url, **kwargs):
+        response = mock.Mock()
+        if node.foreign_server_hostname == "broken.node":
+            response.status_code = 500
+        else:
+            response.status_code = 200
+            response.json.return_value = self.listed
+        return response
+
+    def test_sync(self):
+        self.assertEqual(len(stale_nodes()), 2)
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            errors = sync_foreign_authors()
+        self.assertEqual(list(errors), ["broken.node"])
+        self.assertEqual(stale_nodes(), [])
+        self.assertEqual(ForeignAuthor.objects.count(), 2)
+        self.assertEqual(ForeignAuthor.objects.get(uid="directory.node/author/" + self.uuids[0].hex).to_api_object(),
+                         self.listed[0])
+        self.assertNotEqual(ForeignAuthorSync.objects.get(node=self.broken_node).error, "")
+
+        # Authors that are no longer listed are removed, and changed ones updated
+        self.listed = [self.listing(1, "Renamed"), self.listing(2, "Author 2")]
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            sync_foreign_authors([self.node])
+        self.assertEqual(set(ForeignAuthor.objects.values_list('uid', flat=True)),
+                         {"directory.node/author/" + self.uuids[i].hex for i in [1, 2]})
+        self.assertEqual(ForeignAuthor.objects.get(uid="directory.node/author/" + self.uuids[1].hex)
+                         .to_api_object()["displayName"], "Renamed")
+
+    def test_views_read_the_directory(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request):
+            sync_foreign_authors()
+
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'directory_reader')
+        author = Author.objects.create(id=id, username="directory_reader", password="password", is_active=True,
+                                       host="testserver", uid="testserver/author/" + id.hex,
+                                       url="http://testserver/author/" + id.hex, display_name="Reader")
+        Friend.objects.create(author_id=author.uid, friend_id="directory.node/author/" + self.uuids[0].hex)
+        client = Client()
+        client.force_login(author)
+
+        with mock.patch.object(Node, 'make_request', autospec=True) as make_request:
+            profile = client.get(reverse('retrieve_author_profile', args=[id.hex])).json()
+            candidates = client.get(reverse('view_list_of_available_authors_to_befriend', args=[id.hex])).json()
+        make_request.assert_not_called()
+
+        self.assertEqual([friend['displayName'] for friend in profile['friends']], ["Author 0"])
+        self.assertEqual([candidate['displayName'] for candidate in candidates['available_authors_to_befriend']],
+                         ["Author 1"])
+        self.assertIn(self.broken_node.get_safe_api_url(), candidates['errors'])
+
+
+# This is the unit test for checking foreign friendships in the background
+@override_settings(HOSTNAME='testserver',
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestFriendshipReconciliation(TestCase):
+
+    def setUp(self):
+        self.node = Node.objects.create(foreign_server_hostname="friends.node", foreign_server_username="friends",
+                                        foreign_server_password="password", foreign_server_api_location="friends.node")
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'reconciliation').hex
+        self.author = Author.objects.create(id=id, username='reconciliation', display_name="Reconciliation",
+                                            password="password", is_active=True, host="testserver",
+                                            uid="testserver/author/" + id, url="testserver/author/" + id)
+        self.friend_id = "friends.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'foreign_friend').hex
+        self.requested_id = "friends.node/author/" + uuid.uuid5(uuid.NAMESPACE_DNS, 'foreign_request').hex
+        Friend.objects.create(author_id=self.author.uid, friend_id=self.friend_id)
+        Friend.objects.create(author_id=self.friend_id, friend_id=self.author.uid)
+        FriendRequest.objects.create(from_id=self.author.uid, to_id=self.requested_id)
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def fake_request(self, node, method, url, **kwargs):
+        response = mock.Mock()
+        response.status_code = 200
+        # The friend unfriended our author, and the request was accepted
+        response.json.return_value = {"friends": self.requested_id in url}
+        return response
+
+    def test_profile_schedules_without_requests(self):
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request) as make_request:
+            for i in range(2):
+                response = self.client.get(reverse('profile', args=[self.author.uid]))
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(make_request.call_count, 0)
+            # Viewing the profile again while the checks are pending does not schedule them twice
+            self.assertEqual(Job.objects.count(), 2)
+
+            self.assertEqual(run_pending_jobs(), 2)
+        self.assertEqual(make_request.call_count, 2)
+        self.assertFalse(Friend.objects.filter(author_id=self.author.uid, friend_id=self.friend_id).exists())
+        self.assertTrue(Friend.objects.filter(author_id=self.author.uid, friend_id=self.requested_id).exists())
+        self.assertFalse(FriendRequest.objects.exists())
+
+    def test_failure_retried(self):
+        response = mock.Mock(status_code=503)
+        response.raise_for_status.side_effect = Exception("unavailable")
+        with mock.patch.object(Node, 'make_request', autospec=True, return_value=response):
+            self.client.get(reverse('profile', args=[self.author.uid]))
+            run_pending_jobs()
+        self.assertEqual(Job.objects.filter(state=Job.PENDING).count(), 2)
+        self.assertTrue(Friend.objects.filter(author_id=self.author.uid, friend_id=self.friend_id).exists())
+
+
+# This is the unit test for serving foreign posts and responses while they are refreshed in the background
+@override_settings(HOSTNAME='testserver', FOREIGN_POST_FRESH_TTL=60, FOREIGN_POST_STALE_TTL=3600,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestStaleForeignResponses(TestCase):
+
+    def setUp(self):
+        self.node = Node.objects.create(foreign_server_hostname="stale.node", foreign_server_username="stale",
+                                        foreign_server_password="password", foreign_server_api_location="stale.node")
+        id = uuid.uuid5(uuid.NAMESPACE_DNS, 'stale').hex
+        self.author = Author.objects.create(id=id, username='stale', display_name="Stale", password="password",
+                                            is_active=True, host="testserver", uid="testserver/author/" + id,
+                                            url="testserver/author/" + id)
+        self.post_id = uuid.uuid5(uuid.NAMESPACE_DNS, 'stale_post').hex
+        self.post = {"id": self.post_id, "title": "Stale", "description": "", "content": "Old content",
+                     "contentType": "text/plain", "visibility": "PUBLIC", "published": "2020-03-01T00:00:00+00:00",
+                     "author": {"id": "http://stale.node/author/" + id, "displayName": "Foreign"}, "comments": []}
+        ForeignPost.objects.create(id=self.post_id, node=self.node, author_uid="stale.node/author/" + id,
+                                   title="Stale", contentType="text/plain", visibility="PUBLIC",
+                                   published=timezone.now(), data=json.dumps(self.post),
+                                   fetched_at=timezone.now() - timedelta(minutes=10))
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def fake_request(self, node, method, url, **kwargs):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"posts": [dict(self.post, content="New content")]}
+        return response
+
+    def test_stale_post_is_shown_and_refreshed(self):
+        url = reverse('view_post', args=["stale.node/posts/" + self.post_id])
+        with mock.patch.object(Node, 'make_request', autospec=True, side_effect=self.fake_request) as make_request:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "Old content")
+            self.assertGreaterEqual(int(response['Age']), 600)
+            self.assertEqual(make_request.call_count, 0)
+            self.assertEqual(Job.objects.filter(name="refresh_foreign_post").count(), 1)
+
+            self.assertEqual(run_pending_jobs(), 1)
+            self.assertEqual(make_request.call_count, 1)
+            response = self.client.get(url)
+        self.assertContains(response, "New content")
+        self.assertLess(int(response['Age']), 60)
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_entries_are_served_while_refreshed(self):
+        cache = StaleWhileRevalidateCache(max_size=10, ttl=0, stale_ttl=60)
+        self.assertEqual(cache.fetch("key", lambda: 1)[0], 1)
+
+        refreshing = threading.Event()
+        finish = threading.Event()
+
+        def refresh():
+            refreshing.set()
+            finish.wait(5)
+            return 2
+
+        # The stale value is served right away, and refreshed only once
+        self.assertEqual(cache.get("key", refresh)[0], 1)
+        refreshing.wait(5)
+        self.assertEqual(cache.get("key", lambda: 3)[0], 1)
+        finish.set()
+        for i in range(50):
+            if cache.get("key")[0] == 2:
+                break
+            time.sleep(0.1)
+        value, age = cache.get("key")
+        self.assertEqual(value, 2)
+        self.assertLess(age, 5)
+
+        # A failed refresh keeps the stale value
+        cache.get("key", mock.Mock(side_effect=ValueError("down")))
+        self.assertEqual(cache.get("key")[0], 2)
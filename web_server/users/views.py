@@ -8,15 +8,22 @@ from django.contrib.auth import views as auth_views
 from django.urls import reverse
 from friendship.models import Friend
 from nodes.models import Node
+from nodes import outbox
 import requests
 from users.models import Author
+from posts.federation import fetch_foreign_comments, refresh_foreign_post
+from posts.jobs import schedule_foreign_post_refresh
+from posts.models import ForeignPost
 from django.conf import settings
-from uuid import uuid4
+from django.utils import timezone
+from uuid import NAMESPACE_URL, uuid5
+from hashlib import sha256
+import json
 
 from json import loads
 
 from nodes.models import Node
-from friendship.views import invalidate_friend_requests
+from friendship.jobs import schedule_friendship_reconciliation
 import requests
 from social_distribution.utils.basic_auth import validate_remote_server_authentication
 import re
@@ -43,8 +50,8 @@ def profile(request, user_id):
 
     if Author.is_uid_local(stripped_user_id):
         # @todo , this template expects a uuid in order to render, it should be able to handle a uid
-        invalidate_friends(request.get_host(), stripped_user_id)
-        invalidate_friend_requests(stripped_user_id)
+        # Foreign friendships are checked by the job queue, the page does not wait on foreign servers
+        schedule_friendship_reconciliation(stripped_user_id)
         return render(request, 'users/profile.html', {
             'user_id': Author.extract_uuid_from_uid(stripped_user_id),  # uuid
             'user_full_id': stripped_user_id,  # uid
@@ -61,41 +68,19 @@ def profile(request, user_id):
     })
 
 
-"""
- this function invalidates existing friendship of give author 
- it GETs foreign servers' https://service/<authorid: UUID>/friends/<authorid2:: URL> endpoint to retrieve latest 
- friendship status (if given author has foreign friends)
-"""
-
-
-def invalidate_friends(host, user_id):
-    author_id = url_regex.sub('', user_id)
-    author_id = author_id.rstrip("/")
-    if not Friend.objects.filter(author_id=author_id).exists():
-        return
-    friends = Friend.objects.filter(author_id=author_id)
-    for friend in friends:
-        splits = friend.friend_id.split("/")
-        friend_host = splits[0]
-        if host != friend_host:
-            if Node.objects.filter(pk=friend_host).exists():
-                node = Node.objects.get(foreign_server_hostname=friend_host)
-                headers = {"Content-Type": "application/json",
-                           "Accept": "application/json"}
-                url = "https://{}/friends/{}".format(
-                    friend.friend_id, author_id)
-                res = requests.get(url, headers=headers, auth=(
-                    node.username_registered_on_foreign_server, node.password_registered_on_foreign_server))
-                if res.status_code >= 200 and res.status_code < 300:
-                    res = res.json()
-                    # if they are friends
-                    pending = res.get("pending", None)
-                    if not pending and not res["friends"]:
-                        if Friend.objects.filter(author_id=author_id).filter(friend_id=friend.friend_id).exists():
-                            Friend.objects.filter(author_id=author_id).filter(
-                                friend_id=friend.friend_id).delete()
-                            Friend.objects.filter(author_id=friend.friend_id).filter(
-                                friend_id=author_id).delete()
+def fetch_foreign_post(node, post_id):
+    """
+    Fetches a single post from a foreign node and stores it
+    :return: the post, or an HttpResponse describing why it could not be fetched
+    """
+    try:
+        return refresh_foreign_post(node, post_id)
+    except requests.RequestException as e:
+        return HttpResponse(f"The foreign server {node.foreign_server_hostname} could not be reached: {e}", status=502)
+    except ValueError as e:
+        return HttpResponse(f"We attempted to grab the post from the foreign server, but could not use its response: "
+                            f"{e}", status=500)
+
 
 @login_required
 def view_post(request, post_path):
@@ -124,38 +109,25 @@ def view_post(request, post_path):
     except Node.DoesNotExist as e:
         return HttpResponse(f"No foreign server with hostname {host} is registered on our server.", status=404)
 
-    req = node.make_api_get_request(f'posts/{post_id}')
-
-    # Attempt to extract the post, theres a lot of different interpretations of the spec floating out there.
-    # Some return bare posts, some return it under a different key
-    while True:
-        try:
-            # Spec compliant
-            post = req.json()['posts'][0]
-            break
-        except:
-            pass
-        try:
-            # Bare post in proper key
-            post = req.json()['posts']
-            break
-        except:
-            pass
-        try:
-            # Incorrect key missing an s
-            post = req.json()['post']
-            break
-        except:
-            pass
-        try:
-            # Bare post
-            post = req.json()
-            break
-        except:
-            return HttpResponse("We attempted to grab the post from the foreign server, but the response was not"
-                                f"understandable. The response looks like: {req.content[:20]}",
-                                status=500)
-        break
+    # Posts are read from the database, and only fetched from the node when they are not stored or are too old to be
+    # shown without asking. Posts that are getting old are fetched again in the background.
+    stored = ForeignPost.objects.filter(id=post_id, node=node).first()
+    age = 0
+    if stored is not None:
+        age = (timezone.now() - stored.fetched_at).total_seconds()
+    if stored is not None and age < settings.FOREIGN_POST_STALE_TTL:
+        post = stored.to_api_object()
+        if age >= settings.FOREIGN_POST_FRESH_TTL:
+            schedule_foreign_post_refresh(node, post_id)
+    else:
+        post = fetch_foreign_post(node, post_id)
+        if isinstance(post, HttpResponse):
+            if stored is None:
+                return post
+            # Better an old copy than none
+            post = stored.to_api_object()
+        else:
+            age = 0
 
     # Some of the servers are incorrectly using 'content_type' instead of 'contentType'
     if 'content_type' in post and 'contentType' not in post:
@@ -167,9 +139,11 @@ def view_post(request, post_path):
         # For image posts, we create a special content for direct rendering as an image
         post['image_content_data'] = 'data:' + post['contentType'] + ',' + post['content']
 
-        return render(request, 'posts/foreign_post.html', {
+        response = render(request, 'posts/foreign_post.html', {
             'post': post
         })
+        response['Age'] = int(age)
+        return response
     except Exception as e:
         print(post)
         return HttpResponse(f"The post you are trying to view is on a foreign server, which responded unexpectedly: {post}"
@@ -203,26 +177,18 @@ def view_post_comment(request, post_path):
         return HttpResponse(f"No foreign server with hostname {host} is registered on our server.", status=404)
 
     if request.method == "GET":
-        req = node.make_api_get_request(f'posts/{post_id}/comments')
-        comments_list = []
-        for comment in req.json()["comments"]:
-            content = {
-                "author": comment["author"],
-                "content": comment["comment"],
-                "contentType": comment["contentType"],
-                "published": comment["published"],
-                "id": comment["id"]
-            }
-            comments_list.append(content)
-
-        output = {
-            "query": "comments",
-            "count": req.json()["count"],
-            "size": req.json()["size"],
-            "comments": comments_list
-        }
-
-        return JsonResponse(output)
+        try:
+            comments, age = fetch_foreign_comments(node, post_id)
+        except requests.RequestException as e:
+            return HttpResponse(f"The foreign server {host} could not be reached: {e}", status=502)
+        except ValueError as e:
+            return HttpResponse(f"The foreign server {host} responded unexpectedly: {e}", status=502)
+
+        # Seconds since the comments were fetched from the foreign server
+        output = dict(comments, age=int(age))
+        response = JsonResponse(output)
+        response['Age'] = int(age)
+        return response
 
     elif request.method == "POST" and host != settings.HOSTNAME:
         body = request.body.decode('utf-8')
@@ -232,6 +198,13 @@ def view_post_comment(request, post_path):
         # author_uid = "{}/author/{}".format(settings.HOSTNAME, comment_info["author"]["id"].replace("-", ""))
         author_uid = url_regex.sub("", comment_info["author"]["id"]).rstrip("/")
         author = Author.objects.get(uid=author_uid)
+
+        # The comment is delivered in the background. The page names each draft with an Idempotency-Key header, so
+        # submitting the same draft again does not post it twice, and the foreign server gets the same comment id
+        # every time. Without the header, submissions of the same comment published at the same time are the same.
+        draft = request.headers.get('Idempotency-Key') or comment_info['published']
+        idempotency_key = "comment:" + sha256(json.dumps(
+            [author_uid, post_path, comment_info["comment"], draft]).encode('utf-8')).hexdigest()
         output = {
             "query": "addComment",
             "post": "http://"+post_path,
@@ -240,24 +213,22 @@ def view_post_comment(request, post_path):
                 "comment": comment_info["comment"],
                 "contentType": comment_info['contentType'],
                 "published": comment_info['published'],
-                "id": str(uuid4())
+                "id": str(uuid5(NAMESPACE_URL, idempotency_key))
             }
         }
-        try:
-            node = Node.objects.get(foreign_server_hostname=host)
-        except Node.DoesNotExist as e:
-            return HttpResponse(f"No foreign server with hostname {host} is registered on our server.", status=404)
-
         api = node.foreign_server_api_location
         api = "http://{}/posts/{}/comments".format(api, post_id)
         if node.append_slash:
             api = api + "/"
-        response = requests.post(api,
-            auth=(node.username_registered_on_foreign_server, node.password_registered_on_foreign_server),
-            json=output
-        )
 
-        return HttpResponse(response.text, status=response.status_code)
+        message = outbox.send(node, "comment", api, output, idempotency_key, sender=author_uid)
+        return JsonResponse({
+            "query": "addComment",
+            "success": True,
+            "message": "Your comment will be sent to the foreign server",
+            "outbox": message.to_status_object(),
+            "status_url": reverse('outbox_message', args=[message.id])
+        }, status=202)
 
 
 @login_required